@@ -3,24 +3,36 @@ import cv2
 import csv
 import json
 import base64
+import io
 import numpy as np
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from datetime import datetime, timedelta
+from flask import Flask, Response, g, render_template, request, jsonify, session, redirect, url_for, send_file, stream_with_context
 from pyzbar.pyzbar import decode
 import os
+import hmac
+import threading
+import time
+from dataclasses import replace
 from werkzeug.security import check_password_hash, generate_password_hash
+from barcodes import InvalidBarcode, normalize_barcode
+from inventory import Book, BOOK_FIELDS
+from transactions import TRANSACTION_FIELDS, new_transaction_id
+from storage import CsvStorage, open_storage
+from exports import (csv_chunks, gzip_chunks, group_transaction_rows, json_array_chunks, ndjson_chunks,
+                     typed_transaction_row)
+from checkout import CheckoutEngine, CheckoutError
+from scanner import (DECODE_STEP_SECONDS, BarcodeDecoder, DecodeResult, FrameFilter, extract_barcode_only,
+                     frame_fingerprint, observe_decode_timings, validate_client_barcode)
+from decode_pool import DROPPED, shared_pool
+from camera import CameraManager
+from importer import ImportFileError, csv_rows, read_import, xlsx_rows
+from scan_sessions import RESULT, SCANNING, BatchScans, ScanSessions
+from metrics import REGISTRY, CallbackGauge, Counter, Histogram
+from profiler import profiler_from_env
 
 app = Flask(__name__)
 app.secret_key = 'library_secret_key_2024'  # Change this in production
 
-def extract_barcode_only(decoded_list):
-    """Return only barcodes, ignore QR codes."""
-    for code in decoded_list:
-        if code.type.upper() != "QRCODE":
-            return code.data.decode("utf-8"), code.type
-    return None, None
-
-
 # Initialize CSV files
 def init_csv_files():
     # Initialize books.csv if it doesn't exist
@@ -36,10 +48,69 @@ def init_csv_files():
             writer.writerow(['transaction_id', 'item_name', 'item_quantity', 'item_price', 'customer_name', 'date', 'processed_by'])
 
 
+# Storage backend: CSV files (default) or SQLite, chosen with LIBRARY_STORAGE
+storage = open_storage()
+checkout_engine = CheckoutEngine(storage)
+
+# Shared adaptive decoder for mobile frames and the desktop camera
+barcode_decoder = BarcodeDecoder()
+
+# Skips near-identical mobile frames and repeated reports of one barcode
+frame_filter = FrameFilter()
+
+# One capture thread per camera device, shared by all desktop scan sessions
+camera_manager = CameraManager(idle_timeout=30)
+
 # Global variables for camera scanning
-camera_active = {}
-scanning_active = {}
-scan_results = {}
+scan_threads = {}
+# Shared by all app processes so any worker can answer a result poll
+scan_sessions = ScanSessions(os.environ.get('SCAN_STATE_DB', 'scan_sessions.db'))
+# Symbols collected by batch intake bursts, in the same shared database
+batch_scans = BatchScans(os.environ.get('SCAN_STATE_DB', 'scan_sessions.db'))
+
+# Longest a long-poll /api/check_scan_result request may block
+MAX_SCAN_WAIT = 25
+
+# Metrics served by /api/metrics
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Request latency by route',
+                            ('method', 'route', 'status'))
+SCAN_FRAMES = Counter('scan_frames_total', 'Camera frames per scan session and outcome',
+                      ('session', 'outcome'), max_series=2048)
+SCAN_PATHS = Counter('scan_path_total', 'Mobile scan responses by decode path (client, fallback, server) and outcome',
+                     ('path', 'outcome'))
+CallbackGauge('camera_active_devices', 'Camera devices held open by a grab thread', lambda: camera_manager.active_devices())
+CallbackGauge('scan_threads_active', 'Desktop scan threads running',
+              lambda: sum(1 for thread in list(scan_threads.values()) if thread.is_alive()))
+
+def decode_pool_pending():
+    pool = shared_pool(start=False)
+    return pool.stats()['pending'] if pool is not None else 0
+
+CallbackGauge('decode_pool_pending', 'Frames waiting for a decode worker', decode_pool_pending)
+
+# Opt-in: PROFILE_SLOW_REQUESTS=<seconds> dumps stacks of slower requests
+profiler = profiler_from_env()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if profiler is not None:
+        profiler.start()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route, response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_profile(exc):
+    started = g.get('request_started')
+    if profiler is not None and started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        profiler.finish(f'{request.method} {route}', time.perf_counter() - started)
 
 # Barcode scanning functions (adapted from your code)
 def decode_barcode_from_image(img_data):
@@ -60,170 +131,194 @@ def decode_barcode_from_image(img_data):
         return None
 
 def continuous_scan_opencv(session_id, scan_type):
-    """Continuous barcode scanning using OpenCV with enhanced detection"""
+    """Continuous barcode scanning from the shared desktop camera feed"""
+    feed = camera_manager.acquire(0)
     try:
-        # Initialize camera
-        cap = cv2.VideoCapture(0)
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        
         print(f"🎥 Starting continuous scan for session {session_id}, type: {scan_type}")
         
-        while camera_active.get(session_id, False) and scanning_active.get(session_id, False):
-            success, img = cap.read()
-            if not success:
+        seq = 0
+        while scan_sessions.is_active(session_id):
+            seq, img = feed.wait_frame(seq, timeout=1.0)
+            if img is None:
+                if feed.error:
+                    raise RuntimeError(feed.error)
                 continue
             
-            # Try multiple preprocessing techniques for better detection
-            # 1. Try original image
-            barcodes = decode(img)
-            if barcodes:
-                barcode_data = barcodes[0].data.decode('utf-8')
-                print(f"🎯 Desktop barcode detected (original): {barcode_data}")
-                scan_results[session_id] = barcode_data
-                camera_active[session_id] = False
-                scanning_active[session_id] = False
-                cap.release()
-                return barcode_data
-            
-            # 2. Try grayscale
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            barcodes = decode(gray)
-            if barcodes:
-                barcode_data = barcodes[0].data.decode('utf-8')
-                print(f"🎯 Desktop barcode detected (grayscale): {barcode_data}")
-                scan_results[session_id] = barcode_data
-                camera_active[session_id] = False
-                scanning_active[session_id] = False
-                cap.release()
-                return barcode_data
-            
-            # 3. Try with increased contrast
-            gray_eq = cv2.equalizeHist(gray)
-            barcodes = decode(gray_eq)
-            if barcodes:
-                barcode_data = barcodes[0].data.decode('utf-8')
-                print(f"🎯 Desktop barcode detected (contrast): {barcode_data}")
-                scan_results[session_id] = barcode_data
-                camera_active[session_id] = False
-                scanning_active[session_id] = False
-                cap.release()
-                return barcode_data
-            
-            # 4. Try with thresholding
-            _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            barcodes = decode(thresh)
-            if barcodes:
-                barcode_data = barcodes[0].data.decode('utf-8')
-                print(f"🎯 Desktop barcode detected (threshold): {barcode_data}")
-                scan_results[session_id] = barcode_data
-                camera_active[session_id] = False
-                scanning_active[session_id] = False
-                cap.release()
-                return barcode_data
-            
-            # Small delay to prevent excessive CPU usage
-            import time
-            time.sleep(0.1)
+            # Adaptive cascade: this session's best preprocessing variant goes first
+            SCAN_FRAMES.inc(session_id, 'received')
+            result = barcode_decoder.decode(img, session_key=session_id, ignore_qr=False)
+            SCAN_FRAMES.inc(session_id, 'decoded' if result else 'no_barcode')
+            if result:
+                print(f"🎯 Desktop barcode detected ({result.variant}): {result.barcode}")
+                scan_sessions.publish(session_id, result.barcode)
+                return result.barcode
         
-        cap.release()
-        print(f"📹 Camera released for session {session_id}")
         return None
         
     except Exception as e:
         print(f"❌ Desktop scan error: {e}")
-        camera_active[session_id] = False
-        scanning_active[session_id] = False
+        scan_sessions.stop(session_id)
         return None
+    finally:
+        # The device itself stays open for the idle timeout so the next scan starts instantly
+        camera_manager.release(feed)
+        scan_threads.pop(session_id, None)
+        print(f"📹 Scan session {session_id} finished")
+
+def scan_session_key(scan_type):
+    """Per user, scan type and device: the decoder learns its best preprocessing order per key"""
+    return f"{session.get('user')}_{scan_type}_{request.remote_addr}"
+
+def scan_json(path, fields):
+    """Scan response tagged with the decode path it took, counted in SCAN_PATHS"""
+    if fields.get('detected'):
+        outcome = 'decoded'
+    elif 'repeat' in fields:
+        outcome = 'repeat'
+    elif 'error' in fields:
+        outcome = 'error'
+    else:
+        outcome = 'no_barcode'
+    SCAN_PATHS.inc(path, outcome)
+    fields['path'] = path
+    return jsonify(fields)
+
+def scan_encoded_frame(img_bytes, scan_type, path='server'):
+    """Decode one encoded camera frame and build the JSON scan response.
+    
+    Uses the decode worker pool when it is running, otherwise decodes
+    inline. Either way the shared decoder learns from the outcome. A frame
+    nearly identical to the session's previous one reuses its outcome.
+    path is 'fallback' for a cropped frame sent after the browser's own
+    detector missed, else 'server'.
+    """
+    session_key = scan_session_key(scan_type)
+    SCAN_FRAMES.inc(session_key, 'received')
+    
+    with DECODE_STEP_SECONDS.time('fingerprint'):
+        fingerprint = frame_fingerprint(img_bytes)
+    skip, barcode = frame_filter.check(session_key, fingerprint)
+    if skip:
+        SCAN_FRAMES.inc(session_key, 'skipped')
+        if barcode is None:
+            return scan_json(path, {'detected': False, 'barcode': None, 'skipped': True, 'continue': True})
+        return scan_frame_result(session_key, barcode, path)
+    
+    # Decode worker processes (SCAN_WORKERS), started on the first frame
+    decode_pool = shared_pool()
+    if decode_pool is not None and len(img_bytes) <= decode_pool.slot_size:
+        payload = decode_pool.decode(session_key, img_bytes, barcode_decoder.order_for(session_key))
+        if payload == DROPPED:
+            # A newer frame from this device replaced this one
+            SCAN_FRAMES.inc(session_key, 'dropped')
+            return scan_json(path, {'detected': False, 'barcode': None, 'dropped': True, 'continue': True})
+        if payload is None:
+            SCAN_FRAMES.inc(session_key, 'timeout')
+            return scan_json(path, {'detected': False, 'barcode': None, 'error': 'Decode timed out', 'continue': True})
+        observe_decode_timings(payload.get('timings', {}))
+        if 'error' in payload:
+            SCAN_FRAMES.inc(session_key, 'error')
+            return scan_json(path, {'detected': False, 'barcode': None, 'error': payload['error']})
+        result = None
+        if payload.get('barcode'):
+            result = DecodeResult(payload['barcode'], payload['code_type'], payload['variant'], payload['region'])
+        barcode_decoder.record(session_key, payload['tried'], result, payload['used_roi'])
+    else:
+        with DECODE_STEP_SECONDS.time('imdecode'):
+            img = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            SCAN_FRAMES.inc(session_key, 'error')
+            return scan_json(path, {'detected': False, 'barcode': None, 'error': 'Failed to decode image'})
+        result = barcode_decoder.decode(img, session_key)
+    
+    SCAN_FRAMES.inc(session_key, 'decoded' if result else 'no_barcode')
+    frame_filter.record(session_key, fingerprint, result.barcode if result else None)
+    if result:
+        print(f"🎯 Detected {result.code_type} ({result.variant}, {path}): {result.barcode}")
+        return scan_frame_result(session_key, result.barcode, path)
+    
+    print(f"⚪ No barcode detected in frame ({path})")
+    return scan_json(path, {'detected': False, 'barcode': None, 'continue': True})
+
+def scan_frame_result(session_key, barcode, path='server'):
+    """Report a decoded barcode, with its inventory record, unless this session just got it"""
+    if frame_filter.is_repeat(session_key, barcode):
+        return scan_json(path, {'detected': False, 'barcode': None, 'repeat': barcode, 'continue': True})
+    # Saves the client a /api/book round trip; None means not in the inventory
+    return scan_json(path, {'detected': True, 'barcode': barcode, 'success': True,
+                            'book': find_book_by_code(barcode)})
 
 def get_book_by_barcode(barcode):
-    """Get book details by barcode from CSV"""
-    try:
-        with open('books.csv', 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                if row['barcode'] == barcode:
-                    return {
-                        'barcode': row['barcode'],
-                        'name': row['name'],
-                        'price': float(row['price']),
-                        'details': row['details'],
-                        'date_added': row['date_added'],
-                        'quantity': int(row.get('quantity', 1))
-                    }
-        return None
-    except Exception as e:
-        print(f"Error reading books CSV: {e}")
-        return None
+    """Get book details by barcode from the storage backend"""
+    book = storage.get_book(barcode)
+    return book.to_dict() if book else None
+
+def find_book_by_code(code):
+    """Book details for a scanned or typed code, also found under its other ISBN/EAN forms.
+    
+    None if not catalogued.
+    """
+    book = storage.find_book(code)
+    return book.to_dict() if book else None
 
 def add_book_to_csv(barcode, name, price, details, quantity=1):
     """Add new book to CSV or update quantity if exists"""
     try:
-        existing_book = get_book_by_barcode(barcode)
-        
-        if existing_book:
-            # Book exists, update quantity
-            new_quantity = existing_book['quantity'] + quantity
-            success = update_book_quantity(barcode, new_quantity)
-            if success:
-                return True, f"Book quantity updated. New quantity: {new_quantity}"
+        with storage.transaction():
+            # Also finds the book under another form of its ISBN/EAN
+            existing_book = storage.find_book(barcode)
+            
+            if existing_book:
+                # Book exists, update quantity
+                new_quantity = existing_book.quantity + quantity
+                success = update_book_quantity(existing_book.barcode, new_quantity)
+                if success:
+                    return True, f"Book quantity updated. New quantity: {new_quantity}"
+                else:
+                    return False, "Failed to update book quantity"
             else:
-                return False, "Failed to update book quantity"
-        else:
-            # New book, add to CSV
-            with open('books.csv', 'a', newline='', encoding='utf-8') as file:
-                writer = csv.writer(file)
-                writer.writerow([barcode, name, price, details, datetime.now().isoformat(), quantity])
-            return True, f"Book added successfully with quantity: {quantity}"
+                # New book, add to storage
+                storage.add_book(Book(barcode, name, price, details, datetime.now().isoformat(), quantity))
+                return True, f"Book added successfully with quantity: {quantity}"
     except Exception as e:
         print(f"Error adding book: {e}")
         return False, f"Error: {e}"
 
+def parse_book_record(data):
+    """Validate a posted book record. Returns (Book, None) or (None, error)"""
+    if not isinstance(data, dict):
+        return None, 'Invalid book record'
+    barcode = data.get('barcode')
+    name = data.get('name')
+    price = data.get('price')
+    details = data.get('details', '')
+    quantity = data.get('quantity', 1)
+    
+    if not all([barcode, name, price]):
+        return None, 'Missing required fields'
+    
+    try:
+        price = float(price)
+        quantity = int(quantity)
+        if quantity < 1:
+            return None, 'Quantity must be at least 1'
+    except (TypeError, ValueError):
+        return None, 'Invalid price or quantity format'
+    
+    # Stored in canonical ISBN/EAN form, so every spelling of a code finds the
+    # same book; a code failing its check digit is kept as a shop code
+    barcode = normalize_barcode(str(barcode))
+    
+    return Book(barcode, name, price, details or '', datetime.now().isoformat(), quantity), None
+
 def get_all_books():
-    """Get all books from CSV"""
-    books = []
-    try:
-        with open('books.csv', 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                books.append({
-                    'barcode': row['barcode'],
-                    'name': row['name'],
-                    'price': float(row['price']),
-                    'details': row['details'],
-                    'date_added': row['date_added'],
-                    'quantity': int(row.get('quantity', 1))
-                })
-    except Exception as e:
-        print(f"Error reading books: {e}")
-    return books
+    """Get all books from the storage backend"""
+    return [book.to_dict() for book in storage.all_books()]
 
 def update_book_quantity(barcode, new_quantity):
-    """Update the quantity of a book in CSV"""
+    """Update the quantity of a book (journaled, no CSV rewrite)"""
     try:
-        books = []
-        updated = False
-        
-        # Read all books
-        with open('books.csv', 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            fieldnames = reader.fieldnames
-            for row in reader:
-                if row['barcode'] == barcode:
-                    row['quantity'] = str(new_quantity)
-                    updated = True
-                books.append(row)
-        
-        if not updated:
-            return False
-        
-        # Write back all books
-        with open('books.csv', 'w', newline='', encoding='utf-8') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(books)
-        
-        return True
+        return storage.set_quantity(barcode, new_quantity)
     except Exception as e:
         print(f"Error updating book quantity: {e}")
         return False
@@ -253,29 +348,71 @@ def reduce_book_quantity(barcode, quantity_to_reduce):
 def save_transaction(items, total, customer_name, processed_by):
     """Save transaction to CSV - one row per item for easy Excel viewing"""
     try:
-        transaction_id = datetime.now().strftime('%Y%m%d%H%M%S')
+        transaction_id = new_transaction_id()
         transaction_date = datetime.now().isoformat()
         
-        with open('transactions.csv', 'a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            
-            # Write one row per item
-            for item in items:
-                writer.writerow([
-                    transaction_id,
-                    item.get('name', 'Unknown'),
-                    item.get('quantity', 1),
-                    item.get('price', 0),
-                    customer_name,
-                    transaction_date,
-                    processed_by
-                ])
+        # Write one row per item
+        storage.append_transaction(transaction_id, items, customer_name, transaction_date, processed_by)
         
         return True, transaction_id
     except Exception as e:
         print(f"Error saving transaction: {e}")
         return False, str(e)
 
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json'
+}
+
+def stream_export(chunks, fmt, basename):
+    """Stream export chunks as a download, gzipped when ?gzip=1"""
+    filename = f'{basename}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{fmt}'
+    mimetype = EXPORT_MIMETYPES[fmt]
+    if request.args.get('gzip', '').lower() in ('1', 'true', 'yes'):
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+MAX_PAGE_SIZE = 500
+# Page size of /api/transactions when no limit is given
+DEFAULT_TRANSACTION_PAGE = 100
+
+def page_args(default_sort, default_descending, default_limit=None):
+    """Parse limit/offset/sort/order query parameters.
+    
+    limit is default_limit when not given; None means everything from
+    offset on.
+    """
+    limit = request.args.get('limit')
+    try:
+        limit = default_limit if limit is None else max(1, min(int(limit), MAX_PAGE_SIZE))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        raise ValueError('Invalid limit or offset')
+    sort = request.args.get('sort', default_sort)
+    order = request.args.get('order')
+    if order not in (None, 'asc', 'desc'):
+        raise ValueError(f'Invalid order: {order}')
+    descending = default_descending if order is None else order == 'desc'
+    return limit, offset, sort, descending
+
+def page_response(key, items, total, offset, limit):
+    """Wrap one page of results with paging metadata"""
+    next_offset = offset + len(items)
+    return {
+        key: items,
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'next_offset': next_offset if next_offset < total else None
+    }
+
 # Routes
 @app.route('/')
 def index():
@@ -309,12 +446,19 @@ def download_inventory():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
+        download_name = f'inventory_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        if not isinstance(storage, CsvStorage):
+            rows = (book.to_row() for book in storage.iter_books())
+            return stream_export(csv_chunks(BOOK_FIELDS, rows), 'csv', 'inventory')
+        
+        # Fold pending journal entries into books.csv so the export is complete
+        storage.flush()
         if os.path.exists('books.csv'):
             return send_file(
                 'books.csv',
                 mimetype='text/csv',
                 as_attachment=True,
-                download_name=f'inventory_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+                download_name=download_name
             )
         else:
             return jsonify({'error': 'Inventory file not found'}), 404
@@ -328,6 +472,10 @@ def download_transactions():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
+        if not isinstance(storage, CsvStorage):
+            rows = ([row[field] for field in TRANSACTION_FIELDS] for row in storage.iter_transaction_rows())
+            return stream_export(csv_chunks(TRANSACTION_FIELDS, rows), 'csv', 'transactions')
+        
         if not os.path.exists('transactions.csv'):
             return jsonify({'error': 'Transactions file not found'}), 404
         
@@ -343,6 +491,42 @@ def download_transactions():
         print(f"Error downloading transactions: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/export/inventory')
+def export_inventory():
+    """Stream the inventory as csv or ndjson (?format=, ?gzip=1)"""
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt == 'csv':
+        chunks = csv_chunks(BOOK_FIELDS, (book.to_row() for book in storage.iter_books()))
+    elif fmt == 'ndjson':
+        chunks = ndjson_chunks(book.to_dict() for book in storage.iter_books())
+    else:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    return stream_export(chunks, fmt, 'inventory')
+
+@app.route('/api/export/transactions')
+def export_transactions():
+    """Stream transactions as flat csv, flat ndjson or grouped json.
+    
+    Optional ?start= and ?end= (ISO dates, end exclusive) and ?gzip=1.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    fmt = request.args.get('format', 'csv')
+    rows = storage.iter_transaction_rows(request.args.get('start') or None, request.args.get('end') or None)
+    if fmt == 'csv':
+        chunks = csv_chunks(TRANSACTION_FIELDS, ([row[field] for field in TRANSACTION_FIELDS] for row in rows))
+    elif fmt == 'ndjson':
+        chunks = ndjson_chunks(typed_transaction_row(row) for row in rows)
+    elif fmt == 'json':
+        chunks = json_array_chunks('transactions', group_transaction_rows(rows))
+    else:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+    return stream_export(chunks, fmt, 'transactions')
+
 # API Routes
 @app.route('/api/start_continuous_scan', methods=['POST'])
 def start_continuous_scan():
@@ -355,14 +539,15 @@ def start_continuous_scan():
         session_id = session.get('user') + '_' + scan_type
         
         # Start continuous scanning
-        camera_active[session_id] = True
-        scanning_active[session_id] = True
+        scan_sessions.start(session_id)
         
-        # Start scanning in background thread
-        import threading
-        scan_thread = threading.Thread(target=continuous_scan_opencv, args=(session_id, scan_type))
-        scan_thread.daemon = True
-        scan_thread.start()
+        # Start scanning in background thread, unless this session already has one
+        scan_thread = scan_threads.get(session_id)
+        if scan_thread is None or not scan_thread.is_alive():
+            scan_thread = threading.Thread(target=continuous_scan_opencv, args=(session_id, scan_type))
+            scan_thread.daemon = True
+            scan_threads[session_id] = scan_thread
+            scan_thread.start()
         
         return jsonify({'success': True, 'session_id': session_id, 'message': 'Continuous scanning started'})
     
@@ -380,52 +565,70 @@ def stop_continuous_scan():
         session_id = session.get('user') + '_' + scan_type
         
         # Stop scanning
-        camera_active[session_id] = False
-        scanning_active[session_id] = False
+        scan_sessions.stop(session_id)
         
         return jsonify({'success': True, 'message': 'Scanning stopped'})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def scan_result_payload(status, barcode):
+    """Response body for a settled or still-running desktop scan"""
+    if status == RESULT:
+        return {'scanning': False, 'barcode': barcode, 'success': True,
+                'book': find_book_by_code(barcode)}
+    return {'scanning': status == SCANNING, 'barcode': None}
+
 @app.route('/api/check_scan_result', methods=['POST'])
 def check_scan_result():
+    """Desktop scan result, optionally as a long-poll.
+    
+    With {"wait": seconds} the request blocks until the barcode is decoded
+    or scanning stops (up to MAX_SCAN_WAIT). A found barcode comes with
+    its book lookup ('book' is null for unknown barcodes).
+    """
     if 'user' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         scan_type = data.get('type', 'add')
         session_id = session.get('user') + '_' + scan_type
+        wait = min(max(float(data.get('wait', 0)), 0), MAX_SCAN_WAIT)
         
-        # Check if we have a scan result
-        if session_id in scan_results:
-            barcode = scan_results[session_id]
-            
-            # Cleanup after returning result
-            if session_id in scan_results:
-                del scan_results[session_id]
-            if session_id in camera_active:
-                del camera_active[session_id]
-            if session_id in scanning_active:
-                del scanning_active[session_id]
-                
-            return jsonify({'scanning': False, 'barcode': barcode, 'success': True})
-        
-        # Check if scanning is still active
-        elif scanning_active.get(session_id, False):
-            return jsonify({'scanning': True, 'barcode': None})
-        else:
-            # Scanning stopped without result
-            if session_id in camera_active:
-                del camera_active[session_id]
-            if session_id in scanning_active:
-                del scanning_active[session_id]
-            return jsonify({'scanning': False, 'barcode': None})
+        status, barcode = scan_sessions.wait(session_id, timeout=wait)
+        return jsonify(scan_result_payload(status, barcode))
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/scan_events')
+def scan_events():
+    """Server-Sent Events stream for a desktop scan session.
+    
+    Sends one 'scan' event (barcode + book lookup) as soon as the barcode
+    is decoded, or a 'stopped' event if scanning ends without one, then
+    closes. A comment line every 15s keeps proxies from timing out.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    scan_type = request.args.get('type', 'add')
+    session_id = session.get('user') + '_' + scan_type
+    
+    def generate():
+        while True:
+            status, barcode = scan_sessions.wait(session_id, timeout=15)
+            if status == SCANNING:
+                yield ': keepalive\n\n'
+                continue
+            event = 'scan' if status == RESULT else 'stopped'
+            yield f"event: {event}\ndata: {json.dumps(scan_result_payload(status, barcode))}\n\n"
+            return
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/scan_barcode', methods=['POST'])
 def scan_barcode():
     """Scan barcode from mobile device image"""
@@ -442,114 +645,493 @@ def scan_barcode():
         
         # Decode base64 image
         img_bytes = base64.b64decode(img_data.split(',')[1])
-        img_array = np.frombuffer(img_bytes, dtype=np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            return jsonify({'detected': False, 'barcode': None, 'error': 'Failed to decode image'})
         
-        # Try multiple preprocessing techniques for better detection
-        barcodes = []
-        
-        # 1. Try original image
-        decoded = decode(img)
-        barcode_data, code_type = extract_barcode_only(decoded)
+        return scan_encoded_frame(img_bytes, scan_type, 'fallback' if data.get('fallback') else 'server')
+    
+    except Exception as e:
+        print(f"❌ Scan error: {e}")
+        return jsonify({'detected': False, 'error': str(e)}), 500
 
-        if barcode_data:
-            print(f"🎯 Detected {code_type}: {barcode_data}")
-            return jsonify({'detected': True, 'barcode': barcode_data, 'success': True})
-        else:
-            print("⚪ QR or no barcode — ignored")
+def metrics_token_ok():
+    """True if the request carries the METRICS_TOKEN bearer token (for scrapers without a login)"""
+    token = os.environ.get('METRICS_TOKEN')
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header, f'Bearer {token}')
 
-        
-        # 2. Try grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        decoded = decode(gray)
-        barcode_data, code_type = extract_barcode_only(decoded)
+@app.route('/api/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition of this process's metrics"""
+    if 'user' not in session and not metrics_token_ok():
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
-        if barcode_data:
-            print(f"🎯 Detected {code_type}: {barcode_data}")
-            return jsonify({'detected': True, 'barcode': barcode_data, 'success': True})
-        
-        # 3. Try with increased contrast
-        gray = cv2.equalizeHist(gray)
-        decoded = decode(gray)
-        barcode_data, code_type = extract_barcode_only(decoded)
+@app.route('/api/scan_stats')
+def scan_stats():
+    """Per-variant attempt and hit-rate counters of the barcode decoder"""
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    stats = barcode_decoder.stats()
+    # Reading stats must not start the pool
+    decode_pool = shared_pool(start=False)
+    if decode_pool is not None:
+        stats['pool'] = decode_pool.stats()
+    stats['frame_filter'] = frame_filter.stats()
+    return jsonify(stats)
 
-        if barcode_data:
-            print(f"🎯 Detected {code_type}: {barcode_data}")
-            return jsonify({'detected': True, 'barcode': barcode_data, 'success': True})
-        
-        # 4. Try with thresholding
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        decoded = decode(thresh)
-        barcode_data, code_type = extract_barcode_only(decoded)
+MAX_FRAME_BYTES = 8 * 1024 * 1024
+
+class UploadTooLarge(ValueError):
+    """A request body over the size limit of its endpoint"""
+
+def read_upload(limit):
+    """Read the request body, refusing more than limit bytes.
+    
+    The limit holds for chunked uploads without a Content-Length too.
+    Returns (body, form, files): a multipart/form-data body is parsed into
+    form and files, any other comes back as body. Raises UploadTooLarge.
+    """
+    if request.content_length and request.content_length > limit:
+        raise UploadTooLarge('Upload too large')
+    chunks, size = [], 0
+    while size <= limit:
+        chunk = request.stream.read(min(64 * 1024, limit + 1 - size))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    if size > limit:
+        raise UploadTooLarge('Upload too large')
+    body = b''.join(chunks)
+    if request.mimetype != 'multipart/form-data':
+        return body, {}, {}
+    _, form, files = request.make_form_data_parser().parse(
+        io.BytesIO(body), request.mimetype, len(body), request.mimetype_params)
+    return None, form, files
 
-        if barcode_data:
-            print(f"🎯 Detected {code_type}: {barcode_data}")
-            return jsonify({'detected': True, 'barcode': barcode_data, 'success': True})
+@app.route('/api/scan_frame', methods=['POST'])
+def scan_frame():
+    """Scan barcode from a raw JPEG/PNG frame.
+    
+    Accepts the encoded image as the request body (application/octet-stream
+    or image/*) or as a 'frame' file in multipart/form-data. Scan type comes
+    from ?type= or the 'type' form field. Skips the base64 + JSON round trip
+    of /api/scan_barcode. ?fallback=1 marks a cropped frame sent after the
+    browser's own detector found nothing.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        img_bytes, form, files = read_upload(MAX_FRAME_BYTES)
+    except UploadTooLarge:
+        return jsonify({'error': 'Frame too large'}), 413
+    
+    try:
+        if request.mimetype == 'multipart/form-data':
+            frame = files.get('frame')
+            if frame is None:
+                return jsonify({'error': 'No frame provided'}), 400
+            img_bytes = frame.read()
+            scan_type = form.get('type', request.args.get('type', 'add'))
+        else:
+            scan_type = request.args.get('type', 'add')
         
-        # 5. Try inverted
-        inverted = cv2.bitwise_not(thresh)
-        decoded = decode(inverted)
-        barcode_data, code_type = extract_barcode_only(decoded)
-        if barcode_data:
-            print(f"🎯 Detected {code_type}: {barcode_data}")
-            return jsonify({'detected': True, 'barcode': barcode_data, 'success': True})
+        if not img_bytes:
+            return jsonify({'error': 'No image data provided'}), 400
         
-        # No barcode found
-        print("⚪ No barcode detected in frame")
-        return jsonify({'detected': False, 'barcode': None, 'continue': True})
+        return scan_encoded_frame(img_bytes, scan_type, 'fallback' if request.args.get('fallback') else 'server')
     
     except Exception as e:
         print(f"❌ Scan error: {e}")
         return jsonify({'detected': False, 'error': str(e)}), 500
 
+@app.route('/api/scan_result', methods=['POST'])
+def scan_result():
+    """Validate and look up a barcode the browser decoded itself (BarcodeDetector).
+    
+    Takes JSON {barcode, format, type} with a BarcodeDetector format name.
+    Costs a check digit and a lookup instead of a frame decode, and
+    answers like /api/scan_frame with path 'client'.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        barcode, code_type = validate_client_barcode(data.get('barcode'), data.get('format'))
+    except ValueError as e:
+        SCAN_PATHS.inc('client', 'invalid')
+        return jsonify({'detected': False, 'barcode': None, 'error': str(e), 'path': 'client', 'continue': True}), 400
+    
+    print(f"📱 Browser detected {code_type}: {barcode}")
+    return scan_frame_result(scan_session_key(data.get('type', 'add')), barcode, 'client')
+
 @app.route('/api/books', methods=['GET', 'POST'])
 def books_api():
     if 'user' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
     if request.method == 'GET':
-        books = get_all_books()
-        return jsonify({'books': books})
-    
-    elif request.method == 'POST':
-        data = request.get_json()
-        barcode = data.get('barcode')
-        name = data.get('name')
-        price = data.get('price')
-        details = data.get('details', '')
-        quantity = data.get('quantity', 1)
-        
-        if not all([barcode, name, price]):
-            return jsonify({'error': 'Missing required fields'}), 400
+        # No paging parameters: keep returning the whole catalog
+        if not any(key in request.args for key in ('limit', 'offset', 'q', 'sort', 'order')):
+            return jsonify({'books': get_all_books()})
         
         try:
-            price = float(price)
-            quantity = int(quantity)
-            if quantity < 1:
-                return jsonify({'error': 'Quantity must be at least 1'}), 400
-        except ValueError:
-            return jsonify({'error': 'Invalid price or quantity format'}), 400
+            limit, offset, sort, descending = page_args('name', False)
+            books, total = storage.query_books(request.args.get('q', '').strip() or None,
+                                               sort, descending, offset, limit)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify(page_response('books', [book.to_dict() for book in books], total, offset, limit))
+    
+    elif request.method == 'POST':
+        book, error = parse_book_record(request.get_json())
+        if error:
+            return jsonify({'error': error}), 400
         
-        success, message = add_book_to_csv(barcode, name, price, details, quantity)
+        success, message = add_book_to_csv(book.barcode, book.name, book.price, book.details, book.quantity)
         
         if success:
             return jsonify({'success': True, 'message': message})
         else:
             return jsonify({'error': message}), 400
 
+@app.route('/api/books/search', methods=['GET'])
+def search_books():
+    """Ranked full-text search over book names and details"""
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Search query (q) is required'}), 400
+
+    try:
+        limit, offset, _, _ = page_args('name', False)
+        limit = limit or 50
+        books, total = storage.search_books(query, offset, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(page_response('books', [book.to_dict() for book in books], total, offset, limit))
+
+# Most barcodes or records accepted by one batch request
+MAX_BATCH_ITEMS = 1000
+
+@app.route('/api/books/batch_lookup', methods=['POST'])
+def batch_lookup_books():
+    """Look up many barcodes at once.
+    
+    Body: {"barcodes": [...]}. Returns one result per barcode, in order,
+    with 'book' set to null for unknown barcodes.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    barcodes = data.get('barcodes')
+    if not isinstance(barcodes, list) or not barcodes:
+        return jsonify({'error': 'barcodes must be a non-empty list'}), 400
+    if len(barcodes) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'At most {MAX_BATCH_ITEMS} barcodes per request'}), 400
+    
+    barcodes = [str(barcode) for barcode in barcodes]
+    books = storage.find_books(barcodes)
+    results = []
+    for barcode in barcodes:
+        book = books.get(barcode)
+        results.append({'barcode': barcode, 'found': book is not None,
+                        'book': book.to_dict() if book else None})
+    return jsonify({'results': results, 'found': sum(1 for result in results if result['found']),
+                    'missing': sum(1 for result in results if not result['found'])})
+
+@app.route('/api/books/bulk_upsert', methods=['POST'])
+def bulk_upsert_books():
+    """Add or restock many books in one storage pass.
+    
+    Body: {"books": [{barcode, name, price, details, quantity}, ...]}.
+    Valid records are applied together (existing barcodes get the quantity
+    added, like POST /api/books); invalid ones are reported per item and
+    skipped.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    records = data.get('books')
+    if not isinstance(records, list) or not records:
+        return jsonify({'error': 'books must be a non-empty list'}), 400
+    if len(records) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'At most {MAX_BATCH_ITEMS} books per request'}), 400
+    
+    results = [None] * len(records)
+    valid = []
+    for index, record in enumerate(records):
+        book, error = parse_book_record(record)
+        if error:
+            results[index] = {'index': index, 'barcode': record.get('barcode') if isinstance(record, dict) else None,
+                              'success': False, 'error': error}
+        else:
+            valid.append((index, book))
+    
+    try:
+        applied = storage.upsert_books([book for _, book in valid]) if valid else []
+    except Exception as e:
+        print(f"Error in bulk upsert: {e}")
+        return jsonify({'error': f'Error: {e}'}), 500
+    
+    for (index, _), (barcode, created, quantity) in zip(valid, applied):
+        results[index] = {'index': index, 'barcode': barcode, 'success': True,
+                          'status': 'added' if created else 'updated', 'quantity': quantity}
+    
+    return jsonify({'success': True, 'results': results,
+                    'added': sum(1 for result in results if result.get('status') == 'added'),
+                    'updated': sum(1 for result in results if result.get('status') == 'updated'),
+                    'failed': len(records) - len(valid)})
+
+# Frames accepted by one /api/batch_scan/frame request
+MAX_BURST_FRAMES = 10
+
+def decode_batch_frame(session_key, img_bytes):
+    """All EAN/ISBN symbols of one encoded frame as {barcode: (code_type, copies)}, or None if undecodable"""
+    decode_pool = shared_pool()
+    if decode_pool is not None and len(img_bytes) <= decode_pool.slot_size:
+        payload = decode_pool.decode(session_key, img_bytes, list(barcode_decoder.variants), collect_all=True)
+        if not isinstance(payload, dict) or 'error' in payload:
+            return None
+        observe_decode_timings(payload.get('timings', {}))
+        return payload['symbols']
+    with DECODE_STEP_SECONDS.time('imdecode'):
+        img = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    timings = {}
+    symbols = barcode_decoder.decode_all(img, timings=timings)
+    observe_decode_timings(timings)
+    return symbols
+
+class BatchTooLarge(ValueError):
+    """A batch intake commit with more books than one request may restock"""
+
+def batch_items(frames, symbols, min_hits):
+    """A batch tally's symbols with catalog lookups, in order of first sighting"""
+    symbols = [symbol for symbol in symbols if symbol[2] >= min_hits]
+    books = storage.find_books([barcode for barcode, _, _, _ in symbols])
+    items = []
+    for barcode, code_type, hits, copies in symbols:
+        book = books.get(barcode)
+        items.append({'barcode': barcode, 'code_type': code_type, 'hits': hits, 'copies': copies,
+                      'confidence': round(hits / frames, 2) if frames else 0,
+                      'found': book is not None, 'book': book.to_dict() if book else None})
+    return items
+
+def min_hits_arg(value):
+    try:
+        return max(1, int(value or 1))
+    except (TypeError, ValueError):
+        raise ValueError('min_hits must be a number')
+
+@app.route('/api/batch_scan/frame', methods=['POST'])
+def batch_scan_frame():
+    """Add a burst of frames to this device's batch intake.
+    
+    Frames are sent like /api/scan_frame: a raw JPEG/PNG body, or one or
+    more 'frame' files in multipart/form-data. Every EAN/ISBN symbol in
+    every frame is collected, not just the first. Returns the running frame
+    count and the barcodes new in this request; GET /api/batch_scan has the
+    full set.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        body, _, files = read_upload(MAX_FRAME_BYTES * MAX_BURST_FRAMES)
+    except UploadTooLarge:
+        return jsonify({'error': 'Burst too large'}), 413
+    
+    try:
+        if request.mimetype == 'multipart/form-data':
+            encoded = [frame.read() for frame in files.getlist('frame')]
+        else:
+            encoded = [body]
+        encoded = [img_bytes for img_bytes in encoded if img_bytes]
+        if not encoded:
+            return jsonify({'error': 'No image data provided'}), 400
+        if len(encoded) > MAX_BURST_FRAMES:
+            return jsonify({'error': f'At most {MAX_BURST_FRAMES} frames per request'}), 400
+        
+        session_key = scan_session_key('batch')
+        decoded = [decode_batch_frame(session_key, img_bytes) for img_bytes in encoded]
+        frames = [symbols for symbols in decoded if symbols is not None]
+        total_frames, new = batch_scans.add_frames(session_key, frames)
+        if new:
+            print(f"📦 Batch intake picked up {len(new)} new barcode(s): {', '.join(new)}")
+        
+        return jsonify({'success': True, 'frames': total_frames, 'new': new,
+                        'symbols': sum(len(symbols) for symbols in frames),
+                        'undecodable': len(decoded) - len(frames)})
+    
+    except Exception as e:
+        print(f"❌ Batch scan error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/batch_scan')
+def batch_scan_result():
+    """Distinct barcodes collected by this device's batch intake, with catalog lookups.
+    
+    Each item has the frames it was read in ('hits'), hits / frames as
+    'confidence' and the most copies seen in one frame. ?min_hits=N drops
+    reads seen in fewer than N frames.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        min_hits = min_hits_arg(request.args.get('min_hits'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    frames, symbols = batch_scans.tally(scan_session_key('batch'))
+    items = batch_items(frames, symbols, min_hits)
+    return jsonify({'frames': frames, 'items': items,
+                    'found': sum(1 for item in items if item['found']),
+                    'missing': sum(1 for item in items if not item['found'])})
+
+@app.route('/api/batch_scan/commit', methods=['POST'])
+def batch_scan_commit():
+    """Add the collected books to stock in one bulk update and end the intake.
+    
+    Body (optional): {"min_hits": N, "quantities": {barcode: n}}. Each
+    catalogued barcode gets its quantity added (default: the copies seen
+    in one frame), like POST /api/books/bulk_upsert. Barcodes not in the
+    catalog are returned as 'missing' for adding by hand. The tally is
+    consumed by the commit, so committing it again changes nothing.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    quantities = data.get('quantities') or {}
+    try:
+        min_hits = min_hits_arg(data.get('min_hits'))
+        if not isinstance(quantities, dict):
+            raise ValueError('quantities must be an object')
+        quantities = {str(barcode): int(quantity) for barcode, quantity in quantities.items()}
+        if any(quantity < 1 for quantity in quantities.values()):
+            raise ValueError('Quantities must be at least 1')
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        # The restock commits first and the tally is dropped only after it
+        # succeeded; a commit arriving meanwhile waits for the tally and
+        # then finds it gone
+        with batch_scans.take(scan_session_key('batch')) as (frames, symbols), storage.transaction():
+            items = batch_items(frames, symbols, min_hits)
+            found = [item for item in items if item['found']]
+            if len(found) > MAX_BATCH_ITEMS:
+                raise BatchTooLarge(f'At most {MAX_BATCH_ITEMS} books per request')
+            restock = [replace(Book(**item['book']), quantity=quantities.get(item['barcode'], item['copies']))
+                       for item in found]
+            applied = storage.upsert_books(restock) if restock else []
+    except BatchTooLarge as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error committing batch intake: {e}")
+        return jsonify({'error': f'Error: {e}'}), 500
+    
+    results = [{'barcode': barcode, 'success': True, 'status': 'added' if created else 'updated',
+                'added_quantity': book.quantity, 'quantity': quantity}
+               for book, (barcode, created, quantity) in zip(restock, applied)]
+    print(f"📦 Batch intake restocked {len(results)} title(s)")
+    return jsonify({'success': True, 'results': results, 'updated': len(results),
+                    'missing': [item['barcode'] for item in items if not item['found']]})
+
+@app.route('/api/batch_scan/reset', methods=['POST'])
+def batch_scan_reset():
+    """Discard this device's batch intake"""
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    batch_scans.clear(scan_session_key('batch'))
+    return jsonify({'success': True})
+
+# Per-row errors returned by one import response
+MAX_IMPORT_ERRORS = 1000
+
+@app.route('/api/books/import', methods=['POST'])
+def import_books():
+    """Import a supplier CSV or .xlsx sheet in one batched commit.
+    
+    Send the file as multipart 'file' or a raw text/csv body. Columns are
+    matched by header (barcode/ISBN, name/title, price, details, quantity).
+    Rows are validated in chunks, merged by barcode and applied with one
+    storage upsert; invalid rows are skipped and listed with their row
+    number. ?dry_run=1 validates without writing.
+    """
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('file')
+            if upload is None:
+                return jsonify({'error': 'No file provided'}), 400
+            filename = (upload.filename or '').lower()
+            if filename.endswith('.xlsx'):
+                rows = xlsx_rows(upload.stream)
+            else:
+                rows = csv_rows(upload.stream)
+        else:
+            rows = csv_rows(request.stream)
+        
+        books, errors, total = read_import(rows)
+    except ImportFileError as e:
+        return jsonify({'error': str(e)}), 400
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'error': f'Could not read file: {e}'}), 400
+    
+    added = updated = 0
+    if books and request.args.get('dry_run') != '1':
+        try:
+            for _, created, _ in storage.upsert_books(books):
+                if created:
+                    added += 1
+                else:
+                    updated += 1
+        except Exception as e:
+            print(f"Error importing books: {e}")
+            return jsonify({'error': f'Error: {e}'}), 500
+        print(f"📥 Imported {len(books)} titles from {total} rows ({len(errors)} rejected)")
+    
+    return jsonify({
+        'success': True,
+        'rows': total,
+        'titles': len(books),
+        'added': added,
+        'updated': updated,
+        'failed': len(errors),
+        'errors': errors[:MAX_IMPORT_ERRORS],
+        'errors_truncated': len(errors) > MAX_IMPORT_ERRORS
+    })
+
 @app.route('/api/book/<barcode>')
 def get_book(barcode):
     if 'user' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    book = get_book_by_barcode(barcode)
+    # Exact barcode, else its canonical ISBN/EAN form
+    book = storage.find_book(barcode)
     if book:
-        return jsonify({'book': book})
-    else:
-        return jsonify({'error': 'Book not found'}), 404
+        return jsonify({'book': book.to_dict()})
+    # Not catalogued: say so if it also fails its check digit, as a misread would
+    try:
+        normalize_barcode(barcode, strict=True)
+    except InvalidBarcode as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'error': 'Book not found'}), 404
 
 @app.route('/api/update_book_quantity', methods=['POST'])
 def update_book_quantity_api():
@@ -571,13 +1153,13 @@ def update_book_quantity_api():
         except ValueError:
             return jsonify({'error': 'Invalid quantity format'}), 400
         
-        # Check if book exists
-        book = get_book_by_barcode(barcode)
+        # Check if book exists, under this or another form of its ISBN/EAN
+        book = storage.find_book(str(barcode))
         if not book:
             return jsonify({'error': 'Book not found'}), 404
         
         # Update quantity
-        success = update_book_quantity(barcode, quantity)
+        success = update_book_quantity(book.barcode, quantity)
         
         if success:
             return jsonify({
@@ -603,30 +1185,15 @@ def delete_book_api():
         if not barcode:
             return jsonify({'error': 'Missing barcode'}), 400
         
-        # Check if book exists
-        book = get_book_by_barcode(barcode)
+        # Check if book exists, under this or another form of its ISBN/EAN
+        book = storage.find_book(str(barcode))
         if not book:
             return jsonify({'error': 'Book not found'}), 404
         
-        # Delete book from CSV
-        books = []
-        deleted = False
-        
-        with open('books.csv', 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            fieldnames = reader.fieldnames
-            for row in reader:
-                if row['barcode'] != barcode:
-                    books.append(row)
-                else:
-                    deleted = True
+        # Delete book from storage
+        deleted = storage.delete_book(book.barcode)
         
         if deleted:
-            with open('books.csv', 'w', newline='', encoding='utf-8') as file:
-                writer = csv.DictWriter(file, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(books)
-            
             return jsonify({
                 'success': True,
                 'message': 'Book deleted successfully'
@@ -655,32 +1222,20 @@ def process_bill():
         if not customer_name:
             return jsonify({'error': 'Customer name is required'}), 400
         
-        # Reduce quantity for each item in the bill
-        insufficient_items = []
-        for item in items:
-            barcode = item.get('barcode')
-            quantity = item.get('quantity', 1)
-            
-            success, message = reduce_book_quantity(barcode, quantity)
-            if not success:
-                insufficient_items.append(f"{item.get('name')}: {message}")
-        
-        if insufficient_items:
+        # Validate the whole cart, reduce stock and record the transaction in one locked pass
+        try:
+            transaction_id = checkout_engine.checkout(items, customer_name, session['user'])
+        except CheckoutError as e:
             return jsonify({
-                'error': 'Insufficient quantity for items',
-                'details': insufficient_items
+                'error': str(e),
+                'details': e.details
             }), 400
         
-        success, transaction_id = save_transaction(items, total, customer_name, session['user'])
-        
-        if success:
-            return jsonify({
-                'success': True,
-                'transaction_id': transaction_id,
-                'message': f'Transaction processed successfully for {customer_name}. ID: {transaction_id}'
-            })
-        else:
-            return jsonify({'error': f'Failed to save transaction: {transaction_id}'}), 500
+        return jsonify({
+            'success': True,
+            'transaction_id': transaction_id,
+            'message': f'Transaction processed successfully for {customer_name}. ID: {transaction_id}'
+        })
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -691,42 +1246,20 @@ def get_transactions():
         return jsonify({'error': 'Not authenticated'}), 401
     
     try:
-        # Read flattened transactions and group by transaction_id
-        transactions_dict = {}
-        
-        with open('transactions.csv', 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                trans_id = row['transaction_id']
-                
-                if trans_id not in transactions_dict:
-                    transactions_dict[trans_id] = {
-                        'id': trans_id,
-                        'customer_name': row['customer_name'],
-                        'items': [],
-                        'total': 0,
-                        'date': row['date'],
-                        'processed_by': row['processed_by']
-                    }
-                
-                # Add item to transaction
-                item_price = float(row['item_price'])
-                item_qty = int(row['item_quantity'])
-                
-                transactions_dict[trans_id]['items'].append({
-                    'name': row['item_name'],
-                    'quantity': item_qty,
-                    'price': item_price
-                })
-                
-                transactions_dict[trans_id]['total'] += item_price * item_qty
-        
-        # Convert to list and sort by date
-        transactions = list(transactions_dict.values())
-        transactions.sort(key=lambda x: x['date'], reverse=True)
-        
-        return jsonify({'transactions': transactions})
+        limit, offset, sort, descending = page_args('date', True, DEFAULT_TRANSACTION_PAGE)
         
+        # Grouped transactions come from a date-ordered index, newest first by default
+        transactions, total = storage.query_transactions(
+            request.args.get('start') or None,
+            request.args.get('end') or None,
+            request.args.get('q', '').strip() or None,
+            sort, descending, offset, limit
+        )
+        
+        return jsonify(page_response('transactions', transactions, total, offset, limit))
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error reading transactions: {e}")
         return jsonify({'error': str(e)}), 500
@@ -736,17 +1269,64 @@ def stats():
     if 'user' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    books = get_all_books()
-    total_books = len(books)
-    total_quantity = sum(book['quantity'] for book in books)
-    total_value = sum(book['price'] * book['quantity'] for book in books)
+    try:
+        top_n = max(1, min(int(request.args.get('top', 5)), 50))
+        days = max(1, min(int(request.args.get('days', 7)), 366))
+    except ValueError:
+        return jsonify({'error': 'Invalid top or days'}), 400
+    
+    # Running totals, maintained on every write
+    total_books, total_quantity, total_value = storage.inventory_totals()
+    
+    sales = storage.sales_stats()
+    today = datetime.now().date()
+    today_revenue, today_units = sales.day(today.isoformat())
+    units_per_day = {}
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        units_per_day[day] = sales.day(day)[1]
     
     return jsonify({
         'total_books': total_books,
         'total_quantity': total_quantity,
-        'total_value': total_value
+        'total_value': round(total_value, 2),
+        'today_revenue': round(today_revenue, 2),
+        'today_units': today_units,
+        'units_sold_per_day': units_per_day,
+        'top_sellers': sales.top_sellers(top_n)
     })
 
+@app.route('/api/reports/sales')
+def sales_report():
+    """Daily or monthly rollups: revenue, units, transactions, distinct customers"""
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    try:
+        period = request.args.get('period', 'day')
+        # Only the buckets between start and end (exclusive) are read
+        buckets = storage.sales_stats().rollup(
+            period,
+            request.args.get('start') or None,
+            request.args.get('end') or None
+        )
+        for bucket in buckets:
+            bucket['revenue'] = round(bucket['revenue'], 2)
+
+        return jsonify({
+            'period': period,
+            'buckets': buckets,
+            'revenue': round(sum(bucket['revenue'] for bucket in buckets), 2),
+            'units': sum(bucket['units'] for bucket in buckets),
+            'transactions': sum(bucket['transactions'] for bucket in buckets)
+        })
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error building sales report: {e}")
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     init_csv_files()
     print(" Library Inventory System Starting...")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""ISBN/EAN normalization and check digits.
+
+One book's code reaches the app in several shapes: ISBN-13 or ISBN-10,
+with or without hyphens, a UPC-A instead of its EAN-13, or with an EAN-2 /
+EAN-5 add-on (price or issue supplement) appended by the scanner.
+normalize_barcode() maps them all to one canonical key - the EAN-13.
+Codes are only converted when their check digit holds: an all-digit
+number may just as well be a shop-assigned code, so a failing one is
+kept as typed. Reads from an EAN/UPC/ISBN symbol are checked strictly
+instead, so a misread never reaches a catalog lookup. Other codes
+(Code 128 labels, ...) pass through trimmed.
+"""
+import re
+
+# Optional 'ISBN', 'ISBN-13:' ... label in front of a typed code
+_ISBN_LABEL = re.compile(r'^ISBN(?:-?1[03])?:?', re.IGNORECASE)
+_SEPARATORS = re.compile(r'[\s-]+')
+
+
+class InvalidBarcode(ValueError):
+    """An EAN/UPC/ISBN-shaped code whose check digit does not match"""
+
+
+def ean_check_digit(digits):
+    """EAN/UPC check digit for the digits before it"""
+    total = sum(int(digit) * (3 if position % 2 == 0 else 1) for position, digit in enumerate(reversed(digits)))
+    return str((10 - total % 10) % 10)
+
+
+def ean_ok(code):
+    """True if code is all digits and ends with its EAN/UPC check digit"""
+    return len(code) > 1 and code.isdigit() and ean_check_digit(code[:-1]) == code[-1]
+
+
+def isbn10_check_digit(digits):
+    """ISBN-10 check digit (0-9 or X) for the first nine digits"""
+    total = sum(int(digit) * weight for weight, digit in zip(range(10, 1, -1), digits))
+    check = (11 - total % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+
+def isbn10_to_isbn13(isbn10):
+    """The 978-prefixed ISBN-13 of a valid ISBN-10"""
+    digits = '978' + isbn10[:9]
+    return digits + ean_check_digit(digits)
+
+
+def _compact(text):
+    return _SEPARATORS.sub('', _ISBN_LABEL.sub('', text.strip()))
+
+
+def normalize_barcode(raw, strict=False):
+    """Canonical form of a scanned or typed code.
+
+    ISBN-10 -> ISBN-13, UPC-A -> EAN-13 (leading 0), EAN-13 + 2/5 digit
+    add-on -> EAN-13, separators dropped. An ISBN/EAN-shaped code that
+    fails its check digit comes back compacted, as a shop-assigned code;
+    with strict - the code was read from an EAN/UPC/ISBN symbol - it
+    raises InvalidBarcode instead. Anything else comes back trimmed but
+    otherwise unchanged.
+    """
+    text = str(raw).strip()
+    code = _compact(text)
+    length = len(code)
+    if length == 10 and code[:9].isdigit() and (code[9].isdigit() or code[9] in 'xX'):
+        if isbn10_check_digit(code) == code[9].upper():
+            return isbn10_to_isbn13(code)
+        if strict:
+            raise InvalidBarcode(f"ISBN-10 check digit mismatch: {text}")
+        return code
+    if not code.isdigit():
+        return text
+    if length in (15, 18):
+        # Add-on digits follow the 13 main ones
+        ean = code[:13]
+    elif length == 12:
+        ean = '0' + code
+    elif length in (8, 13):
+        ean = code
+    else:
+        return text
+    if ean_ok(ean):
+        return ean
+    if strict:
+        raise InvalidBarcode(f"EAN check digit mismatch: {text}")
+    return code
+
+
+def canonical_barcode(raw):
+    """normalize_barcode() for keys of stored barcodes"""
+    # Fast path: most stored barcodes are already canonical EAN-13s
+    if len(raw) == 13 and raw.isdigit() and ean_ok(raw):
+        return raw
+    return normalize_barcode(raw)
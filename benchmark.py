@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""Offline benchmark of the lookup, billing, history, stats and scan paths.
+
+Generates a synthetic library in a scratch directory - books.csv,
+transactions.csv and EAN-13 camera frames with blur, noise and rotation -
+then drives the real endpoints through the Flask test client from several
+concurrent clients and reports throughput and p50/p99 latency per
+scenario as JSON.
+
+Usage:
+    python benchmark.py [--rows 100000] [--storage csv|sqlite] [--clients 4] [--requests 400]
+                        [--scenarios lookup,bill,transactions,stats,scan] [--seed 1]
+                        [--output result.json] [--compare baseline.json] [--threshold 0.2]
+
+--rows is both the book count and the transaction row count; 1000,
+100000 and 1000000 are the reference sizes. The same --seed generates the
+same data, so results of two runs with the same settings are comparable:
+--compare prints the change per scenario against an earlier result file
+and exits with status 1 if anything got slower by more than --threshold.
+"""
+import argparse
+import base64
+import contextlib
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+
+SCENARIOS = ('lookup', 'bill', 'transactions', 'stats', 'scan')
+
+# EAN-13 digit patterns, 1 = bar. R is L inverted, G is R reversed
+_L_CODES = ['0001101', '0011001', '0010011', '0111101', '0100011',
+            '0110001', '0101111', '0111011', '0110111', '0001011']
+_R_CODES = [code.translate(str.maketrans('01', '10')) for code in _L_CODES]
+_G_CODES = [code[::-1] for code in _R_CODES]
+# The first digit is encoded in the L/G mix of the left half
+_PARITY = ['LLLLLL', 'LLGLGG', 'LLGGLG', 'LLGGGL', 'LGLLGG',
+           'LGGLLG', 'LGGGLL', 'LGLGLG', 'LGLGGL', 'LGGLGL']
+
+_TITLE_WORDS = ['river', 'night', 'garden', 'silent', 'letters', 'monsoon', 'city', 'stories', 'history',
+                'secret', 'journey', 'island', 'memory', 'children', 'light', 'ocean', 'village', 'songs',
+                'Aadujeevitham', 'Randamoozham', 'Khasakkinte', 'Itihasam', 'Balyakalasakhi', 'Naalukettu',
+                '\u0d06\u0d1f\u0d41\u0d1c\u0d40\u0d35\u0d3f\u0d24\u0d02', '\u0d2e\u0d34',
+                '\u0d15\u0d25\u0d15\u0d7e', '\u0d28\u0d3e\u0d1f\u0d4d']
+_AUTHORS = ['Benyamin', 'M. T. Vasudevan Nair', 'O. V. Vijayan', 'Vaikom Muhammad Basheer', 'Kamala Surayya',
+            'Arundhati Roy', 'Shashi Tharoor', 'K. R. Meera']
+_CUSTOMERS = ['Anil', 'Beena', 'Chandran', 'Deepa', 'Fathima', 'Gopan', 'Hari', 'Jaya', 'Latha', 'Manoj']
+
+
+def ean13_check_digit(digits):
+    """Check digit for the first 12 digits of an EAN-13"""
+    total = sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(digits))
+    return str((10 - total % 10) % 10)
+
+
+def random_isbn(rng):
+    """A valid 978-prefixed EAN-13 (ISBN-13)"""
+    digits = '978' + ''.join(rng.choice('0123456789') for _ in range(9))
+    return digits + ean13_check_digit(digits)
+
+
+def ean13_modules(code):
+    """The 95 modules of an EAN-13 as a '0'/'1' string"""
+    parity = _PARITY[int(code[0])]
+    left = ''.join((_L_CODES if kind == 'L' else _G_CODES)[int(digit)] for kind, digit in zip(parity, code[1:7]))
+    right = ''.join(_R_CODES[int(digit)] for digit in code[7:])
+    return '101' + left + '01010' + right + '101'
+
+
+def barcode_frame(code, rng, width=640, height=480):
+    """JPEG camera frame of an EAN-13, randomly scaled, rotated, blurred and noised.
+
+    Returns (jpeg bytes, the distortions used).
+    """
+    module = rng.randint(2, 4)
+    bars = np.array([0 if bit == '1' else 255 for bit in ean13_modules(code)], dtype=np.uint8)
+    # Quiet zone of 10 modules either side
+    row = np.concatenate([np.full(10, 255, np.uint8), bars, np.full(10, 255, np.uint8)])
+    symbol = np.tile(np.repeat(row, module), (rng.randint(20, 35) * module, 1))
+
+    frame = np.full((height, width), rng.randint(150, 220), np.uint8)
+    top = rng.randint(0, height - symbol.shape[0])
+    left = rng.randint(0, width - symbol.shape[1])
+    frame[top:top + symbol.shape[0], left:left + symbol.shape[1]] = symbol
+
+    angle = rng.uniform(-15, 15)
+    center = (left + symbol.shape[1] / 2, top + symbol.shape[0] / 2)
+    frame = cv2.warpAffine(frame, cv2.getRotationMatrix2D(center, angle, 1.0), (width, height),
+                           borderMode=cv2.BORDER_REPLICATE)
+    blur = rng.choice([1, 3, 5])
+    if blur > 1:
+        frame = cv2.GaussianBlur(frame, (blur, blur), 0)
+    noise = rng.uniform(0, 12)
+    noisy = frame.astype(np.float32) + np.random.default_rng(rng.randrange(2 ** 32)).normal(0, noise, frame.shape)
+    frame = np.clip(noisy, 0, 255).astype(np.uint8)
+
+    ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        raise RuntimeError(f"Could not encode a frame for {code}")
+    return encoded.tobytes(), {'module_px': module, 'angle': round(angle, 1), 'blur': blur, 'noise': round(noise, 1)}
+
+
+def generate_books(path, count, rng):
+    """Write a books.csv of count books. Returns [(barcode, name, price)]"""
+    books = []
+    seen = set()
+    added = datetime(2024, 1, 1)
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['barcode', 'name', 'price', 'details', 'date_added', 'quantity'])
+        while len(books) < count:
+            barcode = random_isbn(rng)
+            if barcode in seen:
+                continue
+            seen.add(barcode)
+            name = ' '.join(rng.choice(_TITLE_WORDS) for _ in range(rng.randint(1, 4))).title()
+            price = float(rng.choice([99, 150, 199, 250, 299, 350, 450, 599, 799]))
+            details = f"by {rng.choice(_AUTHORS)}" if rng.random() < 0.7 else ''
+            writer.writerow([barcode, name, price, details,
+                             (added + timedelta(minutes=len(books))).isoformat(), rng.randint(1000, 5000)])
+            books.append((barcode, name, price))
+    return books
+
+
+def generate_transactions(path, count, books, rng, days=365):
+    """Write a transactions.csv of count item rows spread over the last days, oldest first"""
+    now = datetime.now()
+    # Bills hold two items on average
+    step = timedelta(days=days) / max(1, count // 2)
+    moment = now - timedelta(days=days)
+    written = 0
+    sequence = 0
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['transaction_id', 'item_name', 'item_quantity', 'item_price',
+                         'customer_name', 'date', 'processed_by'])
+        while written < count:
+            moment = min(moment + step, now)
+            sequence += 1
+            # Same shape as new_transaction_id(), with process ID 0
+            transaction_id = f"{moment.strftime('%Y%m%d%H%M%S')}{moment.microsecond // 1000:03d}-000000-{sequence % 10000:04d}"
+            customer = rng.choice(_CUSTOMERS)
+            for _ in range(min(rng.randint(1, 3), count - written)):
+                _, name, price = rng.choice(books)
+                writer.writerow([transaction_id, name, rng.randint(1, 3), price, customer, moment.isoformat(), 'admin'])
+                written += 1
+
+
+class Scenario:
+    """One benchmarked request type: request(client, rng) returns a response"""
+
+    def __init__(self, name, request, ok_status=200, check=None):
+        self.name = name
+        self.request = request
+        self.ok_status = ok_status
+        # Optional response -> extra counter name (e.g. 'decoded')
+        self.check = check
+
+
+def build_scenarios(books, frames):
+    """The scenarios, closing over the generated books and frames"""
+    # Encoded once so the client side costs nothing per request
+    images = [f"data:image/jpeg;base64,{base64.b64encode(jpeg).decode('ascii')}" for jpeg, _ in frames]
+    months = sorted({(datetime.now() - timedelta(days=30 * back)).strftime('%Y-%m') for back in range(12)})
+
+    def lookup(client, rng):
+        return client.get(f'/api/book/{rng.choice(books)[0]}')
+
+    def bill(client, rng):
+        items = [{'barcode': barcode, 'name': name, 'price': price, 'quantity': 1}
+                 for barcode, name, price in rng.sample(books, min(len(books), rng.randint(1, 3)))]
+        return client.post('/api/process_bill', json={
+            'items': items,
+            'total': sum(item['price'] for item in items),
+            'customer_name': rng.choice(_CUSTOMERS)
+        })
+
+    def transactions(client, rng):
+        # Mostly the first pages, sometimes one month
+        if rng.random() < 0.2:
+            month = rng.choice(months)
+            return client.get(f'/api/transactions?limit=20&start={month}-01&end={month}-28')
+        return client.get(f'/api/transactions?limit=20&offset={20 * rng.randint(0, 4)}')
+
+    def stats(client, rng):
+        return client.get('/api/stats')
+
+    def scan(client, rng):
+        return client.post('/api/scan_barcode', json={'image': rng.choice(images), 'type': 'add'})
+
+    def scan_check(response):
+        return 'decoded' if (response.get_json() or {}).get('detected') else None
+
+    return {
+        'lookup': Scenario('lookup', lookup),
+        'bill': Scenario('bill', bill),
+        'transactions': Scenario('transactions', transactions),
+        'stats': Scenario('stats', stats),
+        'scan': Scenario('scan', scan, check=scan_check),
+    }
+
+
+def logged_in_client(flask_app, number):
+    """Test client with an admin session and its own address (per-device scan state)"""
+    client = flask_app.test_client()
+    client.environ_base['REMOTE_ADDR'] = f'10.0.{number // 256}.{number % 256}'
+    with client.session_transaction() as sess:
+        sess['user'] = 'admin'
+    return client
+
+
+def percentiles(latencies):
+    """Latency summary in milliseconds"""
+    values = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {'mean_ms': round(float(values.mean()), 3), 'p50_ms': round(float(p50), 3),
+            'p90_ms': round(float(p90), 3), 'p99_ms': round(float(p99), 3), 'max_ms': round(float(values.max()), 3)}
+
+
+def run_scenario(flask_app, scenario, clients, requests, seed):
+    """Run requests calls of a scenario split over concurrent clients"""
+    # The first call pays for cold caches and lazy indexes; report it on its own
+    started = time.perf_counter()
+    scenario.request(logged_in_client(flask_app, 0), random.Random(seed))
+    first_ms = (time.perf_counter() - started) * 1000
+
+    latencies = []
+    errors = {}
+    extras = {}
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients + 1)
+
+    def worker(number, calls):
+        client = logged_in_client(flask_app, number + 1)
+        rng = random.Random(seed * 1000 + number + 1)
+        mine = []
+        barrier.wait()
+        for _ in range(calls):
+            call_started = time.perf_counter()
+            response = scenario.request(client, rng)
+            mine.append(time.perf_counter() - call_started)
+            with lock:
+                if response.status_code != scenario.ok_status:
+                    errors[response.status_code] = errors.get(response.status_code, 0) + 1
+                elif scenario.check:
+                    extra = scenario.check(response)
+                    if extra:
+                        extras[extra] = extras.get(extra, 0) + 1
+        with lock:
+            latencies.extend(mine)
+
+    shares = [requests // clients + (1 if number < requests % clients else 0) for number in range(clients)]
+    threads = [threading.Thread(target=worker, args=(number, share)) for number, share in enumerate(shares)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    result = {'requests': len(latencies), 'errors': sum(errors.values()),
+              'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+              'first_request_ms': round(first_ms, 3)}
+    result.update(percentiles(latencies))
+    if errors:
+        result['error_statuses'] = {str(status): count for status, count in sorted(errors.items())}
+    result.update(extras)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def log(message):
+    # Progress goes to stderr so stdout stays clean JSON
+    print(message, file=sys.stderr, flush=True)
+
+
+def run(args, workdir):
+    rng = random.Random(args.seed)
+    setup = {}
+
+    started = time.perf_counter()
+    books = generate_books(os.path.join(workdir, 'books.csv'), args.rows, rng)
+    setup['generate_books'] = time.perf_counter() - started
+    log(f"📚 Generated {len(books)} books")
+
+    started = time.perf_counter()
+    generate_transactions(os.path.join(workdir, 'transactions.csv'), args.rows, books, rng)
+    setup['generate_transactions'] = time.perf_counter() - started
+    log(f"🧾 Generated {args.rows} transaction rows")
+
+    started = time.perf_counter()
+    frames = [barcode_frame(barcode, rng) for barcode, _, _ in rng.sample(books, min(len(books), args.frames))]
+    setup['generate_frames'] = time.perf_counter() - started
+    log(f"📷 Generated {len(frames)} barcode frames")
+
+    os.chdir(workdir)
+    os.environ['LIBRARY_STORAGE'] = args.storage
+    os.environ['LIBRARY_DB'] = 'library.db'
+    if args.scan_workers is not None:
+        os.environ['SCAN_WORKERS'] = str(args.scan_workers)
+    if args.storage == 'sqlite':
+        from migrate_to_sqlite import migrate
+        started = time.perf_counter()
+        migrate('books.csv', 'transactions.csv', 'library.db')
+        setup['import_sqlite'] = time.perf_counter() - started
+        log("🗄️ Imported into SQLite")
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with quiet:
+        started = time.perf_counter()
+        import app as library_app
+        setup['app_start'] = time.perf_counter() - started
+
+        scenarios = build_scenarios(books, frames)
+        results = {}
+        for name in args.scenarios:
+            log(f"⏱️ {name}: {args.requests} requests from {args.clients} clients")
+            results[name] = run_scenario(library_app.app, scenarios[name], args.clients, args.requests, args.seed)
+
+    return {
+        'format': 1,
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'config': {'rows': args.rows, 'storage': args.storage, 'clients': args.clients, 'requests': args.requests,
+                   'frames': len(frames), 'seed': args.seed, 'scan_workers': os.environ.get('SCAN_WORKERS')},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'opencv': cv2.__version__, 'commit': git_commit()},
+        'setup_seconds': {step: round(seconds, 3) for step, seconds in setup.items()},
+        'scenarios': results,
+    }
+
+
+def compare(result, baseline, threshold):
+    """Print per-scenario changes against a baseline result. Returns the regressions"""
+    config_keys = ('rows', 'storage', 'clients', 'requests', 'seed')
+    mismatched = [key for key in config_keys if result['config'].get(key) != baseline['config'].get(key)]
+    if mismatched:
+        log(f"⚠️ Baseline was run with different {', '.join(mismatched)}; numbers may not be comparable")
+
+    regressions = []
+    for name, current in result['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before:
+            continue
+        # (metric, True if bigger is worse)
+        for metric, worse_up in (('p50_ms', True), ('p99_ms', True), ('throughput_rps', False)):
+            old, new = before.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change > threshold if worse_up else change < -threshold
+            if regressed:
+                regressions.append(f'{name} {metric}')
+            log(f"{'❌' if regressed else '  '} {name:<13}{metric:<15}{old:>11.2f} -> {new:>11.2f}  ({change:+.0%})")
+        if current['errors'] > before.get('errors', 0):
+            regressions.append(f'{name} errors')
+            log(f"❌ {name:<13}{'errors':<15}{before.get('errors', 0):>11} -> {current['errors']:>11}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the app on synthetic data through the Flask test client')
+    parser.add_argument('--rows', type=int, default=100000, help='books and transaction rows to generate')
+    parser.add_argument('--storage', choices=['csv', 'sqlite'], default='csv')
+    parser.add_argument('--clients', type=int, default=4, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=400, help='requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated subset to run')
+    parser.add_argument('--frames', type=int, default=50, help='distinct barcode frames for the scan scenario')
+    parser.add_argument('--scan-workers', type=int, help='SCAN_WORKERS for the app (default: its own default)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', help='empty directory for the generated data (default: a temporary one)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated data')
+    parser.add_argument('--output', help='write the JSON result here instead of stdout')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative change counted as a regression')
+    parser.add_argument('--verbose', action='store_true', help="show the app's own log output")
+    args = parser.parse_args()
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    if args.rows < 1 or args.clients < 1 or args.requests < 1:
+        parser.error('--rows, --clients and --requests must be positive')
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+    output = os.path.abspath(args.output) if args.output else None
+
+    if args.workdir:
+        workdir = os.path.abspath(args.workdir)
+        os.makedirs(workdir, exist_ok=True)
+        if os.listdir(workdir):
+            parser.error(f"{workdir} is not empty")
+    else:
+        workdir = tempfile.mkdtemp(prefix='library-bench-')
+
+    try:
+        result = run(args, workdir)
+    finally:
+        if args.keep or args.workdir:
+            log(f"📁 Data kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if output:
+        with open(output, 'w', encoding='utf-8') as file:
+            file.write(text + '\n')
+        log(f"✅ Results written to {output}")
+    else:
+        print(text)
+
+    if baseline is not None:
+        regressions = compare(result, baseline, args.threshold)
+        if regressions:
+            log(f"❌ {len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+        log("✅ No regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Shared camera access for desktop scanning.
+
+Each device is opened once by a CameraFeed whose grab thread publishes
+frames into a small ring buffer. Scan sessions subscribe to the feed
+instead of opening the device themselves; the device is released once no
+session has used it for idle_timeout seconds.
+"""
+import threading
+import time
+from collections import deque
+
+import cv2
+
+
+class CameraFeed:
+    """One opened capture device and its grab thread"""
+
+    def __init__(self, device=0, width=640, height=480, buffer_size=4, idle_timeout=30.0):
+        self.device = device
+        self.width = width
+        self.height = height
+        self.idle_timeout = idle_timeout
+        self._frames = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._subscribers = 0
+        self._last_used = time.monotonic()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self.error = None
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            previous = self._thread
+        if previous is not None:
+            # Let a grab thread that just went idle finish releasing the device
+            previous.join(timeout=2)
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self.error = None
+            self._thread = threading.Thread(target=self._grab_loop, daemon=True)
+            self._thread.start()
+
+    def subscribe(self):
+        with self._cond:
+            self._subscribers += 1
+            self._last_used = time.monotonic()
+        self.start()
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers = max(0, self._subscribers - 1)
+            self._last_used = time.monotonic()
+
+    def wait_frame(self, after_seq=0, timeout=1.0):
+        """Return (seq, frame) for the newest frame newer than after_seq,
+        or (after_seq, None) if none arrived within timeout"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._frames or self._frames[-1][0] <= after_seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._running:
+                    return after_seq, None
+                self._cond.wait(remaining)
+            self._last_used = time.monotonic()
+            return self._frames[-1]
+
+    def _grab_loop(self):
+        cap = None
+        try:
+            cap = cv2.VideoCapture(self.device)
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+            if not cap.isOpened():
+                raise RuntimeError(f"Could not open camera {self.device}")
+            print(f"🎥 Camera {self.device} opened")
+
+            while True:
+                with self._cond:
+                    idle = time.monotonic() - self._last_used
+                    if self._subscribers == 0 and idle > self.idle_timeout:
+                        self._running = False
+                        break
+                success, img = cap.read()
+                if not success:
+                    time.sleep(0.01)
+                    continue
+                with self._cond:
+                    self._seq += 1
+                    self._frames.append((self._seq, img))
+                    self._cond.notify_all()
+        except Exception as e:
+            print(f"❌ Camera {self.device} error: {e}")
+            self.error = str(e)
+        finally:
+            if cap is not None:
+                cap.release()
+            with self._cond:
+                self._running = False
+                self._frames.clear()
+                self._cond.notify_all()
+            print(f"📹 Camera {self.device} released")
+
+
+class CameraManager:
+    """Hands out one shared CameraFeed per device"""
+
+    def __init__(self, idle_timeout=30.0):
+        self.idle_timeout = idle_timeout
+        self._feeds = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, device=0):
+        """Subscribe to a device's feed, opening it if needed"""
+        with self._lock:
+            feed = self._feeds.get(device)
+            if feed is None:
+                feed = CameraFeed(device, idle_timeout=self.idle_timeout)
+                self._feeds[device] = feed
+            feed.subscribe()
+        return feed
+
+    def release(self, feed):
+        feed.unsubscribe()
+
+    def active_devices(self):
+        """Number of devices currently held open by a grab thread"""
+        with self._lock:
+            return sum(1 for feed in self._feeds.values() if feed.running)
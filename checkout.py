@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Transactional multi-item checkout"""
+from datetime import datetime
+
+from transactions import new_transaction_id
+
+
+class CheckoutError(Exception):
+    """Raised when a cart cannot be billed; nothing has been changed"""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details or []
+
+
+class CheckoutEngine:
+    """Validates and applies a whole cart in a single locked pass.
+
+    Stock for every line is checked before anything is written. The stock
+    decrements and the matching transaction rows are then written inside one
+    storage transaction (the inventory lock for CSV, BEGIN IMMEDIATE for
+    SQLite) so concurrent tills cannot interleave.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def checkout(self, items, customer_name, processed_by):
+        """Bill a cart. Returns the transaction ID or raises CheckoutError"""
+        with self.storage.transaction():
+            new_quantities = self._validate(items)
+
+            transaction_id = new_transaction_id()
+            transaction_date = datetime.now().isoformat()
+
+            self.storage.set_quantities(new_quantities)
+            try:
+                self.storage.append_transaction(transaction_id, items, customer_name, transaction_date, processed_by)
+            except Exception:
+                # Put the stock back so inventory and history stay consistent
+                self.storage.set_quantities({
+                    barcode: quantity + self._requested(items, barcode)
+                    for barcode, quantity in new_quantities.items()
+                })
+                raise
+            return transaction_id
+
+    def _validate(self, items):
+        """Return barcode -> remaining quantity, or raise with every problem"""
+        errors = []
+        requested = {}
+        for item in items:
+            barcode = item.get('barcode')
+            try:
+                quantity = int(item.get('quantity', 1))
+            except (TypeError, ValueError):
+                errors.append(f"{item.get('name')}: Invalid quantity")
+                continue
+            if quantity < 1:
+                errors.append(f"{item.get('name')}: Quantity must be at least 1")
+                continue
+            requested[barcode] = requested.get(barcode, 0) + quantity
+
+        remaining = {}
+        checked = set()
+        for item in items:
+            barcode = item.get('barcode')
+            if barcode not in requested or barcode in checked:
+                continue
+            checked.add(barcode)
+            book = self.storage.get_book(barcode)
+            if not book:
+                errors.append(f"{item.get('name')}: Book not found")
+                continue
+            if book.quantity < requested[barcode]:
+                errors.append(f"{item.get('name')}: Insufficient quantity. Available: {book.quantity}")
+                continue
+            remaining[barcode] = book.quantity - requested[barcode]
+
+        if errors:
+            raise CheckoutError('Insufficient quantity for items', errors)
+        return remaining
+
+    @staticmethod
+    def _requested(items, barcode):
+        return sum(int(item.get('quantity', 1)) for item in items if item.get('barcode') == barcode)
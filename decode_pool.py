@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""Process pool for barcode decoding.
+
+Encoded frames are copied once into preallocated shared-memory slots and
+decoded (cv2.imdecode + the scanner cascade) in worker processes, so
+OpenCV/pyzbar work neither blocks Flask request threads nor competes for
+the GIL. Each session keeps at most one frame waiting: a newer frame
+replaces a waiting one, whose caller gets a 'dropped' answer.
+
+Workers are started through a forkserver: a single-threaded process
+forks them, so they never inherit locks that request threads held at
+the time. shared_pool() starts the pool on first use in each process, so
+a server that forks its workers after importing the app (gunicorn
+--preload) gives every worker its own pool. Where the forkserver start
+method is unavailable the pool is disabled and frames decode inline.
+"""
+import atexit
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+DROPPED = 'dropped'
+
+START_METHOD = 'forkserver'
+
+
+def _worker_main(slot_names, conn):
+    """Worker process loop: decode frames referenced by slot index"""
+    import cv2
+    import numpy as np
+    from scanner import BarcodeDecoder
+
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    decoder = BarcodeDecoder()
+    try:
+        while True:
+            try:
+                task = conn.recv()
+            except EOFError:
+                break
+            if task is None:
+                break
+            job_id, slot, size, order, ignore_qr, collect_all = task
+            payload = None
+            try:
+                # Zero-copy view of the encoded bytes in shared memory
+                encoded = np.ndarray((size,), dtype=np.uint8, buffer=slots[slot].buf)
+                started = time.perf_counter()
+                img = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+                # Step timings travel back with the payload: metrics live in the parent
+                timings = {'imdecode': time.perf_counter() - started}
+                del encoded
+                if img is None:
+                    payload = {'error': 'Failed to decode image'}
+                elif collect_all:
+                    payload = {'symbols': decoder.decode_all(img, order, timings), 'timings': timings}
+                else:
+                    result, tried, used_roi = decoder.run(img, order, ignore_qr, timings)
+                    payload = {'tried': tried, 'used_roi': used_roi, 'timings': timings}
+                    if result:
+                        payload.update(barcode=result.barcode, code_type=result.code_type,
+                                       variant=result.variant, region=result.region)
+            except Exception as e:
+                payload = {'error': str(e)}
+            conn.send((job_id, slot, payload))
+    finally:
+        for shm in slots:
+            shm.close()
+
+
+class _Job:
+    def __init__(self, job_id, session_key, data, order, ignore_qr, collect_all):
+        self.id = job_id
+        self.session_key = session_key
+        self.data = data
+        self.order = order
+        self.ignore_qr = ignore_qr
+        self.collect_all = collect_all
+        self.result = None
+        self.done = threading.Event()
+
+    def finish(self, result):
+        self.data = None
+        self.result = result
+        self.done.set()
+
+
+class DecodePool:
+    """Bounded pool of decode worker processes fed through shared memory.
+
+    Each worker owns slots_per_worker slots and talks to the pool over its
+    own pipe, so a worker that dies (a crash in zbar, the OOM killer)
+    cannot wedge the others. Its death is noticed within check_interval
+    seconds: the frames it held fail with an error, its slots are freed
+    and a replacement is started.
+    """
+
+    def __init__(self, workers, slot_size=8 * 1024 * 1024, slots_per_worker=2, check_interval=0.5):
+        self.workers = workers
+        self.slot_size = slot_size
+        self.slots_per_worker = slots_per_worker
+        self.check_interval = check_interval
+        # Only the creating process owns the workers and shared memory
+        self._pid = os.getpid()
+        self._ctx = multiprocessing.get_context(START_METHOD)
+        # Imported once in the forkserver instead of in every new worker
+        self._ctx.set_forkserver_preload(['decode_pool', 'scanner'])
+        self._slots = [shared_memory.SharedMemory(create=True, size=slot_size)
+                       for _ in range(workers * slots_per_worker)]
+        self._slot_names = [shm.name for shm in self._slots]
+        self._free_slots = list(range(len(self._slots)))
+        # Job ID each in-flight slot holds
+        self._slot_jobs = {}
+        self._pending = OrderedDict()
+        self._in_flight = {}
+        self._ids = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+        self.completed = 0
+        self.restarts = 0
+
+        # (process, pipe end) per worker
+        self._workers = [self._start_worker() for _ in range(workers)]
+
+        threading.Thread(target=self._dispatch_loop, daemon=True).start()
+        threading.Thread(target=self._result_loop, daemon=True).start()
+        atexit.register(self.close)
+
+    def _start_worker(self):
+        conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, args=(self._slot_names, child_conn), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, conn
+
+    def decode(self, session_key, data, order, ignore_qr=True, timeout=5.0, collect_all=False):
+        """Decode encoded image bytes for a session.
+
+        Returns the worker payload dict, DROPPED if a newer frame from the
+        same session superseded this one, or None on timeout. With
+        collect_all the payload holds 'symbols' from
+        BarcodeDecoder.decode_all() instead of a single result.
+        """
+        if len(data) > self.slot_size:
+            raise ValueError('Frame too large for decode slot')
+        with self._cond:
+            job = _Job(next(self._ids), session_key, data, order, ignore_qr, collect_all)
+            stale = self._pending.pop(session_key, None)
+            if stale is not None:
+                self.dropped += 1
+                stale.finish(DROPPED)
+            self._pending[session_key] = job
+            self._cond.notify_all()
+        if not job.done.wait(timeout):
+            with self._cond:
+                if self._pending.get(session_key) is job:
+                    del self._pending[session_key]
+            return None
+        return job.result
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'pending': len(self._pending),
+                'in_flight': len(self._in_flight),
+                'completed': self.completed,
+                'dropped': self.dropped,
+                'restarts': self.restarts
+            }
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and not (self._pending and self._free_slots):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # Oldest waiting session first
+                _, job = self._pending.popitem(last=False)
+                slot = self._free_slots.pop()
+                self._in_flight[job.id] = job
+                self._slot_jobs[slot] = job.id
+                # Copied and sent under the lock so a worker restart cannot
+                # hand the slot to another job in between
+                size = len(job.data)
+                self._slots[slot].buf[:size] = job.data
+                job.data = None
+                _, conn = self._workers[slot // self.slots_per_worker]
+                try:
+                    conn.send((job.id, slot, size, job.order, job.ignore_qr, job.collect_all))
+                except OSError:
+                    # The worker is gone; its restart fails the job
+                    pass
+
+    def _result_loop(self):
+        while not self._closed:
+            with self._cond:
+                workers = list(self._workers)
+            ready = wait([conn for _, conn in workers] + [process.sentinel for process, _ in workers],
+                         self.check_interval)
+            for index, (process, conn) in enumerate(workers):
+                try:
+                    while conn.poll():
+                        self._finish(*conn.recv())
+                except (EOFError, OSError):
+                    pass
+                if process.sentinel in ready:
+                    self._restart_worker(index, process)
+
+    def _finish(self, job_id, slot, payload):
+        with self._cond:
+            # A late result from a replaced worker no longer owns the slot
+            if self._slot_jobs.get(slot) == job_id:
+                del self._slot_jobs[slot]
+                self._free_slots.append(slot)
+            job = self._in_flight.pop(job_id, None)
+            self.completed += 1
+            self._cond.notify_all()
+        if job is not None:
+            job.finish(payload)
+
+    def _restart_worker(self, index, process):
+        """Fail the frames of a dead worker, free its slots and start a replacement"""
+        with self._cond:
+            if self._closed or self._workers[index][0] is not process:
+                return
+            process.join()
+            lost = []
+            for slot in range(index * self.slots_per_worker, (index + 1) * self.slots_per_worker):
+                job_id = self._slot_jobs.pop(slot, None)
+                if job_id is None:
+                    continue
+                self._free_slots.append(slot)
+                job = self._in_flight.pop(job_id, None)
+                if job is not None:
+                    lost.append(job)
+            self._workers[index][1].close()
+            self._workers[index] = self._start_worker()
+            self.restarts += 1
+            self._cond.notify_all()
+        print(f"⚠️ Decode worker {process.pid} exited with code {process.exitcode}; "
+              f"restarted it and failed {len(lost)} frame(s)")
+        for job in lost:
+            job.finish({'error': 'Decode worker crashed'})
+
+    def close(self):
+        if os.getpid() != self._pid:
+            # A forked copy: the workers and slots belong to the parent
+            return
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        for _, conn in self._workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process, conn in self._workers:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+
+
+def pool_from_env():
+    """Start a DecodePool sized by SCAN_WORKERS (0 disables it).
+
+    Defaults to half the cores, at most 4, where a forkserver is available.
+    """
+    if START_METHOD not in multiprocessing.get_all_start_methods():
+        default = 0
+    else:
+        default = min(4, max(1, (os.cpu_count() or 2) // 2))
+    workers = int(os.environ.get('SCAN_WORKERS', default))
+    if workers <= 0:
+        return None
+    return DecodePool(workers)
+
+
+def _forget_forkserver():
+    """Drop the forkserver inherited over a fork: it is the parent's child,
+    so this process starts its own on first use"""
+    from multiprocessing import forkserver
+    server = forkserver._forkserver
+    if server._forkserver_pid is not None:
+        os.close(server._forkserver_alive_fd)
+        server._forkserver_pid = server._forkserver_alive_fd = server._forkserver_address = None
+    server._lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_forkserver)
+
+
+# Pool per process ID (None where disabled), see shared_pool()
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+
+def shared_pool(start=True):
+    """This process's DecodePool, started by the first call (None if disabled).
+
+    The pool's threads do not survive a fork, so a forked child starts its
+    own pool instead of using its parent's. With start=False returns None
+    unless the pool is already running.
+    """
+    pid = os.getpid()
+    if pid not in _shared_pools:
+        if not start:
+            return None
+        with _shared_pools_lock:
+            if pid not in _shared_pools:
+                _shared_pools[pid] = pool_from_env()
+    return _shared_pools[pid]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Streaming export encoders.
+
+Each function turns an iterable of rows into an iterable of text chunks
+so a response can start sending before the whole history has been read.
+"""
+import csv
+import io
+import json
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+
+
+def csv_chunks(header, rows):
+    """Yield CSV text in ~CHUNK_SIZE pieces"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(records):
+    """Yield one JSON object per line, batched into ~CHUNK_SIZE pieces"""
+    parts, size = [], 0
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(parts)
+            parts, size = [], 0
+    if parts:
+        yield ''.join(parts)
+
+
+def typed_transaction_row(row):
+    """Flattened transaction row with numeric quantity and price"""
+    row = dict(row)
+    row['item_quantity'] = int(row['item_quantity'])
+    row['item_price'] = float(row['item_price'])
+    return row
+
+
+def group_transaction_rows(rows):
+    """Group flattened rows into transactions without holding the history.
+
+    Rows of one transaction are written together, so a transaction is
+    complete as soon as the next ID or date shows up. Legacy IDs were
+    reused across sales, so the date is part of the key, as in the
+    transaction index and sales stats.
+    """
+    current = None
+    for row in rows:
+        trans_id = row['transaction_id']
+        if current is None or (current['id'], current['date']) != (trans_id, row['date']):
+            if current is not None:
+                yield current
+            current = {
+                'id': trans_id,
+                'customer_name': row['customer_name'],
+                'items': [],
+                'total': 0,
+                'date': row['date'],
+                'processed_by': row['processed_by']
+            }
+        item_price = float(row['item_price'])
+        item_qty = int(row['item_quantity'])
+        current['items'].append({'name': row['item_name'], 'quantity': item_qty, 'price': item_price})
+        current['total'] += item_price * item_qty
+    if current is not None:
+        yield current
+
+
+def json_array_chunks(key, records):
+    """Yield {"key": [record, ...]} incrementally"""
+    parts, size = [f'{{"{key}": ['], 0
+    first = True
+    for record in records:
+        text = ('' if first else ',') + json.dumps(record, ensure_ascii=False)
+        first = False
+        parts.append(text)
+        size += len(text)
+        if size >= CHUNK_SIZE:
+            yield ''.join(parts)
+            parts, size = [], 0
+    parts.append(']}')
+    yield ''.join(parts)
+
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Re-entrant lock shared by threads and worker processes.
+
+Threads of one process serialize on an RLock; the outermost holder also
+takes an advisory lock (fcntl.flock) on a lock file, so several app
+processes (e.g. gunicorn workers) can share the CSV files safely. Writers
+take it exclusive; readers take it shared, so reads in different processes
+only wait for writers, not for each other.
+Where fcntl is unavailable (Windows) only the thread lock is used, which
+is enough for the single-process dev server.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import FAST_BUCKETS, Histogram
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOCK_WAIT_SECONDS = Histogram('lock_wait_seconds', 'Time spent waiting to take a storage lock',
+                              ('lock',), buckets=FAST_BUCKETS + (2.5, 5.0, 10.0))
+
+
+class FileLock:
+    """Thread + process lock on path.
+
+    on_acquire runs each time the lock is taken at the outermost level,
+    after the file lock is held - the place to pick up changes that other
+    processes made while we were not holding it. The lock file also holds
+    a generation counter that holders can bump to tell other processes
+    their cached view is obsolete; file stat data is not enough for that,
+    since inodes get reused and mtimes are coarse.
+    """
+
+    def __init__(self, path, on_acquire=None):
+        self.path = path
+        self.on_acquire = on_acquire
+        self._rlock = threading.RLock()
+        self._depth = 0
+        # Whether the outermost holder took the file lock shared
+        self._shared = False
+        self._fd = None
+        self._pid = None
+
+    def _file(self):
+        # flock locks belong to the open file, which a fork shares; reopen per process
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def acquire(self, shared=False):
+        """Take the lock; shared=True lets other processes' readers hold it too.
+
+        A nested acquire gets the outermost holder's mode. Asking for
+        exclusive inside a shared hold is an error: two processes upgrading
+        at once would deadlock.
+        """
+        started = time.perf_counter()
+        self._rlock.acquire()
+        self._depth += 1
+        if self._depth > 1:
+            if self._shared and not shared:
+                self.release()
+                raise RuntimeError(f'{self.path} is held shared; take it exclusively from the start')
+            return
+        try:
+            self._shared = shared
+            if fcntl is not None:
+                fcntl.flock(self._file(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            LOCK_WAIT_SECONDS.observe(time.perf_counter() - started, os.path.basename(self.path))
+            if self.on_acquire is not None:
+                self.on_acquire()
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None and self._fd is not None and self._pid == os.getpid():
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._rlock.release()
+
+    @contextmanager
+    def shared(self):
+        """Hold the lock for reading"""
+        self.acquire(shared=True)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def generation(self):
+        """Counter kept in the lock file; read it while holding the lock"""
+        fd = self._file()
+        os.lseek(fd, 0, os.SEEK_SET)
+        data = os.read(fd, 32).strip()
+        return int(data) if data else 0
+
+    def bump_generation(self):
+        """Increment the lock file counter (hold the lock). Returns the new value"""
+        value = self.generation() + 1
+        fd = self._file()
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, str(value).encode('ascii'))
+        os.ftruncate(fd, len(str(value)))
+        return value
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
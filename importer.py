@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""Bulk inventory import from supplier CSV / Excel sheets.
+
+Rows are read in chunks; each chunk's columns are normalized and validated
+with numpy in one go, falling back to row-by-row parsing only for a chunk
+that holds bad numbers. Rows are merged by barcode (quantities summed, the
+first row's name/price/details kept) so the caller can apply everything in
+a single Storage.upsert_books() call.
+"""
+import csv
+import io
+import itertools
+import re
+from datetime import datetime
+
+import numpy as np
+
+from barcodes import normalize_barcode
+from inventory import Book
+
+# Accepted header spellings, matched case-insensitively
+COLUMN_ALIASES = {
+    'barcode': ('barcode', 'isbn', 'ean', 'isbn13', 'isbn-13', 'code'),
+    'name': ('name', 'title', 'book', 'book name'),
+    'price': ('price', 'mrp', 'rate', 'unit price'),
+    'details': ('details', 'description', 'author', 'notes'),
+    'quantity': ('quantity', 'qty', 'stock', 'copies'),
+}
+REQUIRED_COLUMNS = ('barcode', 'name', 'price')
+
+_BARCODE_SEPARATORS = re.compile(r'[\s\-]')
+# Spreadsheets turn 9781234567897 into 9781234567897.0, or into
+# 9.78123E+12 once saved as CSV - by then the digits are gone
+_FLOAT_TAIL = re.compile(r'\.0+$')
+_SCIENTIFIC = re.compile(r'^\d(\.\d+)?[eE]\+?\d+$')
+# Digit counts of ISBN-10, EAN-8, UPC-A, EAN-13 and EAN-13 with an add-on
+_EAN_LENGTHS = (8, 10, 12, 13, 15, 18)
+_PRICE_JUNK = re.compile(r'[^\d.,\-]')
+# 1,200 / 1,20,000 (Indian grouping) / 1,200.50
+_GROUPED_PRICE = re.compile(r'\d{1,3}(?:,\d{2})*,\d{3}(?:\.\d+)?')
+# 12,50 / 12,5
+_DECIMAL_COMMA_PRICE = re.compile(r'\d+,\d{1,2}')
+
+
+class ImportFileError(Exception):
+    """The upload as a whole cannot be imported (bad header, bad file)"""
+
+
+def map_columns(header):
+    """Return {field: column index} for a header row"""
+    normalized = [str(cell or '').strip().lower() for cell in header]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for index, name in enumerate(normalized):
+            if name in aliases:
+                columns[field] = index
+                break
+    missing = [field for field in REQUIRED_COLUMNS if field not in columns]
+    if missing:
+        raise ImportFileError(f"Missing required columns: {', '.join(missing)}")
+    return columns
+
+
+def csv_rows(stream, encoding='utf-8-sig'):
+    """Yield rows (lists) from a binary CSV stream without reading it all"""
+    text = io.TextIOWrapper(stream, encoding=encoding, newline='')
+    try:
+        yield from csv.reader(text)
+    finally:
+        text.detach()
+
+
+def xlsx_rows(stream):
+    """Yield rows from the first sheet of an .xlsx workbook (needs openpyxl)"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError('Excel import needs openpyxl (pip install openpyxl); upload a CSV instead')
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield ['' if cell is None else cell for cell in row]
+    finally:
+        workbook.close()
+
+
+def _barcode_cell(value):
+    """(canonical barcode, error message or None) for an import cell.
+
+    Undoes spreadsheet number formatting, then normalize_barcode(). A
+    value in scientific notation and a hyphenated number that is no
+    ISBN/EAN are errors: the spreadsheet lost or split its digits.
+    """
+    value = _FLOAT_TAIL.sub('', value)
+    if _SCIENTIFIC.match(value):
+        return value, 'Barcode in scientific notation lost its digits; format the column as text'
+    compact = _BARCODE_SEPARATORS.sub('', value)
+    if compact != value and compact.isdigit() and len(compact) not in _EAN_LENGTHS:
+        return value, f'Not an ISBN/EAN: {value}'
+    return (normalize_barcode(value) if value else ''), None
+
+
+def _price_text(value):
+    """Number part of a price cell: 'Rs. 1,200' -> '1200', '12,50' -> '12.50'.
+
+    Other uses of a comma are ambiguous and come back unparseable.
+    """
+    number = _PRICE_JUNK.sub('', value).lstrip('.')
+    if ',' not in number:
+        return number
+    if _GROUPED_PRICE.fullmatch(number):
+        return number.replace(',', '')
+    if _DECIMAL_COMMA_PRICE.fullmatch(number):
+        return number.replace(',', '.')
+    return 'ambiguous'
+
+
+def _column(chunk, index):
+    if index is None:
+        return [''] * len(chunk)
+    return [str(row[index]).strip() if index < len(row) and row[index] is not None else '' for row in chunk]
+
+
+def _to_numbers(values):
+    """Vectorized float conversion; None if any value does not parse"""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except ValueError:
+        return None
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def _row_error(barcode, barcode_error, name, price, quantity):
+    if barcode_error:
+        return barcode_error
+    if not barcode:
+        return 'Missing barcode'
+    if not name:
+        return 'Missing name'
+    if not np.isfinite(price) or price < 0:
+        return 'Invalid price'
+    return 'Quantity must be a whole number of at least 1'
+
+
+def _validate_chunk(chunk, lines, columns):
+    """Normalize one chunk of rows.
+
+    Returns ((barcode, name, price, details, quantity) per valid row,
+    error dicts for the rest).
+    """
+    barcodes, barcode_errors = zip(*map(_barcode_cell, _column(chunk, columns['barcode'])))
+    names = _column(chunk, columns['name'])
+    details = _column(chunk, columns.get('details'))
+    prices_raw = [_price_text(value) for value in _column(chunk, columns['price'])]
+    quantities_raw = [value or '1' for value in _column(chunk, columns.get('quantity'))]
+
+    prices = _to_numbers(prices_raw)
+    quantities = _to_numbers(quantities_raw)
+    if prices is None or quantities is None:
+        # Bad values somewhere in the chunk: parse row by row to find them
+        prices = np.array([_parse_float(value) for value in prices_raw])
+        quantities = np.array([_parse_float(value) for value in quantities_raw])
+
+    valid = (np.array([bool(code) and error is None for code, error in zip(barcodes, barcode_errors)])
+             & np.array([bool(name) for name in names])
+             & np.isfinite(prices) & (prices >= 0)
+             & np.isfinite(quantities) & (quantities >= 1) & (quantities == np.floor(quantities)))
+
+    rows = [(barcodes[i], names[i], float(prices[i]), details[i], int(quantities[i]))
+            for i in np.flatnonzero(valid)]
+    errors = [{'row': lines[i], 'barcode': barcodes[i] or None,
+               'error': _row_error(barcodes[i], barcode_errors[i], names[i], prices[i], quantities[i])}
+              for i in np.flatnonzero(~valid)]
+    return rows, errors
+
+
+def read_import(rows, chunk_size=5000):
+    """Validate and merge an import.
+
+    rows yields the header row, then data rows. Returns (merged Books in
+    first-seen order, per-row errors, non-blank data row count). Error row
+    numbers count the header as row 1, like a spreadsheet.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise ImportFileError('The file is empty')
+    columns = map_columns(header)
+
+    numbered = ((line, row) for line, row in enumerate(rows, start=2)
+                if any(str(cell).strip() for cell in row))
+    merged = {}
+    errors = []
+    total = 0
+    added_on = datetime.now().isoformat()
+    while True:
+        chunk = list(itertools.islice(numbered, chunk_size))
+        if not chunk:
+            break
+        total += len(chunk)
+        valid, chunk_errors = _validate_chunk([row for _, row in chunk], [line for line, _ in chunk], columns)
+        errors.extend(chunk_errors)
+        for barcode, name, price, details, quantity in valid:
+            book = merged.get(barcode)
+            if book is None:
+                merged[barcode] = Book(barcode, name, price, details, added_on, quantity)
+            else:
+                book.quantity += quantity
+    return list(merged.values()), errors, total
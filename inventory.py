@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+"""In-memory inventory store backed by books.csv"""
+import bisect
+import csv
+import json
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass, asdict
+
+from barcodes import canonical_barcode
+from filelock import FileLock
+from metrics import Histogram, record_io
+from search import SearchIndex
+
+BOOK_FIELDS = ['barcode', 'name', 'price', 'details', 'date_added', 'quantity']
+BOOK_SORT_KEYS = ('name', 'barcode', 'price', 'quantity', 'date_added')
+
+COMPACTION_SECONDS = Histogram('inventory_compaction_seconds', 'Time to fold the journal into a new books.csv')
+
+
+@dataclass
+class Book:
+    """A single inventory record"""
+    barcode: str
+    name: str
+    price: float
+    details: str
+    date_added: str
+    quantity: int = 1
+
+    @classmethod
+    def from_row(cls, row):
+        """Build a Book from a books.csv row"""
+        return cls(
+            barcode=row['barcode'],
+            name=row['name'],
+            price=float(row['price']),
+            details=row.get('details') or '',
+            date_added=row.get('date_added') or '',
+            quantity=int(row.get('quantity') or 1)
+        )
+
+    def to_row(self):
+        return [self.barcode, self.name, self.price, self.details, self.date_added, self.quantity]
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class InventoryStore:
+    """Loads books.csv once and serves lookups from a barcode-keyed dict.
+
+    Writes are recorded as small appended entries in a journal next to the
+    CSV and periodically compacted back into books.csv, so a sale costs one
+    short append instead of a full rewrite. Journal entries carry the
+    resulting quantity, which makes replaying them idempotent.
+
+    Several processes may share the files: every access holds a FileLock
+    on books.csv.lock - shared for reads, exclusive for writes and
+    compaction - and on taking it the store replays journal entries
+    other processes appended since it last looked, or reloads everything
+    if the lock file's generation moved on - compaction bumps it when it
+    rotates the journal and when it replaces books.csv.
+    """
+
+    def __init__(self, path='books.csv', journal_path=None, compact_every=1000):
+        self.path = path
+        self.journal_path = journal_path or os.path.splitext(path)[0] + '.journal'
+        self.compact_every = compact_every
+        self._books = {}
+        # Sorted (casefolded name, barcode) pairs and sorted barcodes for
+        # prefix filters and ordered pages
+        self._name_index = []
+        self._barcode_index = []
+        # Full-text index over names and details; built on the first search
+        # after a (re)load, then kept current by _put/_remove
+        self._search = None
+        # Canonical ISBN/EAN key -> barcodes stored under it (ISBN-10 and
+        # ISBN-13 of one book, ...); built lazily like the search index
+        self._canonical = None
+        # Running totals for the dashboard
+        self._total_quantity = 0
+        self._total_value = 0.0
+        self._lock = FileLock(path + '.lock', on_acquire=self._sync)
+        # Only one process compacts at a time
+        self._compact_lock = FileLock(path + '.compact.lock')
+        self._compact_needed = threading.Event()
+        self._compactor = None
+        self._compactor_pid = None
+        self._compact_interval = None
+        self._journal = None
+        self._journal_entries = 0
+        # What has been read from disk: the lock file generation, books.csv
+        # identity and how many bytes of the journal have been applied
+        self._loaded = False
+        self._generation = None
+        self._snapshot_key = None
+        self._journal_offset = 0
+        self.load()
+
+    def load(self):
+        """(Re)load all books from the CSV snapshot and replay the journal"""
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        """Rebuild everything from disk. Caller holds the lock"""
+        snapshot_key = self._file_key(self.path)
+        books = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as file:
+                reader = csv.DictReader(file)
+                for row in reader:
+                    try:
+                        book = Book.from_row(row)
+                    except (KeyError, ValueError) as e:
+                        print(f"Skipping bad inventory row {row}: {e}")
+                        continue
+                    books[book.barcode] = book
+                record_io(self.path, 'read', file.buffer.tell())
+
+        # A leftover .old journal means a compaction is running or was interrupted
+        entries, _ = self._replay(self.journal_path + '.old', books)
+        journal_entries, journal_offset = self._replay(self.journal_path, books)
+
+        self._close_journal()
+        self._books = books
+        self._name_index = sorted((book.name.casefold(), book.barcode) for book in books.values())
+        self._barcode_index = sorted(books)
+        self._search = None
+        self._canonical = None
+        self._total_quantity = sum(book.quantity for book in books.values())
+        self._total_value = sum(book.price * book.quantity for book in books.values())
+        self._journal_entries = entries + journal_entries
+        self._generation = self._lock.generation()
+        self._snapshot_key = snapshot_key
+        self._journal_offset = journal_offset
+        self._loaded = True
+
+    def _replay(self, path, books, offset=0):
+        """Apply journal entries from offset on to a books dict.
+
+        Returns (entries applied, end offset).
+        """
+        if not os.path.exists(path):
+            return 0, 0
+        count = 0
+        with open(path, 'rb') as file:
+            file.seek(offset)
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn write at the end of the journal
+                    print(f"Skipping bad journal line in {path}")
+                    continue
+                self._apply(books, entry)
+                count += 1
+            record_io(path, 'read', file.tell() - offset)
+            return count, file.tell()
+
+    @staticmethod
+    def _file_key(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _sync(self):
+        """Catch up with other processes. Runs whenever the lock is taken"""
+        if not self._loaded:
+            return
+        if self._lock.generation() != self._generation or self._file_key(self.path) != self._snapshot_key:
+            # Another process compacted, or books.csv was replaced
+            self._reload()
+            return
+        try:
+            size = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            size = 0
+        if size < self._journal_offset:
+            self._reload()
+        elif size > self._journal_offset:
+            self._replay_tail()
+
+    def _replay_tail(self):
+        """Apply journal entries appended by other processes"""
+        with open(self.journal_path, 'rb') as file:
+            file.seek(self._journal_offset)
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    print(f"Skipping bad journal line in {self.journal_path}")
+                    continue
+                self._apply_live(entry)
+                self._journal_entries += 1
+            record_io(self.journal_path, 'read', file.tell() - self._journal_offset)
+            self._journal_offset = file.tell()
+
+    @staticmethod
+    def _apply(books, entry):
+        op = entry.get('op')
+        if op == 'add':
+            book = Book(**entry['book'])
+            books[book.barcode] = book
+        elif op == 'qty':
+            book = books.get(entry['barcode'])
+            if book:
+                book.quantity = entry['quantity']
+        elif op == 'delete':
+            books.pop(entry['barcode'], None)
+        elif op == 'batch':
+            for sub_entry in entry['entries']:
+                InventoryStore._apply(books, sub_entry)
+
+    def _apply_live(self, entry):
+        """Apply a journal entry to the live store, keeping indexes and totals"""
+        op = entry.get('op')
+        if op == 'add':
+            self._put(Book(**entry['book']))
+        elif op == 'qty':
+            book = self._books.get(entry['barcode'])
+            if book:
+                self._set_stock(book, entry['quantity'])
+        elif op == 'delete':
+            self._remove(entry['barcode'])
+        elif op == 'batch':
+            for sub_entry in entry['entries']:
+                self._apply_live(sub_entry)
+
+    def _put(self, book):
+        self._remove(book.barcode)
+        self._books[book.barcode] = book
+        self._count_stock(book, book.quantity)
+        bisect.insort(self._name_index, (book.name.casefold(), book.barcode))
+        bisect.insort(self._barcode_index, book.barcode)
+        if self._search is not None:
+            self._search.add(book)
+        if self._canonical is not None:
+            self._canonical.setdefault(canonical_barcode(book.barcode), set()).add(book.barcode)
+
+    def _set_stock(self, book, quantity):
+        self._count_stock(book, quantity - book.quantity)
+        book.quantity = quantity
+
+    def _remove(self, barcode):
+        book = self._books.pop(barcode, None)
+        if book is not None:
+            self._count_stock(book, -book.quantity)
+            self._remove_indexed(self._name_index, (book.name.casefold(), barcode))
+            self._remove_indexed(self._barcode_index, barcode)
+            if self._search is not None:
+                self._search.remove(barcode)
+            if self._canonical is not None:
+                key = canonical_barcode(barcode)
+                self._canonical[key].discard(barcode)
+                if not self._canonical[key]:
+                    del self._canonical[key]
+        return book
+
+    @property
+    def lock(self):
+        """Re-entrant thread + process lock guarding the store; hold it to
+        make several reads and writes one atomic step"""
+        return self._lock
+
+    @property
+    def read_lock(self):
+        """The lock held shared: several reads as one consistent step"""
+        return self._lock.shared()
+
+    def get(self, barcode):
+        """Return the Book for a barcode, or None"""
+        with self._lock.shared():
+            return self._books.get(barcode)
+
+    def get_many(self, barcodes):
+        """Return {barcode: Book} for the barcodes that exist, under one lock"""
+        with self._lock.shared():
+            books = self._books
+            return {barcode: books[barcode] for barcode in barcodes if barcode in books}
+
+    def get_canonical(self, key):
+        """Return the Book stored under any form of a canonical barcode, or None.
+
+        A book stored under the canonical form itself wins.
+        """
+        with self._lock.shared():
+            if self._canonical is None:
+                index = {}
+                for barcode in self._books:
+                    index.setdefault(canonical_barcode(barcode), set()).add(barcode)
+                self._canonical = index
+            barcodes = self._canonical.get(key)
+            if not barcodes:
+                return None
+            return self._books[key if key in barcodes else min(barcodes)]
+
+    def all(self):
+        """Return all books in insertion order"""
+        with self._lock.shared():
+            return list(self._books.values())
+
+    def __len__(self):
+        return len(self._books)
+
+    def __contains__(self, barcode):
+        return barcode in self._books
+
+    def add(self, book):
+        """Add a new book"""
+        with self._lock:
+            if book.barcode in self._books:
+                raise ValueError(f"Book {book.barcode} already exists")
+            self._log({'op': 'add', 'book': book.to_dict()})
+            self._put(book)
+        return book
+
+    def set_quantity(self, barcode, quantity):
+        """Set the stock quantity of a book. Returns False if not found"""
+        with self._lock:
+            book = self._books.get(barcode)
+            if book is None:
+                return False
+            self._log({'op': 'qty', 'barcode': barcode,
+                       'delta': quantity - book.quantity, 'quantity': quantity})
+            self._set_stock(book, quantity)
+            return True
+
+    def adjust_quantity(self, barcode, delta):
+        """Add delta to the stock quantity. Returns the new quantity or None"""
+        with self._lock:
+            book = self._books.get(barcode)
+            if book is None:
+                return None
+            self.set_quantity(barcode, book.quantity + delta)
+            return book.quantity
+
+    def set_quantities(self, quantities):
+        """Set several quantities as one journal entry, all or nothing.
+
+        quantities maps barcode -> new quantity; every barcode must exist.
+        """
+        with self._lock:
+            missing = [barcode for barcode in quantities if barcode not in self._books]
+            if missing:
+                raise KeyError(f"Unknown barcodes: {', '.join(missing)}")
+            entries = [{'op': 'qty', 'barcode': barcode,
+                        'delta': quantity - self._books[barcode].quantity, 'quantity': quantity}
+                       for barcode, quantity in quantities.items()]
+            self._log({'op': 'batch', 'entries': entries})
+            for barcode, quantity in quantities.items():
+                self._set_stock(self._books[barcode], quantity)
+
+    def upsert_many(self, books):
+        """Add new books and restock existing ones as one journal entry.
+
+        A barcode already in stock (or earlier in books) gets book.quantity
+        added to its quantity; its other fields are left alone. Returns a
+        (barcode, created, resulting quantity) tuple per input book.
+        """
+        with self._lock:
+            added = {}
+            quantities = {}
+            results = []
+            for book in books:
+                if book.barcode in added:
+                    added[book.barcode].quantity += book.quantity
+                    results.append((book.barcode, False, added[book.barcode].quantity))
+                elif book.barcode in self._books:
+                    quantity = quantities.get(book.barcode, self._books[book.barcode].quantity) + book.quantity
+                    quantities[book.barcode] = quantity
+                    results.append((book.barcode, False, quantity))
+                else:
+                    added[book.barcode] = Book(**book.to_dict())
+                    results.append((book.barcode, True, book.quantity))
+
+            entries = [{'op': 'add', 'book': book.to_dict()} for book in added.values()]
+            entries += [{'op': 'qty', 'barcode': barcode,
+                         'delta': quantity - self._books[barcode].quantity, 'quantity': quantity}
+                        for barcode, quantity in quantities.items()]
+            if not entries:
+                return results
+            self._log({'op': 'batch', 'entries': entries})
+
+            for book in added.values():
+                self._put(book)
+            for barcode, quantity in quantities.items():
+                self._set_stock(self._books[barcode], quantity)
+            return results
+
+    def delete(self, barcode):
+        """Remove a book. Returns False if not found"""
+        with self._lock:
+            if barcode not in self._books:
+                return False
+            self._log({'op': 'delete', 'barcode': barcode})
+            self._remove(barcode)
+            return True
+
+    def _count_stock(self, book, delta):
+        self._total_quantity += delta
+        self._total_value += book.price * delta
+
+    def totals(self):
+        """Return (title count, total units, inventory value) in O(1)"""
+        with self._lock.shared():
+            return len(self._books), self._total_quantity, self._total_value
+
+    @staticmethod
+    def _remove_indexed(index, key):
+        position = bisect.bisect_left(index, key)
+        if position < len(index) and index[position] == key:
+            del index[position]
+
+    def query(self, prefix=None, sort='name', descending=False, offset=0, limit=None):
+        """Return (page of books, total matches).
+
+        prefix matches the start of the name (case-insensitive) or barcode.
+        Name and barcode ordering come straight from the sorted indexes, so
+        an unfiltered page costs O(limit) rather than a full sort.
+        """
+        if sort not in BOOK_SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        with self._lock.shared():
+            if not prefix and sort in ('name', 'barcode'):
+                index = self._name_index if sort == 'name' else self._barcode_index
+                total = len(index)
+                end = total if limit is None else min(total, offset + limit)
+                positions = range(offset, end)
+                if descending:
+                    positions = (total - 1 - position for position in positions)
+                keys = (index[position] for position in positions)
+                if sort == 'name':
+                    keys = (barcode for _, barcode in keys)
+                return [self._books[barcode] for barcode in keys], total
+
+            if prefix:
+                matches = dict.fromkeys(self._prefix_matches(prefix))
+                books = [self._books[barcode] for barcode in matches]
+            else:
+                books = list(self._books.values())
+
+        if sort == 'name':
+            books.sort(key=lambda book: (book.name.casefold(), book.barcode), reverse=descending)
+        else:
+            books.sort(key=lambda book: getattr(book, sort), reverse=descending)
+        total = len(books)
+        end = total if limit is None else offset + limit
+        return books[offset:end], total
+
+    def search(self, query, offset=0, limit=None):
+        """Return (page of books, total matches) for a full-text query, best first"""
+        with self._lock.shared():
+            if self._search is None:
+                self._search = SearchIndex()
+                self._search.build(self._books.values())
+            barcodes, total = self._search.search(query, offset, limit)
+            return [self._books[barcode] for barcode in barcodes], total
+
+    def _prefix_matches(self, prefix):
+        key = prefix.casefold()
+        position = bisect.bisect_left(self._name_index, (key,))
+        while position < len(self._name_index) and self._name_index[position][0].startswith(key):
+            yield self._name_index[position][1]
+            position += 1
+        position = bisect.bisect_left(self._barcode_index, prefix)
+        while position < len(self._barcode_index) and self._barcode_index[position].startswith(prefix):
+            yield self._barcode_index[position]
+            position += 1
+
+    def _log(self, entry):
+        """Append one entry to the journal. Caller holds the lock"""
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'ab')
+            self._end_torn_line()
+        data = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        self._journal.write(data)
+        self._journal.flush()
+        record_io(self.journal_path, 'write', len(data))
+        self._journal_offset += len(data)
+        self._journal_entries += 1
+        if self._compactor_pid is not None and self._compactor_pid != os.getpid():
+            # Forked after start_compactor(): threads do not survive a fork
+            self.start_compactor(self._compact_interval)
+        if self._journal_entries >= self.compact_every:
+            self._compact_needed.set()
+
+    def _end_torn_line(self):
+        """Terminate a partial last line left by a writer that died, so the
+        next entry is not glued onto it and lost"""
+        size = self._journal.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        with open(self.journal_path, 'rb') as file:
+            file.seek(size - 1)
+            if file.read(1) == b'\n':
+                return
+        self._journal.write(b'\n')
+        self._journal.flush()
+        self._journal_offset += 1
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def compact(self):
+        """Fold the journal into a fresh books.csv snapshot"""
+        started = time.perf_counter()
+        with self._compact_lock:
+            old_journal = self.journal_path + '.old'
+            with self._lock:
+                if self._journal_entries == 0 and os.path.exists(self.path):
+                    return
+                # Rotate the journal so new writes keep flowing while the
+                # snapshot is written outside the lock
+                self._close_journal()
+                if os.path.exists(self.journal_path):
+                    if os.path.exists(old_journal):
+                        # Previous compaction never finished; keep its entries
+                        with open(self.journal_path, 'rb') as src, open(old_journal, 'ab') as dst:
+                            shutil.copyfileobj(src, dst)
+                        os.remove(self.journal_path)
+                    else:
+                        os.replace(self.journal_path, old_journal)
+                self._journal_entries = 0
+                self._journal_offset = 0
+                self._generation = self._lock.bump_generation()
+                rows = [book.to_row() for book in self._books.values()]
+
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(BOOK_FIELDS)
+                writer.writerows(rows)
+                file.flush()
+                os.fsync(file.fileno())
+                record_io(self.path, 'write', file.buffer.tell())
+            with self._lock:
+                os.replace(tmp_path, self.path)
+                if os.path.exists(old_journal):
+                    os.remove(old_journal)
+                # Our own snapshot: nothing to reload
+                self._snapshot_key = self._file_key(self.path)
+                self._generation = self._lock.bump_generation()
+        COMPACTION_SECONDS.observe(time.perf_counter() - started)
+
+    def start_compactor(self, interval=30):
+        """Compact in a background thread every interval seconds, or sooner
+        once compact_every journal entries have piled up"""
+        if self._compactor is not None and self._compactor_pid == os.getpid():
+            return
+        self._compact_interval = interval
+        self._compactor_pid = os.getpid()
+        self._compact_needed = threading.Event()
+        self._compactor = threading.Thread(target=self._compact_loop, args=(interval,), daemon=True)
+        self._compactor.start()
+
+    def _compact_loop(self, interval):
+        while True:
+            self._compact_needed.wait(interval)
+            self._compact_needed.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting inventory journal: {e}")
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Process-wide metrics in the Prometheus text exposition format.
+
+Counters, histograms and callback gauges register themselves in REGISTRY
+when created and /api/metrics renders it. Numbers are per process: with
+several workers each scrape reports the worker that answered it, which
+the process_id gauge identifies.
+"""
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Request latencies and slow file work
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Sub-millisecond steps such as a single image transform
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class Registry:
+    """Ordered collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics as Prometheus text (format version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Shared label handling: one series per tuple of label values.
+
+    With max_series set, the least recently used series are dropped once
+    there are more (for labels such as scan sessions that keep coming).
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), max_series=None, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.max_series = max_series
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _get(self, values):
+        """Series for label values, created on first use. Caller holds the lock"""
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        values = tuple(str(value) for value in values)
+        series = self._series.get(values)
+        if series is None:
+            series = self._series[values] = self._new_series()
+            if self.max_series is not None and len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+        elif self.max_series is not None:
+            self._series.move_to_end(values)
+        return series
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            snapshot = [(values, self._copy(series)) for values, series in self._series.items()]
+        for values, series in snapshot:
+            lines.extend(self._render_series(values, series))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. operations or bytes"""
+
+    kind = 'counter'
+
+    def _new_series(self):
+        return [0]
+
+    @staticmethod
+    def _copy(series):
+        return series[0]
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._get(label_values)[0] += amount
+
+    def _render_series(self, values, value):
+        yield f'{self.name}{_labels(self.label_names, values)} {_number(value)}'
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative upper-bound buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels, **kwargs)
+
+    def _new_series(self):
+        # Per-bucket counts (the last one is +Inf), then the sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    @staticmethod
+    def _copy(series):
+        return list(series)
+
+    def observe(self, value, *label_values):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._get(label_values)
+            series[position] += 1
+            series[-1] += value
+
+    def time(self, *label_values):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, label_values)
+
+    def _render_series(self, values, series):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), series):
+            cumulative += count
+            le = (('le', _number(float(bound))),)
+            yield f'{self.name}_bucket{_labels(self.label_names, values, le)} {cumulative}'
+        yield f'{self.name}_sum{_labels(self.label_names, values)} {_number(series[-1])}'
+        yield f'{self.name}_count{_labels(self.label_names, values)} {cumulative}'
+
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.label_values)
+
+
+class CallbackGauge(_Metric):
+    """Value read from a callback at render time (e.g. open cameras)"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, registry=REGISTRY):
+        self.callback = callback
+        super().__init__(name, documentation, registry=registry)
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            print(f"Error reading metric {self.name}: {e}")
+            return []
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}',
+                f'{self.name} {_number(value)}']
+
+
+PROCESS_ID = CallbackGauge('process_id', 'PID of the process that served this scrape', os.getpid)
+
+FILE_IO_OPERATIONS = Counter('file_io_operations_total', 'Reads and writes of the data files', ('file', 'op'))
+FILE_IO_BYTES = Counter('file_io_bytes_total', 'Bytes read from and written to the data files', ('file', 'op'))
+
+
+def record_io(path, op, size):
+    """Count one read or write of size bytes on a data file (books.csv, its journal, ...)"""
+    name = os.path.basename(path)
+    FILE_IO_OPERATIONS.inc(name, op)
+    FILE_IO_BYTES.inc(name, op, amount=size)
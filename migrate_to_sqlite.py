@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""One-shot import of books.csv/transactions.csv into a SQLite database.
+
+Usage:
+    python migrate_to_sqlite.py [--books books.csv] [--transactions transactions.csv] [--db library.db]
+
+Then start the app with LIBRARY_STORAGE=sqlite (and LIBRARY_DB if the
+database is not library.db).
+"""
+import argparse
+import csv
+import os
+
+from inventory import InventoryStore
+from storage import SqliteStorage
+
+
+def migrate(books_path, transactions_path, db_path):
+    storage = SqliteStorage(db_path)
+    conn = storage._conn()
+
+    # InventoryStore replays any pending journal on top of books.csv
+    books = InventoryStore(books_path).all()
+    transaction_rows = []
+    if os.path.exists(transactions_path):
+        with open(transactions_path, 'r', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                transaction_rows.append((
+                    row['transaction_id'], row['item_name'], int(row['item_quantity']),
+                    float(row['item_price']), row['customer_name'], row['date'], row['processed_by']
+                ))
+
+    with storage.transaction():
+        # Plain DELETE + INSERT so the stock_totals triggers stay exact
+        conn.execute('DELETE FROM books')
+        conn.executemany(
+            'INSERT INTO books (barcode, name, price, details, date_added, quantity) '
+            'VALUES (?, ?, ?, ?, ?, ?)', [book.to_row() for book in books])
+        storage.index_keys()
+        conn.execute('DELETE FROM transactions')
+        conn.executemany(
+            'INSERT INTO transactions (transaction_id, item_name, item_quantity, item_price, '
+            'customer_name, date, processed_by) VALUES (?, ?, ?, ?, ?, ?, ?)', transaction_rows)
+        storage.summarize_transactions()
+    storage.close()
+    return len(books), len(transaction_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import CSV inventory and transactions into SQLite')
+    parser.add_argument('--books', default='books.csv')
+    parser.add_argument('--transactions', default='transactions.csv')
+    parser.add_argument('--db', default='library.db')
+    args = parser.parse_args()
+
+    book_count, row_count = migrate(args.books, args.transactions, args.db)
+    print(f"✅ Imported {book_count} books and {row_count} transaction rows into {args.db}")
+
+
+if __name__ == '__main__':
+    main()
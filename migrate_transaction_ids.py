@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Split transactions that ended up sharing one ID.
+
+Before unique transaction IDs, the ID was the bill time to the second, so
+two bills in the same second were stored under the same ID and shown as a
+single transaction. Rows of one bill share their exact date (to the
+microsecond), customer and cashier; this script finds IDs that cover more
+than one such bill and renames each bill to <old id>-01, <old id>-02, ...
+in log order, which keeps IDs sorting by time.
+
+Usage:
+    python migrate_transaction_ids.py [--storage csv|sqlite] [--transactions transactions.csv]
+                                      [--books books.csv] [--db library.db] [--dry-run]
+
+Safe to run while the app is up: the CSV file is rewritten under the
+storage lock and running workers re-read it on their next request.
+"""
+import argparse
+import csv
+import os
+
+from filelock import FileLock
+from storage import SqliteStorage
+from transactions import TRANSACTION_FIELDS
+
+
+def split_merged_ids(rows):
+    """Return (new transaction ID per row, number of IDs that were split).
+
+    rows are transaction row dicts in log order.
+    """
+    bills = {}
+    positions = []
+    for row in rows:
+        keys = bills.setdefault(row['transaction_id'], {})
+        key = (row['date'], row['customer_name'], row['processed_by'])
+        if key not in keys:
+            keys[key] = len(keys) + 1
+        positions.append(keys[key])
+    merged = {transaction_id for transaction_id, keys in bills.items() if len(keys) > 1}
+    new_ids = [f"{row['transaction_id']}-{position:02d}" if row['transaction_id'] in merged
+               else row['transaction_id'] for row, position in zip(rows, positions)]
+    return new_ids, len(merged)
+
+
+def migrate_csv(transactions_path, books_path, dry_run=False):
+    if not os.path.exists(transactions_path):
+        return 0, 0
+    # CsvStorage guards both files with the inventory lock
+    with FileLock(books_path + '.lock'):
+        with open(transactions_path, 'r', encoding='utf-8', newline='') as file:
+            rows = list(csv.DictReader(file))
+        new_ids, split = split_merged_ids(rows)
+        changed = sum(1 for row, new_id in zip(rows, new_ids) if row['transaction_id'] != new_id)
+        if split and not dry_run:
+            for row, new_id in zip(rows, new_ids):
+                row['transaction_id'] = new_id
+            tmp_path = transactions_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=TRANSACTION_FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, transactions_path)
+            # Byte offsets changed; the app rebuilds the index on its next read
+            index_path = transactions_path + '.idx'
+            if os.path.exists(index_path):
+                os.remove(index_path)
+    return split, changed
+
+
+def migrate_sqlite(db_path, dry_run=False):
+    storage = SqliteStorage(db_path)
+    conn = storage._conn()
+    with storage.transaction():
+        rows = [dict(row) for row in conn.execute(
+            'SELECT id, transaction_id, date, customer_name, processed_by FROM transactions ORDER BY id')]
+        new_ids, split = split_merged_ids(rows)
+        updates = [(new_id, row['id']) for row, new_id in zip(rows, new_ids) if row['transaction_id'] != new_id]
+        if updates and not dry_run:
+            conn.executemany('UPDATE transactions SET transaction_id = ? WHERE id = ?', updates)
+            storage.summarize_transactions()
+    storage.close()
+    return split, len(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Give merged same-second transactions distinct IDs')
+    parser.add_argument('--storage', default=os.environ.get('LIBRARY_STORAGE', 'csv'), choices=('csv', 'sqlite'))
+    parser.add_argument('--transactions', default='transactions.csv')
+    parser.add_argument('--books', default='books.csv')
+    parser.add_argument('--db', default=os.environ.get('LIBRARY_DB', 'library.db'))
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+    args = parser.parse_args()
+
+    if args.storage == 'sqlite':
+        split, changed = migrate_sqlite(args.db, args.dry_run)
+    else:
+        split, changed = migrate_csv(args.transactions, args.books, args.dry_run)
+
+    verb = 'Would split' if args.dry_run else 'Split'
+    print(f"✅ {verb} {split} merged transaction IDs ({changed} rows renamed)")
+
+
+if __name__ == '__main__':
+    main()
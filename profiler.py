@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Opt-in sampling profiler for slow requests.
+
+While requests are being watched, a daemon thread samples their threads'
+stacks (sys._current_frames) every interval seconds. When a request ends
+slower than the threshold, its samples are written as collapsed stacks -
+one 'outer;inner;innermost count' line per distinct stack - which
+flamegraph.pl, speedscope and inferno read directly. Fast requests keep
+nothing.
+
+Enable with PROFILE_SLOW_REQUESTS=<seconds>; see profiler_from_env().
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class SamplingProfiler:
+    """Stack sampler for in-flight requests, dumping the slow ones"""
+
+    def __init__(self, threshold=1.0, interval=0.005, directory='profiles', max_files=200, max_depth=128):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self.max_files = max_files
+        self.max_depth = max_depth
+        # thread id -> Counter of collapsed stacks
+        self._watched = {}
+        self._cond = threading.Condition()
+        self._sampler = None
+        self._sampler_pid = None
+
+    def start(self):
+        """Start sampling the calling thread"""
+        with self._cond:
+            self._ensure_sampler()
+            self._watched[threading.get_ident()] = Counter()
+            self._cond.notify_all()
+
+    def finish(self, name, duration):
+        """Stop sampling the calling thread; dump its stacks if duration was slow.
+
+        Returns the written file path, or None.
+        """
+        with self._cond:
+            stacks = self._watched.pop(threading.get_ident(), None)
+        if not stacks or duration < self.threshold:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        path = os.path.join(self.directory, f"{stamp}_{_UNSAFE.sub('_', name)[:80]}_{int(duration * 1000)}ms.folded")
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in stacks.most_common():
+                file.write(f'{stack} {count}\n')
+        self._prune()
+        print(f"🐢 Slow request {name} ({duration:.2f}s) profiled to {path}")
+        return path
+
+    def _ensure_sampler(self):
+        # Threads do not survive a fork; each worker process starts its own
+        if self._sampler is None or self._sampler_pid != os.getpid():
+            self._sampler_pid = os.getpid()
+            self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._cond:
+                while not self._watched:
+                    self._cond.wait()
+            frames = sys._current_frames()
+            with self._cond:
+                for thread_id, stacks in self._watched.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != own_id:
+                        stacks[self._collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            # Per function, not per line, so one function is one flame box
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _prune(self):
+        """Keep only the newest max_files profiles"""
+        files = sorted(name for name in os.listdir(self.directory) if name.endswith('.folded'))
+        for name in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+def profiler_from_env():
+    """A SamplingProfiler when PROFILE_SLOW_REQUESTS (seconds) is set, else None.
+
+    PROFILE_DIR (default 'profiles') and PROFILE_INTERVAL_MS (default 5)
+    tune it.
+    """
+    threshold = os.environ.get('PROFILE_SLOW_REQUESTS')
+    if not threshold:
+        return None
+    return SamplingProfiler(threshold=float(threshold),
+                            interval=float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000,
+                            directory=os.environ.get('PROFILE_DIR', 'profiles'))
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Desktop scan session state with push-style result delivery, and batch intake tallies.
+
+State lives in a small SQLite database so every app process (e.g. each
+gunicorn worker) sees the same sessions: the worker running the camera
+thread publishes a decoded barcode and a client long-polling another
+worker picks it up. Waiters in the publishing process wake immediately on
+a condition variable; waiters in other processes re-check the database
+every poll_interval seconds. Likewise the frames of one batch intake
+burst may be decoded by different workers.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+SCANNING = 'scanning'
+RESULT = 'result'
+STOPPED = 'stopped'
+
+
+class _StateDatabase:
+    """Per-thread connections to the shared state database"""
+
+    SCHEMA = ''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        """Reuse this thread's connection; reconnect after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+
+class ScanSessions(_StateDatabase):
+    """Per-session scanning flag and pending result"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS scan_sessions (
+            session_id TEXT PRIMARY KEY,
+            active INTEGER NOT NULL,
+            barcode TEXT
+        );
+    """
+
+    def __init__(self, path='scan_sessions.db', poll_interval=0.05):
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        # Bumped on every local change so waiters never miss a wakeup
+        self._version = 0
+        super().__init__(path)
+
+    def _notify(self):
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+
+    def _set(self, session_id, active, barcode):
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO scan_sessions (session_id, active, barcode) VALUES (?, ?, ?)',
+                         (session_id, int(active), barcode))
+        self._notify()
+
+    def start(self, session_id):
+        self._set(session_id, True, None)
+
+    def stop(self, session_id):
+        with self._transaction() as conn:
+            conn.execute('UPDATE scan_sessions SET active = 0 WHERE session_id = ?', (session_id,))
+        self._notify()
+
+    def is_active(self, session_id):
+        row = self._conn().execute('SELECT active FROM scan_sessions WHERE session_id = ?',
+                                   (session_id,)).fetchone()
+        return bool(row and row[0])
+
+    def publish(self, session_id, barcode):
+        """Store a decoded barcode, end the session and wake its waiters"""
+        self._set(session_id, False, barcode)
+
+    @staticmethod
+    def _still_scanning(conn, session_id):
+        row = conn.execute('SELECT active, barcode FROM scan_sessions WHERE session_id = ?',
+                           (session_id,)).fetchone()
+        return bool(row and row[0] and row[1] is None)
+
+    def _settle(self, session_id):
+        """Consume a settled session: (status, barcode), or None while scanning"""
+        if self._still_scanning(self._conn(), session_id):
+            return None
+        with self._transaction() as conn:
+            if self._still_scanning(conn, session_id):
+                return None
+            row = conn.execute('SELECT barcode FROM scan_sessions WHERE session_id = ?', (session_id,)).fetchone()
+            # Settled sessions are dropped; start() creates a fresh one
+            conn.execute('DELETE FROM scan_sessions WHERE session_id = ?', (session_id,))
+        if row and row[0] is not None:
+            return RESULT, row[0]
+        return STOPPED, None
+
+    def wait(self, session_id, timeout=0):
+        """Block up to timeout seconds for the session to settle.
+
+        Returns (RESULT, barcode) once a barcode is published, consuming it,
+        (SCANNING, None) if still scanning at the deadline, or
+        (STOPPED, None) if the session ended without a result.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                version = self._version
+            settled = self._settle(session_id)
+            if settled is not None:
+                return settled
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return SCANNING, None
+            with self._cond:
+                if self._version == version:
+                    self._cond.wait(min(remaining, self.poll_interval))
+
+
+
+class BatchScans(_StateDatabase):
+    """Distinct symbols collected over a burst of frames, per intake session.
+
+    Each barcode counts the frames it was read in (its confidence is
+    hits / frames) and the most copies of it seen in one frame. Sessions
+    idle for max_age seconds are dropped.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS batch_sessions (
+            session_id TEXT PRIMARY KEY,
+            frames INTEGER NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS batch_symbols (
+            session_id TEXT NOT NULL,
+            barcode TEXT NOT NULL,
+            code_type TEXT NOT NULL,
+            hits INTEGER NOT NULL,
+            copies INTEGER NOT NULL,
+            first_frame INTEGER NOT NULL,
+            PRIMARY KEY (session_id, barcode)
+        );
+    """
+
+    def __init__(self, path='scan_sessions.db', max_age=1800):
+        self.max_age = max_age
+        super().__init__(path)
+
+    def add_frames(self, session_id, frames):
+        """Add the symbols of decoded frames, each {barcode: (code_type, copies)}.
+
+        Returns (frames in the session so far, barcodes new to the session).
+        """
+        now = time.time()
+        new = []
+        with self._transaction() as conn:
+            stale = now - self.max_age
+            conn.execute('DELETE FROM batch_symbols WHERE session_id IN '
+                         '(SELECT session_id FROM batch_sessions WHERE updated < ?)', (stale,))
+            conn.execute('DELETE FROM batch_sessions WHERE updated < ?', (stale,))
+            row = conn.execute('SELECT frames FROM batch_sessions WHERE session_id = ?', (session_id,)).fetchone()
+            count = row[0] if row else 0
+            for symbols in frames:
+                count += 1
+                for barcode, (code_type, copies) in symbols.items():
+                    updated = conn.execute(
+                        'UPDATE batch_symbols SET hits = hits + 1, copies = MAX(copies, ?) '
+                        'WHERE session_id = ? AND barcode = ?', (copies, session_id, barcode)).rowcount
+                    if not updated:
+                        conn.execute('INSERT INTO batch_symbols (session_id, barcode, code_type, hits, copies, '
+                                     'first_frame) VALUES (?, ?, ?, 1, ?, ?)',
+                                     (session_id, barcode, code_type, copies, count))
+                        new.append(barcode)
+            conn.execute('INSERT OR REPLACE INTO batch_sessions (session_id, frames, updated) VALUES (?, ?, ?)',
+                         (session_id, count, now))
+        return count, new
+
+    def tally(self, session_id):
+        """(frames, [(barcode, code_type, hits, copies)] in order of first sighting)"""
+        conn = self._conn()
+        row = conn.execute('SELECT frames FROM batch_sessions WHERE session_id = ?', (session_id,)).fetchone()
+        symbols = conn.execute('SELECT barcode, code_type, hits, copies FROM batch_symbols WHERE session_id = ? '
+                               'ORDER BY first_frame, barcode', (session_id,)).fetchall()
+        return (row[0] if row else 0), [tuple(symbol) for symbol in symbols]
+
+    @contextmanager
+    def take(self, session_id):
+        """Consume the session's tally: yields it like tally() and drops the session.
+
+        The read and the delete are one write transaction, held until the
+        block exits, so a concurrent or repeated take() of the same session
+        waits and then finds it empty. If the block raises, the tally is
+        kept, so commit whatever the tally is applied to inside the block.
+        """
+        with self._transaction() as conn:
+            row = conn.execute('SELECT frames FROM batch_sessions WHERE session_id = ?', (session_id,)).fetchone()
+            symbols = conn.execute('SELECT barcode, code_type, hits, copies FROM batch_symbols WHERE session_id = ? '
+                                   'ORDER BY first_frame, barcode', (session_id,)).fetchall()
+            conn.execute('DELETE FROM batch_symbols WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM batch_sessions WHERE session_id = ?', (session_id,))
+            yield (row[0] if row else 0), [tuple(symbol) for symbol in symbols]
+
+    def clear(self, session_id):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM batch_symbols WHERE session_id = ?', (session_id,))
+            conn.execute('DELETE FROM batch_sessions WHERE session_id = ?', (session_id,))
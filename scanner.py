@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""Shared barcode decoding engine used by the mobile and desktop scanners"""
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import cv2
+import numpy as np
+from pyzbar.pyzbar import decode
+
+from barcodes import InvalidBarcode, normalize_barcode
+from metrics import FAST_BUCKETS, Histogram
+
+DECODE_STEP_SECONDS = Histogram('barcode_decode_step_seconds',
+                                'Time per frame spent in each decode step (image transforms, localize, zbar)',
+                                ('step',), buckets=FAST_BUCKETS)
+
+
+def observe_decode_timings(timings):
+    """Record one frame's {step: seconds} (see BarcodeDecoder.run) in DECODE_STEP_SECONDS"""
+    for step, seconds in timings.items():
+        DECODE_STEP_SECONDS.observe(seconds, step)
+
+
+# pyzbar types with a check digit; reads are normalized (ISBN-10 -> ISBN-13, ...) or rejected
+CHECKED_TYPES = frozenset({'EAN13', 'EAN8', 'UPCA', 'ISBN10', 'ISBN13'})
+# EAN-2/EAN-5 supplements are never a code of their own
+ADDON_TYPES = frozenset({'EAN2', 'EAN5'})
+
+
+def accept_symbol(code_type, barcode):
+    """Canonical form of a decoded symbol, or None for a lone add-on or a failed check digit"""
+    code_type = code_type.upper()
+    if code_type in ADDON_TYPES:
+        return None
+    if code_type not in CHECKED_TYPES:
+        return barcode
+    try:
+        return normalize_barcode(barcode, strict=True)
+    except InvalidBarcode:
+        return None
+
+
+def extract_barcode_only(decoded_list):
+    """Return only barcodes, ignore QR codes and misreads."""
+    for code in decoded_list:
+        if code.type.upper() != "QRCODE":
+            barcode = accept_symbol(code.type, code.data.decode("utf-8"))
+            if barcode:
+                return barcode, code.type
+    return None, None
+
+
+def first_symbol(decoded_list):
+    """Return the first decoded symbol of any type that is not a misread."""
+    for code in decoded_list:
+        barcode = accept_symbol(code.type, code.data.decode("utf-8"))
+        if barcode:
+            return barcode, code.type
+    return None, None
+
+
+class FrameVariants:
+    """Lazily computed preprocessing variants of one frame.
+
+    Each variant is built at most once and reuses the ones it derives
+    from, so trying 'threshold' after 'contrast' costs one extra op. With a
+    timings dict, each variant's own build time (without the variants it
+    derives from) is added to timings[name].
+    """
+
+    def __init__(self, img, timings=None):
+        self.img = img
+        self.timings = timings
+        self._cache = {}
+        self._nested = 0.0
+
+    def get(self, name):
+        if name not in self._cache:
+            if self.timings is None:
+                self._cache[name] = getattr(self, '_' + name)()
+            else:
+                outer, self._nested = self._nested, 0.0
+                started = time.perf_counter()
+                self._cache[name] = getattr(self, '_' + name)()
+                elapsed = time.perf_counter() - started
+                self.timings[name] = self.timings.get(name, 0.0) + elapsed - self._nested
+                self._nested = outer + elapsed
+        return self._cache[name]
+
+    def _original(self):
+        return self.img
+
+    def _grayscale(self):
+        if self.img.ndim == 2:
+            return self.img
+        return cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
+
+    def _contrast(self):
+        return cv2.equalizeHist(self.get('grayscale'))
+
+    def _threshold(self):
+        _, thresh = cv2.threshold(self.get('contrast'), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return thresh
+
+    def _inverted(self):
+        return cv2.bitwise_not(self.get('threshold'))
+
+
+def find_barcode_regions(gray, max_side=480, max_regions=3, min_area_ratio=0.005):
+    """Locate likely 1D barcode regions from a gradient-energy map.
+
+    Works on a downscaled copy: bars give strong gradients across one axis
+    and weak ones along the other, so |gx| - |gy| (or the reverse for
+    rotated codes) lights up barcodes and little else. After blurring,
+    thresholding and a closing pass the largest blobs are returned as
+    (x, y, w, h) boxes in full-resolution coordinates, padded a little.
+    """
+    height, width = gray.shape[:2]
+    scale = min(1.0, max_side / float(max(height, width)))
+    small = gray if scale == 1.0 else cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    grad_x = cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=3)
+    grad_y = cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=3)
+    energy = cv2.absdiff(cv2.convertScaleAbs(grad_x), cv2.convertScaleAbs(grad_y))
+
+    blurred = cv2.blur(energy, (9, 9))
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (21, 7))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.erode(mask, None, iterations=3)
+    mask = cv2.dilate(mask, None, iterations=3)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = min_area_ratio * small.shape[0] * small.shape[1]
+    boxes = sorted((cv2.boundingRect(contour) for contour in contours),
+                   key=lambda box: box[2] * box[3], reverse=True)
+
+    regions = []
+    for x, y, w, h in boxes[:max_regions]:
+        if w * h < min_area:
+            break
+        # Pad so quiet zones and the outermost bars survive the crop
+        pad_x, pad_y = int(w * 0.15) + 2, int(h * 0.15) + 2
+        x0 = max(0, int((x - pad_x) / scale))
+        y0 = max(0, int((y - pad_y) / scale))
+        x1 = min(width, int((x + w + pad_x) / scale))
+        y1 = min(height, int((y + h + pad_y) / scale))
+        regions.append((x0, y0, x1 - x0, y1 - y0))
+    return regions
+
+
+# Default cascade order. pyzbar only reads the first channel of a colour
+# array, so the 'original' pass is rarely better than grayscale and goes last.
+DEFAULT_VARIANTS = ('grayscale', 'contrast', 'threshold', 'inverted', 'original')
+
+
+# Browser BarcodeDetector formats accepted from /api/scan_result, as pyzbar type names
+CLIENT_FORMATS = {
+    'ean_13': 'EAN13',
+    'ean_8': 'EAN8',
+    'upc_a': 'UPCA',
+    'upc_e': 'UPCE',
+    'code_128': 'CODE128',
+    'code_39': 'CODE39',
+    'code_93': 'CODE93',
+    'codabar': 'CODABAR',
+    'itf': 'I25',
+}
+# Lengths of the browser formats that carry a check digit
+_CHECK_DIGIT_LENGTHS = {'EAN13': 13, 'EAN8': 8, 'UPCA': 12}
+# Symbols batch intake collects: book and retail product codes
+BATCH_TYPES = frozenset({'EAN13', 'EAN8', 'UPCA', 'UPCE', 'ISBN13', 'ISBN10'})
+
+
+def validate_client_barcode(barcode, client_format):
+    """Check a symbol decoded in the browser. Returns (canonical barcode, code type) or raises ValueError"""
+    code_type = CLIENT_FORMATS.get(client_format)
+    if code_type is None:
+        raise ValueError(f"Unsupported barcode format: {client_format}")
+    barcode = (barcode or '').strip() if isinstance(barcode, str) else ''
+    if not barcode or len(barcode) > 64 or not barcode.isprintable():
+        raise ValueError('Invalid barcode')
+    length = _CHECK_DIGIT_LENGTHS.get(code_type)
+    if length is not None:
+        if len(barcode) != length or not barcode.isdigit():
+            raise ValueError(f"{code_type} must be {length} digits")
+        # InvalidBarcode is a ValueError
+        barcode = normalize_barcode(barcode, strict=True)
+    return barcode, code_type
+
+
+class DecodeResult:
+    """A successful decode: the symbol and the variant that produced it"""
+
+    def __init__(self, barcode, code_type, variant, region=None):
+        self.barcode = barcode
+        self.code_type = code_type
+        self.variant = variant
+        self.region = region
+
+
+class BarcodeDecoder:
+    """Adaptive preprocessing cascade with early exit.
+
+    Variants are tried in an order learned per session (device + scan
+    type): whichever variant has decoded most often for that session goes
+    first. A per-frame time budget caps work on hopeless frames. Attempt
+    and hit counters per variant are kept for inspection. EAN/ISBN reads
+    failing their check digit count as no read, so the cascade goes on.
+
+    Frames at least roi_min_side pixels on their long side are first
+    localized with find_barcode_regions() and only the cropped regions are
+    decoded; the full frame is the fallback.
+    """
+
+    def __init__(self, variants=DEFAULT_VARIANTS, time_budget=0.25, max_sessions=256,
+                 use_roi=True, roi_min_side=640):
+        self.variants = tuple(variants)
+        self.time_budget = time_budget
+        self.max_sessions = max_sessions
+        self.use_roi = use_roi
+        self.roi_min_side = roi_min_side
+        self._roi_frames = 0
+        self._roi_hits = 0
+        self._session_hits = OrderedDict()
+        self._attempts = Counter()
+        self._hits = Counter()
+        self._frames = 0
+        self._decoded_frames = 0
+        self._lock = threading.Lock()
+
+    def order_for(self, session_key=None):
+        """Variant order for a session: most successful first"""
+        with self._lock:
+            hits = self._session_hits.get(session_key) if session_key is not None else None
+            default_rank = {name: rank for rank, name in enumerate(self.variants)}
+            if not hits:
+                return list(self.variants)
+            return sorted(self.variants, key=lambda name: (-hits[name], default_rank[name]))
+
+    def decode(self, img, session_key=None, ignore_qr=True):
+        """Decode one frame. Returns a DecodeResult or None"""
+        timings = {}
+        result, tried, used_roi = self.run(img, self.order_for(session_key), ignore_qr, timings)
+        self.record(session_key, tried, result, used_roi)
+        observe_decode_timings(timings)
+        return result
+
+    def run(self, img, order, ignore_qr=True, timings=None):
+        """Decode with an explicit variant order and no bookkeeping.
+
+        Returns (DecodeResult or None, variants tried, whether ROIs were used)
+        so work done elsewhere (e.g. a decode worker process) can be fed
+        back through record(). A timings dict receives the seconds spent
+        per step: each variant's transform, 'localize' and 'zbar'.
+        """
+        pick = extract_barcode_only if ignore_qr else first_symbol
+        frame = FrameVariants(img, timings)
+        started = time.perf_counter()
+        result = None
+        tried = []
+
+        regions = []
+        if self.use_roi and max(img.shape[:2]) >= self.roi_min_side:
+            gray = frame.get('grayscale')
+            localize_started = time.perf_counter()
+            regions = find_barcode_regions(gray)
+            if timings is not None:
+                timings['localize'] = time.perf_counter() - localize_started
+        for x, y, w, h in regions:
+            # Crops of the grayscale frame; 'original' would repeat 'grayscale'
+            crop = FrameVariants(frame.get('grayscale')[y:y + h, x:x + w], timings)
+            roi_order = [name for name in order if name != 'original']
+            result = self._cascade(crop, roi_order, pick, started, tried, timings)
+            if result:
+                result.region = (x, y, w, h)
+                break
+
+        if result is None:
+            result = self._cascade(frame, order, pick, started, tried, timings)
+        return result, tried, bool(regions)
+
+    def decode_all(self, img, order=None, timings=None):
+        """Every distinct EAN/UPC/ISBN symbol in one frame, in canonical form, for batch intake.
+
+        Unlike run() this does not stop at the first read: each variant
+        (within the time budget) may pick up symbols the others missed.
+        Returns {barcode: (code_type, copies)}, where copies is the most
+        times the barcode appeared in a single variant, e.g. two copies of
+        one title side by side.
+        """
+        frame = FrameVariants(img, timings)
+        started = time.perf_counter()
+        found = {}
+        for position, name in enumerate(order or self.variants):
+            if position and time.perf_counter() - started > self.time_budget:
+                break
+            image = frame.get(name)
+            zbar_started = time.perf_counter()
+            symbols = decode(image)
+            if timings is not None:
+                timings['zbar'] = timings.get('zbar', 0.0) + time.perf_counter() - zbar_started
+            seen = Counter()
+            for symbol in symbols:
+                code_type = symbol.type.upper()
+                if code_type not in BATCH_TYPES:
+                    continue
+                barcode = accept_symbol(code_type, symbol.data.decode('utf-8'))
+                if barcode is None:
+                    continue
+                seen[barcode] += 1
+                found[barcode] = (code_type, max(seen[barcode], found.get(barcode, ('', 0))[1]))
+        return found
+
+    def _cascade(self, frame, order, pick, started, tried, timings=None):
+        """Try variants in order until one decodes or the budget runs out"""
+        for name in order:
+            if tried and time.perf_counter() - started > self.time_budget:
+                return None
+            tried.append(name)
+            image = frame.get(name)
+            zbar_started = time.perf_counter()
+            symbols = decode(image)
+            if timings is not None:
+                timings['zbar'] = timings.get('zbar', 0.0) + time.perf_counter() - zbar_started
+            barcode_data, code_type = pick(symbols)
+            if barcode_data:
+                return DecodeResult(barcode_data, code_type, name)
+        return None
+
+    def record(self, session_key, tried, result, used_roi=False):
+        """Update counters and the session's learned order after a frame"""
+        with self._lock:
+            self._frames += 1
+            self._attempts.update(tried)
+            if used_roi:
+                self._roi_frames += 1
+            if result is None:
+                return
+            if result.region is not None:
+                self._roi_hits += 1
+            self._decoded_frames += 1
+            self._hits[result.variant] += 1
+            if session_key is not None:
+                hits = self._session_hits.pop(session_key, None) or Counter()
+                hits[result.variant] += 1
+                self._session_hits[session_key] = hits
+                while len(self._session_hits) > self.max_sessions:
+                    self._session_hits.popitem(last=False)
+
+    def stats(self):
+        """Per-variant attempt/hit counters and hit rates"""
+        with self._lock:
+            variants = {}
+            for name in self.variants:
+                attempts = self._attempts[name]
+                variants[name] = {
+                    'attempts': attempts,
+                    'hits': self._hits[name],
+                    'hit_rate': round(self._hits[name] / attempts, 4) if attempts else 0.0
+                }
+            return {
+                'frames': self._frames,
+                'decoded_frames': self._decoded_frames,
+                'decodes_per_frame': round(sum(self._attempts.values()) / self._frames, 3) if self._frames else 0.0,
+                'roi_frames': self._roi_frames,
+                'roi_hits': self._roi_hits,
+                'variants': variants
+            }
+
+
+def frame_fingerprint(img_bytes, hash_size=16):
+    """Perceptual difference hash (dHash) of an encoded frame, as an int.
+
+    JPEGs are decoded at 1/8 scale straight to grayscale, which is far
+    cheaper than a full decode; the thumbnail is shrunk to
+    (hash_size + 1) x hash_size and each bit records whether a pixel is
+    brighter than its right-hand neighbour. Returns None if undecodable.
+    """
+    small = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if small is None:
+        return None
+    thumb = cv2.resize(small, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class FrameFilter:
+    """Per-session duplicate-frame and repeated-barcode suppression.
+
+    A frame whose fingerprint is within max_distance bits of the session's
+    previous frame gets that frame's outcome without being decoded, at
+    most max_skips times in a row so slow changes such as refocusing
+    still get a real decode now and then. A barcode already reported to a
+    session within barcode_ttl seconds is not reported again.
+    """
+
+    def __init__(self, max_distance=6, max_skips=3, barcode_ttl=2.0, max_sessions=256):
+        self.max_distance = max_distance
+        self.max_skips = max_skips
+        self.barcode_ttl = barcode_ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._skipped = 0
+        self._repeats = 0
+        self._lock = threading.Lock()
+
+    def check(self, session_key, fingerprint):
+        """Return (True, barcode) if the frame can skip decoding, else (False, None)"""
+        if fingerprint is None:
+            return False, None
+        with self._lock:
+            state = self._sessions.get(session_key)
+            if state is None or state['fingerprint'] is None or state['skips'] >= self.max_skips:
+                return False, None
+            if bin(state['fingerprint'] ^ fingerprint).count('1') > self.max_distance:
+                return False, None
+            state['skips'] += 1
+            self._skipped += 1
+            return True, state['barcode']
+
+    def record(self, session_key, fingerprint, barcode):
+        """Remember a decoded frame's outcome for the session"""
+        with self._lock:
+            state = self._session(session_key)
+            state['fingerprint'] = fingerprint
+            state['barcode'] = barcode
+            state['skips'] = 0
+
+    def is_repeat(self, session_key, barcode):
+        """True if barcode was reported to this session within barcode_ttl.
+
+        Marks it as reported otherwise.
+        """
+        now = time.monotonic()
+        with self._lock:
+            recent = self._session(session_key)['recent']
+            for code in [code for code, expires in recent.items() if expires <= now]:
+                del recent[code]
+            if barcode in recent:
+                self._repeats += 1
+                return True
+            recent[barcode] = now + self.barcode_ttl
+            return False
+
+    def _session(self, session_key):
+        state = self._sessions.pop(session_key, None)
+        if state is None:
+            state = {'fingerprint': None, 'barcode': None, 'skips': 0, 'recent': {}}
+        self._sessions[session_key] = state
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return state
+
+    def stats(self):
+        with self._lock:
+            return {'skipped_frames': self._skipped, 'repeated_barcodes': self._repeats}
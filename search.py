@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""In-memory full-text search over book names and details.
+
+Text is normalized before indexing and querying so the same word matches
+however it was typed: composed, decomposed and compatibility forms
+(NFKC), case, Latin accents, zero-width joiners and old-style Malayalam
+chillu sequences (consonant + virama + ZWJ) versus the atomic chillu
+letters. Every query token must match an
+indexed token exactly or as a prefix; name hits outrank details hits and
+exact tokens outrank prefixes.
+"""
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+
+# Consonant + virama + ZWJ -> atomic chillu (Unicode 5.1)
+_CHILLU = {
+    '\u0d23': '\u0d7a',  # ണ -> ൺ
+    '\u0d28': '\u0d7b',  # ന -> ൻ
+    '\u0d30': '\u0d7c',  # ര -> ർ
+    '\u0d32': '\u0d7d',  # ല -> ൽ
+    '\u0d33': '\u0d7e',  # ള -> ൾ
+    '\u0d15': '\u0d7f',  # ക -> ൿ
+}
+_CHILLU_SEQUENCE = re.compile('([\u0d23\u0d28\u0d30\u0d32\u0d33\u0d15])\u0d4d\u200d')
+# Zero-width space, non-joiner, joiner, word joiner, BOM
+_ZERO_WIDTH = re.compile('[\u200b-\u200d\u2060\ufeff]')
+_LATIN_ACCENTS = re.compile('[\u0300-\u036f]')
+# \w misses the vowel signs and viramas of Indic scripts, which would split
+# words apart; take the Devanagari..Sinhala blocks whole (minus the dandas)
+_TOKEN = re.compile('[\\w\u0900-\u0963\u0966-\u0dff]+')
+
+NAME_WEIGHT = 3
+DETAILS_WEIGHT = 1
+EXACT_BONUS = 2
+# Extra score when the whole query starts the name
+NAME_PREFIX_BONUS = 4
+
+
+def normalize(text):
+    """Canonical search form of a piece of text: NFKC, atomic chillus, no
+    zero-width characters, casefolded, without Latin accents"""
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize('NFKC', text)
+    text = _CHILLU_SEQUENCE.sub(lambda match: _CHILLU[match.group(1)], text)
+    text = _ZERO_WIDTH.sub('', text).casefold()
+    # Accents come off the decomposed form; recompose what is left
+    text = _LATIN_ACCENTS.sub('', unicodedata.normalize('NFD', text))
+    return unicodedata.normalize('NFC', text)
+
+
+def tokenize(text):
+    """Normalized tokens of a piece of text"""
+    return _TOKEN.findall(normalize(text))
+
+
+class SearchIndex:
+    """Inverted index from normalized tokens to barcodes.
+
+    Kept current one book at a time with add()/remove(); a sorted token
+    list answers prefix lookups with a bisect.
+    """
+
+    def __init__(self):
+        # token -> {barcode: field weight}
+        self._postings = {}
+        self._tokens = []
+        # barcode -> (normalized name, its tokens)
+        self._docs = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _weights(book, name):
+        weights = {token: DETAILS_WEIGHT for token in tokenize(book.details or '')}
+        for token in _TOKEN.findall(name) + [book.barcode.lower()]:
+            weights[token] = NAME_WEIGHT
+        return weights
+
+    def build(self, books):
+        """Index many books at once (sorting the token list only once)"""
+        with self._lock:
+            for book in books:
+                self._remove(book.barcode)
+                self._insert(book, sort=False)
+            self._tokens = sorted(self._postings)
+
+    def add(self, book):
+        """Index a book, replacing any earlier version of it"""
+        with self._lock:
+            self._remove(book.barcode)
+            self._insert(book)
+
+    def remove(self, barcode):
+        with self._lock:
+            self._remove(barcode)
+
+    def _insert(self, book, sort=True):
+        name = normalize(book.name)
+        weights = self._weights(book, name)
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                if sort:
+                    bisect.insort(self._tokens, token)
+            postings[book.barcode] = weight
+        self._docs[book.barcode] = (name, list(weights))
+
+    def _remove(self, barcode):
+        doc = self._docs.pop(barcode, None)
+        if doc is None:
+            return
+        for token in doc[1]:
+            postings = self._postings[token]
+            del postings[barcode]
+            if not postings:
+                del self._postings[token]
+                position = bisect.bisect_left(self._tokens, token)
+                if position < len(self._tokens) and self._tokens[position] == token:
+                    del self._tokens[position]
+
+    def _scores(self, token):
+        """{barcode: best score} for one query token, as exact token or prefix"""
+        scores = {}
+        position = bisect.bisect_left(self._tokens, token)
+        while position < len(self._tokens) and self._tokens[position].startswith(token):
+            indexed = self._tokens[position]
+            bonus = EXACT_BONUS if indexed == token else 1
+            for barcode, weight in self._postings[indexed].items():
+                score = weight * bonus
+                if score > scores.get(barcode, 0):
+                    scores[barcode] = score
+            position += 1
+        return scores
+
+    def search(self, query, offset=0, limit=None):
+        """Return (page of barcodes, total matches), best match first.
+
+        Books must match every query token; ties are broken by name.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return [], 0
+        phrase = normalize(query).strip()
+        with self._lock:
+            # Rarest-looking (longest) token first keeps the candidate set small
+            tokens.sort(key=len, reverse=True)
+            totals = self._scores(tokens[0])
+            for token in tokens[1:]:
+                if not totals:
+                    break
+                scores = self._scores(token)
+                totals = {barcode: total + scores[barcode] for barcode, total in totals.items() if barcode in scores}
+            ranked = []
+            for barcode, score in totals.items():
+                name = self._docs[barcode][0]
+                if name.startswith(phrase):
+                    score += NAME_PREFIX_BONUS
+                ranked.append((-score, name, barcode))
+        total = len(ranked)
+        if limit is None:
+            ranked.sort()
+        else:
+            # Only the requested page has to be put in order
+            ranked = heapq.nsmallest(offset + limit, ranked)
+        end = total if limit is None else offset + limit
+        return [barcode for _, _, barcode in ranked[offset:end]], total
@@ -1,4 +1,13 @@
 // Library Inventory Management System - Flask API Integration
+
+// Symbologies the browser's BarcodeDetector is asked for (books and retail codes)
+const LOCAL_BARCODE_FORMATS = ['ean_13', 'ean_8', 'upc_a', 'upc_e', 'code_128', 'code_39'];
+// With on-device detection, every Nth frame it misses goes to the server decoder
+const SERVER_FALLBACK_EVERY = 3;
+// Fallback frames: the central part of the view, at most this wide
+const FALLBACK_CROP = { width: 0.8, height: 0.5 };
+const FALLBACK_MAX_WIDTH = 800;
+
 class LibraryInventorySystem {
     constructor() {
         this.currentBill = [];
@@ -6,7 +15,13 @@ class LibraryInventorySystem {
         this.scanningActive = false;
         this.scanCheckInterval = null;
         this.currentStream = null;
-        this.allBooks = []; // Cache for autocomplete
+        this.allBooks = []; // Inventory rows loaded so far
+        this.inventoryPageSize = 100;
+        this.inventoryQuery = '';
+        this.inventoryNextOffset = null;
+        this.searchTimer = null;
+        this.suggestionQuery = '';
+        this.barcodeDetector = undefined; // Resolved on first scan; null if unsupported
         
         this.init();
     }
@@ -115,9 +130,14 @@ class LibraryInventorySystem {
         
         document.getElementById('clear-search').addEventListener('click', () => {
             document.getElementById('search-books').value = '';
+            this.inventoryQuery = '';
             this.loadInventory();
         });
         
+        document.getElementById('load-more-books').addEventListener('click', () => {
+            this.loadInventory(true);
+        });
+        
         // Billing
         document.getElementById('clear-bill').addEventListener('click', () => {
             this.clearBill();
@@ -163,33 +183,30 @@ class LibraryInventorySystem {
             this.updateStats();
         } else if (sectionName === 'billing') {
             this.displayBill();
-            this.loadBooksForAutocomplete();
-        }
-    }
-    
-    async loadBooksForAutocomplete() {
-        try {
-            const response = await fetch('/api/books');
-            const data = await response.json();
-            this.allBooks = data.books || [];
-        } catch (error) {
-            console.error('Error loading books for autocomplete:', error);
         }
     }
     
-    showBarcodeSuggestions(query) {
+    async showBarcodeSuggestions(query) {
         const suggestionsList = document.getElementById('barcode-suggestions');
+        this.suggestionQuery = query;
         
         if (!query || query.length < 1) {
             suggestionsList.innerHTML = '';
             return;
         }
         
-        // Filter books by barcode or name
-        const matches = this.allBooks.filter(book => 
-            book.barcode.toLowerCase().includes(query.toLowerCase()) ||
-            book.name.toLowerCase().includes(query.toLowerCase())
-        ).slice(0, 5); // Limit to 5 suggestions
+        // Ask the server for books whose barcode or name starts with the query
+        let matches = [];
+        try {
+            const response = await fetch(`/api/books?q=${encodeURIComponent(query)}&limit=5`);
+            const data = await response.json();
+            matches = data.books || [];
+        } catch (error) {
+            console.error('Error loading suggestions:', error);
+        }
+        
+        // A newer keystroke has already taken over
+        if (query !== this.suggestionQuery) return;
         
         if (matches.length === 0) {
             suggestionsList.innerHTML = '<div class="suggestion-item no-match">No matching books found</div>';
@@ -343,9 +360,10 @@ class LibraryInventorySystem {
     }
     
     async continuousScan(type, video, canvas, resultDiv) {
-        const ctx = canvas.getContext('2d');
         let scanCount = 0;
+        let localMisses = 0;
         const maxScans = 200; // Auto-stop after ~1 minute (200 * 300ms)
+        const detector = await this.getBarcodeDetector();
         
         const scanFrame = async () => {
             if (!this.scanningActive) {
@@ -365,30 +383,31 @@ class LibraryInventorySystem {
             }
             
             try {
-                // Capture frame exactly as displayed (with zoom applied)
-                // This ensures the zoomed-in view is what gets sent for decoding
-                canvas.width = video.videoWidth;
-                canvas.height = video.videoHeight;
-                ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-                
-                // Convert to base64 with good quality for barcode recognition
-                const imageData = canvas.toDataURL('image/jpeg', 0.9);
-                
-                // Send to backend for processing
-                const response = await fetch('/api/scan_barcode', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ image: imageData, type })
-                });
+                let data = null;
                 
-                const data = await response.json();
+                if (detector) {
+                    // Decode on the device; the server only validates and looks up the text
+                    data = await this.detectLocally(detector, video, type);
+                    if (!data) {
+                        localMisses++;
+                        // Now and then let the server's decoder try a smaller frame
+                        if (localMisses % SERVER_FALLBACK_EVERY === 0) {
+                            const frame = await this.captureFrame(video, canvas, FALLBACK_CROP, FALLBACK_MAX_WIDTH, 0.8);
+                            data = await this.sendFrame(frame, type, true);
+                        }
+                    }
+                } else {
+                    // Full frame exactly as displayed (with zoom applied)
+                    const frame = await this.captureFrame(video, canvas, { width: 1, height: 1 }, Infinity, 0.9);
+                    data = await this.sendFrame(frame, type, false);
+                }
                 
-                if (data.detected && data.barcode) {
-                    console.log('✅ Barcode detected:', data.barcode);
-                    this.handleScanResult(data.barcode, type);
+                if (data && data.detected && data.barcode) {
+                    console.log(`✅ Barcode detected (${data.path}):`, data.barcode);
+                    this.handleScanResult(data.barcode, type, data.book);
                     this.stopScanner(type);
                     return;
-                } else if (data.error) {
+                } else if (data && data.error) {
                     console.warn('⚠️ Scan error:', data.error);
                 }
                 
@@ -415,6 +434,73 @@ class LibraryInventorySystem {
         scanFrame();
     }
     
+    async getBarcodeDetector() {
+        // Native detection (Chrome on Android, recent Safari); null where unsupported
+        if (this.barcodeDetector !== undefined) return this.barcodeDetector;
+        
+        this.barcodeDetector = null;
+        if ('BarcodeDetector' in window) {
+            try {
+                const supported = await BarcodeDetector.getSupportedFormats();
+                const formats = LOCAL_BARCODE_FORMATS.filter(format => supported.includes(format));
+                if (formats.length) {
+                    this.barcodeDetector = new BarcodeDetector({ formats });
+                }
+            } catch (error) {
+                console.warn('⚠️ BarcodeDetector unavailable:', error);
+            }
+        }
+        console.log(this.barcodeDetector ? '📱 Using on-device barcode detection' : '🌐 Using server barcode decoding');
+        return this.barcodeDetector;
+    }
+    
+    async detectLocally(detector, video, type) {
+        // Returns the server's answer for the first read it accepts, or null if nothing usable was seen
+        const codes = await detector.detect(video);
+        for (const code of codes) {
+            const response = await fetch('/api/scan_result', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ barcode: code.rawValue, format: code.format, type: type })
+            });
+            const data = await response.json();
+            if (data.detected || data.repeat) {
+                return data;
+            }
+            console.warn('⚠️ On-device read rejected:', code.rawValue, data.error);
+        }
+        return null;
+    }
+    
+    captureFrame(video, canvas, crop, maxWidth, quality) {
+        // Central crop of the video, scaled down to maxWidth, as a JPEG blob
+        const sourceWidth = video.videoWidth * crop.width;
+        const sourceHeight = video.videoHeight * crop.height;
+        const scale = Math.min(1, maxWidth / sourceWidth);
+        canvas.width = Math.round(sourceWidth * scale);
+        canvas.height = Math.round(sourceHeight * scale);
+        canvas.getContext('2d').drawImage(
+            video,
+            (video.videoWidth - sourceWidth) / 2, (video.videoHeight - sourceHeight) / 2, sourceWidth, sourceHeight,
+            0, 0, canvas.width, canvas.height
+        );
+        return new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', quality));
+    }
+    
+    async sendFrame(frame, type, fallback) {
+        // Raw bytes to the server decoder (no base64 overhead)
+        const params = new URLSearchParams({ type: type });
+        if (fallback) {
+            params.set('fallback', '1');
+        }
+        const response = await fetch(`/api/scan_frame?${params}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: frame
+        });
+        return response.json();
+    }
+    
     async stopScanner(type) {
         const scanType = type === 'add' ? '' : '-bill';
         const video = document.getElementById(`video${scanType}`);
@@ -471,7 +557,8 @@ class LibraryInventorySystem {
         }
     }
     
-    async handleScanResult(barcode, type) {
+    async handleScanResult(barcode, type, book) {
+        // book comes with mobile scan responses (null: not in inventory); undefined means look it up
         const scanType = type === 'add' ? '' : '-bill';
         const resultDiv = document.getElementById(`scan-result${scanType}`);
         
@@ -482,9 +569,13 @@ class LibraryInventorySystem {
         if (type === 'add') {
             document.getElementById('book-barcode').value = barcode;
             // Check if book exists immediately after scan
-            await this.checkExistingBook(barcode);
+            if (book) {
+                this.showExistingBookDialog(book);
+            } else if (book === undefined) {
+                await this.checkExistingBook(barcode);
+            }
         } else if (type === 'bill') {
-            this.addToBill(barcode);
+            this.addToBill(barcode, book);
         }
     }
     
@@ -704,14 +795,25 @@ class LibraryInventorySystem {
         document.getElementById('book-details').value = '';
     }
     
-    async loadInventory() {
+    async loadInventory(append = false) {
         try {
-            const response = await fetch('/api/books');
+            const offset = append ? this.inventoryNextOffset || 0 : 0;
+            const params = new URLSearchParams({ limit: this.inventoryPageSize, offset });
+            if (this.inventoryQuery) params.set('q', this.inventoryQuery);
+
+            // Searches go to the ranked full-text index; plain listing pages by name
+            const endpoint = this.inventoryQuery ? '/api/books/search' : '/api/books';
+            const response = await fetch(`${endpoint}?${params}`);
             const data = await response.json();
             
-            this.allBooks = data.books || [];
+            const books = data.books || [];
+            this.allBooks = append ? this.allBooks.concat(books) : books;
+            this.inventoryNextOffset = data.next_offset;
             this.displayBooks(this.allBooks);
             
+            document.getElementById('load-more-books').style.display =
+                this.inventoryNextOffset !== null && this.inventoryNextOffset !== undefined ? 'inline-block' : 'none';
+            
         } catch (error) {
             console.error('Load inventory error:', error);
             this.showMessage('Error loading inventory', 'error');
@@ -738,14 +840,13 @@ class LibraryInventorySystem {
         `).join('');
     }
     
-    async searchBooks(query) {
-        const filtered = this.allBooks.filter(book =>
-            book.name.toLowerCase().includes(query.toLowerCase()) ||
-            book.barcode.includes(query) ||
-            (book.details && book.details.toLowerCase().includes(query.toLowerCase()))
-        );
-        
-        this.displayBooks(filtered);
+    searchBooks(query) {
+        // Filter on the server; wait for typing to pause
+        clearTimeout(this.searchTimer);
+        this.searchTimer = setTimeout(() => {
+            this.inventoryQuery = query.trim();
+            this.loadInventory();
+        }, 250);
     }
     
     async updateStats() {
@@ -762,21 +863,24 @@ class LibraryInventorySystem {
         }
     }
     
-    async addToBill(barcode) {
+    async addToBill(barcode, knownBook) {
         try {
-            const response = await fetch(`/api/book/${barcode}`);
-            const data = await response.json();
+            let book = knownBook;
+            if (book === undefined) {
+                const response = await fetch(`/api/book/${barcode}`);
+                const data = await response.json();
+                book = response.ok ? data.book : null;
+            }
             
-            if (response.ok && data.book) {
-                const book = data.book;
-                
+            if (book) {
                 // Check if book has stock
                 if (book.quantity <= 0) {
                     this.showMessage(`${book.name} is out of stock`, 'error');
                     return;
                 }
                 
-                const existing = this.currentBill.find(item => item.barcode === barcode);
+                // The scanned code may be another form (e.g. ISBN-10) of the stored barcode
+                const existing = this.currentBill.find(item => item.barcode === book.barcode);
                 
                 if (existing) {
                     // Check if adding more exceeds available stock
@@ -0,0 +1,732 @@
+#!/usr/bin/env python3
+"""Pluggable storage backends for books and transactions.
+
+The app talks to a Storage object only. CsvStorage keeps the original
+books.csv/transactions.csv files; SqliteStorage keeps everything in one
+SQLite database. Pick one with the LIBRARY_STORAGE environment variable
+('csv' or 'sqlite') - see open_storage().
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import replace
+
+from barcodes import canonical_barcode, normalize_barcode
+from inventory import Book, BOOK_SORT_KEYS, InventoryStore
+from search import SearchIndex
+from transactions import (TRANSACTION_FIELDS, TRANSACTION_SORT_KEYS, SalesStats, TransactionIndex,
+                          TransactionLog, transaction_rows)
+
+
+class Storage:
+    """Interface shared by all backends"""
+
+    _aggregates = None
+
+    def get_book(self, barcode):
+        raise NotImplementedError
+
+    def all_books(self):
+        raise NotImplementedError
+
+    def iter_books(self):
+        """Yield every Book without materializing the catalog where possible"""
+        return iter(self.all_books())
+
+    def get_books(self, barcodes):
+        """Return {barcode: Book} for the barcodes that exist"""
+        books = {}
+        for barcode in barcodes:
+            book = self.get_book(barcode)
+            if book:
+                books[barcode] = book
+        return books
+
+    def find_book(self, code):
+        """Book for a scanned or typed code: by exact barcode, else by its canonical ISBN/EAN key.
+
+        Finds a book stored under its ISBN-10 from the ISBN-13 (and back),
+        a hyphenated form or one with an add-on. The exact lookup comes
+        first, so a shop code that happens to look like a misread EAN still
+        finds its book.
+        """
+        book = self.get_book(code)
+        if book is None:
+            book = self._get_canonical(normalize_barcode(code))
+        return book
+
+    def find_books(self, codes):
+        """{code: Book} for the codes find_book() resolves"""
+        books = self.get_books(codes)
+        for code in codes:
+            if code not in books:
+                book = self._get_canonical(normalize_barcode(code))
+                if book:
+                    books[code] = book
+        return books
+
+    def _get_canonical(self, key):
+        """Book stored under any barcode whose canonical form is key, or None"""
+        raise NotImplementedError
+
+    def _stored_forms(self, books):
+        """books, each switched to the barcode its title is already stored under.
+
+        Restocking an ISBN-13 then adds to a legacy row kept under the
+        ISBN-10 instead of creating a second book. Call inside a write.
+        """
+        stored = self.find_books([book.barcode for book in books])
+        return [replace(book, barcode=stored[book.barcode].barcode) if book.barcode in stored else book
+                for book in books]
+
+    def add_book(self, book):
+        raise NotImplementedError
+
+    def upsert_books(self, books):
+        """Add new books and add stock to existing ones in one atomic pass.
+
+        A book already stored under another form of its ISBN/EAN is
+        restocked under that barcode. Returns (barcode, created, resulting
+        quantity) per input book - see InventoryStore.upsert_many.
+        """
+        raise NotImplementedError
+
+    def set_quantity(self, barcode, quantity):
+        raise NotImplementedError
+
+    def set_quantities(self, quantities):
+        raise NotImplementedError
+
+    def delete_book(self, barcode):
+        raise NotImplementedError
+
+    def append_transaction(self, transaction_id, items, customer_name, date, processed_by):
+        raise NotImplementedError
+
+    def iter_transaction_rows(self, start=None, end=None):
+        """Yield flattened transaction rows (dicts), oldest first.
+
+        start/end are ISO date(time) strings; end is exclusive.
+        """
+        raise NotImplementedError
+
+    def query_books(self, prefix=None, sort='name', descending=False, offset=0, limit=None):
+        """Return (page of Books, total matches) - see InventoryStore.query"""
+        raise NotImplementedError
+
+    def query_transactions(self, start=None, end=None, prefix=None, sort='date', descending=True,
+                           offset=0, limit=None):
+        """Return (page of grouped transactions, total) - see TransactionIndex.query"""
+        raise NotImplementedError
+
+    def search_books(self, query, offset=0, limit=None):
+        """Return (page of Books, total matches) ranked by relevance - see SearchIndex.search"""
+        raise NotImplementedError
+
+    def inventory_totals(self):
+        """Return (title count, total units, inventory value)"""
+        raise NotImplementedError
+
+    def sales_stats(self):
+        """Running SalesStats, built from the log once and then kept current"""
+        return self._aggregate('sales', SalesStats)
+
+    def _transaction_log_since(self, position):
+        """Return (records appended after position, new position, restarted).
+
+        Records are whatever the backend's log yields (rows or transaction
+        summaries - see _fold). position None means from the start.
+        restarted is True when the log was replaced, so the records start
+        from the beginning again.
+        """
+        raise NotImplementedError
+
+    def _fold(self, aggregate, record):
+        aggregate.add_row(record)
+
+    def _aggregate(self, name, factory):
+        """A log-fed aggregate (SalesStats, TransactionIndex) brought up to date.
+
+        Built from the whole log on first use, then fed only the records
+        appended since - by this process or any other sharing the storage.
+        """
+        # One consistent view of the log, and one thread folding at a time
+        with self.read_transaction(), self._aggregate_lock:
+            if self._aggregates is None:
+                self._aggregates = {}
+            aggregate, position = self._aggregates.get(name, (None, None))
+            records, position, restarted = self._transaction_log_since(None if aggregate is None else position)
+            if aggregate is None or restarted:
+                aggregate = factory()
+            for record in records:
+                self._fold(aggregate, record)
+            self._aggregates[name] = (aggregate, position)
+            return aggregate
+
+    def transaction(self):
+        """Context manager grouping several calls into one atomic, exclusive step"""
+        raise NotImplementedError
+
+    def read_transaction(self):
+        """Context manager for several reads that must see one consistent state"""
+        return self.transaction()
+
+    def flush(self):
+        """Make on-disk state complete (e.g. before an export)"""
+
+    def close(self):
+        pass
+
+
+class CsvStorage(Storage):
+    """books.csv + journal and transactions.csv"""
+
+    def __init__(self, books_path='books.csv', transactions_path='transactions.csv'):
+        self.inventory = InventoryStore(books_path)
+        self.inventory.start_compactor()
+        self.transactions = TransactionLog(transactions_path)
+        self._aggregate_lock = threading.Lock()
+
+    def get_book(self, barcode):
+        return self.inventory.get(barcode)
+
+    def all_books(self):
+        return self.inventory.all()
+
+    def get_books(self, barcodes):
+        return self.inventory.get_many(barcodes)
+
+    def find_books(self, codes):
+        # One lock and sync for the exact and the canonical lookups
+        with self.inventory.read_lock:
+            return super().find_books(codes)
+
+    def add_book(self, book):
+        return self.inventory.add(book)
+
+    def _get_canonical(self, key):
+        return self.inventory.get_canonical(key)
+
+    def upsert_books(self, books):
+        with self.inventory.lock:
+            return self.inventory.upsert_many(self._stored_forms(books))
+
+    def set_quantity(self, barcode, quantity):
+        return self.inventory.set_quantity(barcode, quantity)
+
+    def set_quantities(self, quantities):
+        self.inventory.set_quantities(quantities)
+
+    def delete_book(self, barcode):
+        return self.inventory.delete(barcode)
+
+    def append_transaction(self, transaction_id, items, customer_name, date, processed_by):
+        rows = transaction_rows(transaction_id, items, customer_name, date, processed_by)
+        with self.transaction():
+            self.transactions.append(rows)
+
+    def inventory_totals(self):
+        return self.inventory.totals()
+
+    def query_books(self, prefix=None, sort='name', descending=False, offset=0, limit=None):
+        return self.inventory.query(prefix, sort, descending, offset, limit)
+
+    def search_books(self, query, offset=0, limit=None):
+        return self.inventory.search(query, offset, limit)
+
+    def query_transactions(self, start=None, end=None, prefix=None, sort='date', descending=True,
+                           offset=0, limit=None):
+        with self.transaction():
+            index = self._aggregate('index', TransactionIndex)
+            summaries, total = index.query(start, end, prefix, sort, descending, offset, limit)
+            # Only the page's item rows are read, straight from their byte ranges
+            return [self._transaction(summary) for summary in summaries], total
+
+    def _transaction(self, summary):
+        rows = self.transactions.read(summary['offset'], summary['length'])
+        return {
+            'id': summary['id'],
+            'customer_name': summary['customer_name'],
+            'items': [{
+                'name': row['item_name'],
+                'quantity': int(row['item_quantity']),
+                'price': float(row['item_price'])
+            } for row in rows],
+            'total': summary['total'],
+            'date': summary['date'],
+            'processed_by': summary['processed_by']
+        }
+
+    def _transaction_log_since(self, position):
+        # Records are index entries; position is (inode, byte size) of the index file when last read
+        self.transactions.ensure_index()
+        stat = os.stat(self.transactions.index_path)
+        if position is not None and position[0] == stat.st_ino and position[1] <= stat.st_size:
+            offset, restarted = position[1], False
+        else:
+            offset, restarted = 0, position is not None
+        return self.transactions.read_index(offset, stat.st_size), (stat.st_ino, stat.st_size), restarted
+
+    def _fold(self, aggregate, record):
+        aggregate.add_summary(record)
+
+    def iter_transaction_rows(self, start=None, end=None):
+        if not os.path.exists(self.transactions.path):
+            return
+        span = (None, None)
+        if start or end:
+            # Read only the part of the log holding the requested dates
+            span = self._aggregate('index', TransactionIndex).byte_range(start, end)
+            if span is None:
+                return
+        for row in self.transactions.iter_rows(*span):
+            if start and row['date'] < start:
+                continue
+            if end and row['date'] >= end:
+                continue
+            yield row
+
+    @contextmanager
+    def transaction(self):
+        with self.inventory.lock:
+            yield
+
+    # read_transaction() stays exclusive: reading the log may rewrite its index sidecar
+
+    def flush(self):
+        self.inventory.compact()
+
+
+class SqliteStorage(Storage):
+    """Single SQLite database in WAL mode, one connection per thread"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS books (
+            barcode TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            details TEXT NOT NULL DEFAULT '',
+            date_added TEXT NOT NULL DEFAULT '',
+            quantity INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_id TEXT NOT NULL,
+            item_name TEXT NOT NULL,
+            item_quantity INTEGER NOT NULL,
+            item_price REAL NOT NULL,
+            customer_name TEXT NOT NULL,
+            date TEXT NOT NULL,
+            processed_by TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_books_name ON books (name COLLATE NOCASE);
+        CREATE TABLE IF NOT EXISTS stock_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            titles INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            value REAL NOT NULL
+        );
+        INSERT OR IGNORE INTO stock_totals (id, titles, quantity, value)
+            SELECT 1, COUNT(*), COALESCE(SUM(quantity), 0), COALESCE(SUM(price * quantity), 0) FROM books;
+        CREATE TRIGGER IF NOT EXISTS books_totals_insert AFTER INSERT ON books BEGIN
+            UPDATE stock_totals SET titles = titles + 1, quantity = quantity + NEW.quantity,
+                value = value + NEW.price * NEW.quantity WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS books_totals_update AFTER UPDATE ON books BEGIN
+            UPDATE stock_totals SET quantity = quantity + NEW.quantity - OLD.quantity,
+                value = value + NEW.price * NEW.quantity - OLD.price * OLD.quantity WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS books_totals_delete AFTER DELETE ON books BEGIN
+            UPDATE stock_totals SET titles = titles - 1, quantity = quantity - OLD.quantity,
+                value = value - OLD.price * OLD.quantity WHERE id = 1;
+        END;
+        CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date);
+        CREATE INDEX IF NOT EXISTS idx_transactions_id ON transactions (transaction_id);
+        CREATE TABLE IF NOT EXISTS book_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            barcode TEXT NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS books_changes_insert AFTER INSERT ON books BEGIN
+            INSERT INTO book_changes (barcode) VALUES (NEW.barcode);
+        END;
+        CREATE TRIGGER IF NOT EXISTS books_changes_update AFTER UPDATE OF name, details ON books BEGIN
+            INSERT INTO book_changes (barcode) VALUES (NEW.barcode);
+        END;
+        CREATE TRIGGER IF NOT EXISTS books_changes_delete AFTER DELETE ON books BEGIN
+            INSERT INTO book_changes (barcode) VALUES (OLD.barcode);
+        END;
+        CREATE TABLE IF NOT EXISTS book_keys (
+            barcode TEXT PRIMARY KEY,
+            canonical TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_book_keys_canonical ON book_keys (canonical);
+        CREATE TRIGGER IF NOT EXISTS books_keys_delete AFTER DELETE ON books BEGIN
+            DELETE FROM book_keys WHERE barcode = OLD.barcode;
+        END;
+        CREATE TABLE IF NOT EXISTS transaction_summaries (
+            transaction_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            customer_name TEXT NOT NULL,
+            processed_by TEXT NOT NULL,
+            total REAL NOT NULL,
+            UNIQUE (transaction_id, date)
+        );
+        CREATE INDEX IF NOT EXISTS idx_summaries_date ON transaction_summaries (date, transaction_id);
+        CREATE INDEX IF NOT EXISTS idx_summaries_total ON transaction_summaries (total, transaction_id);
+        CREATE INDEX IF NOT EXISTS idx_summaries_customer
+            ON transaction_summaries (customer_name COLLATE NOCASE, transaction_id);
+        CREATE TRIGGER IF NOT EXISTS transactions_summary_insert AFTER INSERT ON transactions BEGIN
+            INSERT INTO transaction_summaries (transaction_id, date, customer_name, processed_by, total)
+                VALUES (NEW.transaction_id, NEW.date, NEW.customer_name, NEW.processed_by,
+                        NEW.item_price * NEW.item_quantity)
+                ON CONFLICT (transaction_id, date) DO UPDATE SET total = total + excluded.total;
+        END;
+    """
+
+    def __init__(self, path='library.db'):
+        self.path = path
+        self._local = threading.local()
+        # (SearchIndex, last book_changes.seq applied), built on first search
+        self._search = None
+        self._aggregate_lock = threading.Lock()
+        self._search_lock = threading.Lock()
+        conn = self._conn()
+        summarized = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transaction_summaries'").fetchone()
+        conn.executescript(self.SCHEMA)
+        self.index_keys()
+        if not summarized:
+            # Database from before the summary table
+            self.summarize_transactions()
+
+    def _conn(self):
+        """Reuse this thread's connection; reconnect after a fork"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._conn()
+        if self._local.depth:
+            # Already inside a transaction on this thread
+            yield
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth += 1
+        try:
+            yield
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            self._local.depth -= 1
+
+    @contextmanager
+    def read_transaction(self):
+        # Deferred: a snapshot that neither waits for nor blocks writers (WAL)
+        conn = self._conn()
+        if self._local.depth:
+            yield
+            return
+        conn.execute('BEGIN')
+        self._local.depth += 1
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            conn.execute('COMMIT')
+
+    @staticmethod
+    def _book(row):
+        return Book(**dict(row)) if row else None
+
+    def index_keys(self):
+        """Fill in book_keys (barcode -> canonical ISBN/EAN) for books without a row.
+
+        Canonical forms are computed in Python, so rows inserted behind the
+        app's back (or before the table existed) are picked up here.
+        """
+        with self.transaction():
+            conn = self._conn()
+            missing = [row[0] for row in conn.execute(
+                'SELECT barcode FROM books WHERE barcode NOT IN (SELECT barcode FROM book_keys)')]
+            self._add_keys(missing)
+
+    def summarize_transactions(self):
+        """Rebuild transaction_summaries (one row per bill) from the transactions table.
+
+        The transactions_summary_insert trigger keeps it current as rows are
+        added; call this after rewriting or renaming existing rows.
+        """
+        with self.transaction():
+            conn = self._conn()
+            conn.execute('DELETE FROM transaction_summaries')
+            # Bare columns come from the bill's first row (the MIN(id) row)
+            conn.execute(
+                'INSERT INTO transaction_summaries (transaction_id, date, customer_name, processed_by, total) '
+                'SELECT transaction_id, date, customer_name, processed_by, total FROM ('
+                'SELECT transaction_id, date, customer_name, processed_by, '
+                'SUM(item_price * item_quantity) AS total, MIN(id) AS first_id '
+                'FROM transactions GROUP BY transaction_id, date ORDER BY first_id)')
+
+    def _add_keys(self, barcodes):
+        self._conn().executemany('INSERT OR REPLACE INTO book_keys (barcode, canonical) VALUES (?, ?)',
+                                 [(barcode, canonical_barcode(barcode)) for barcode in barcodes])
+
+    def _get_canonical(self, key):
+        # A book stored under the canonical form itself wins
+        row = self._conn().execute(
+            'SELECT books.* FROM book_keys JOIN books ON books.barcode = book_keys.barcode '
+            'WHERE book_keys.canonical = ? ORDER BY books.barcode != ?, books.barcode LIMIT 1', (key, key)).fetchone()
+        return self._book(row)
+
+    def get_book(self, barcode):
+        row = self._conn().execute('SELECT * FROM books WHERE barcode = ?', (barcode,)).fetchone()
+        return self._book(row)
+
+    def all_books(self):
+        rows = self._conn().execute('SELECT * FROM books ORDER BY rowid').fetchall()
+        return [self._book(row) for row in rows]
+
+    def iter_books(self):
+        for row in self._conn().execute('SELECT * FROM books ORDER BY rowid'):
+            yield self._book(row)
+
+    def add_book(self, book):
+        with self.transaction():
+            try:
+                self._conn().execute(
+                    'INSERT INTO books (barcode, name, price, details, date_added, quantity) VALUES (?, ?, ?, ?, ?, ?)',
+                    book.to_row())
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Book {book.barcode} already exists")
+            self._add_keys([book.barcode])
+        return book
+
+    def get_books(self, barcodes):
+        barcodes = list(dict.fromkeys(barcodes))
+        books = {}
+        conn = self._conn()
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(barcodes), 500):
+            chunk = barcodes[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in conn.execute(f'SELECT * FROM books WHERE barcode IN ({placeholders})', chunk):
+                books[row['barcode']] = self._book(row)
+        return books
+
+    def upsert_books(self, books):
+        with self.transaction():
+            books = self._stored_forms(books)
+            existing = self.get_books([book.barcode for book in books])
+            added = {}
+            quantities = {}
+            results = []
+            for book in books:
+                if book.barcode in added:
+                    added[book.barcode].quantity += book.quantity
+                    results.append((book.barcode, False, added[book.barcode].quantity))
+                elif book.barcode in existing:
+                    quantity = quantities.get(book.barcode, existing[book.barcode].quantity) + book.quantity
+                    quantities[book.barcode] = quantity
+                    results.append((book.barcode, False, quantity))
+                else:
+                    added[book.barcode] = Book(**book.to_dict())
+                    results.append((book.barcode, True, book.quantity))
+            conn = self._conn()
+            conn.executemany(
+                'INSERT INTO books (barcode, name, price, details, date_added, quantity) VALUES (?, ?, ?, ?, ?, ?)',
+                [book.to_row() for book in added.values()])
+            self._add_keys(added)
+            conn.executemany('UPDATE books SET quantity = ? WHERE barcode = ?',
+                             [(quantity, barcode) for barcode, quantity in quantities.items()])
+        return results
+
+    def set_quantity(self, barcode, quantity):
+        with self.transaction():
+            cursor = self._conn().execute('UPDATE books SET quantity = ? WHERE barcode = ?', (quantity, barcode))
+            return cursor.rowcount > 0
+
+    def set_quantities(self, quantities):
+        with self.transaction():
+            conn = self._conn()
+            for barcode, quantity in quantities.items():
+                cursor = conn.execute('UPDATE books SET quantity = ? WHERE barcode = ?', (quantity, barcode))
+                if cursor.rowcount == 0:
+                    raise KeyError(f"Unknown barcodes: {barcode}")
+
+    def delete_book(self, barcode):
+        with self.transaction():
+            cursor = self._conn().execute('DELETE FROM books WHERE barcode = ?', (barcode,))
+            return cursor.rowcount > 0
+
+    def append_transaction(self, transaction_id, items, customer_name, date, processed_by):
+        rows = transaction_rows(transaction_id, items, customer_name, date, processed_by)
+        with self.transaction():
+            self._conn().executemany(
+                'INSERT INTO transactions (transaction_id, item_name, item_quantity, item_price, '
+                'customer_name, date, processed_by) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(row['transaction_id'], row['item_name'], int(row['item_quantity']), float(row['item_price']),
+                  row['customer_name'], row['date'], row['processed_by']) for row in rows])
+
+    def inventory_totals(self):
+        # Kept current by the books_totals_* triggers
+        row = self._conn().execute('SELECT titles, quantity, value FROM stock_totals WHERE id = 1').fetchone()
+        return row['titles'], row['quantity'], row['value']
+
+    def _transaction_log_since(self, position):
+        # Records are rows; position is the last transactions.id read
+        last_id = position or 0
+        rows = self._conn().execute(
+            'SELECT id, transaction_id, item_name, item_quantity, item_price, customer_name, date, processed_by '
+            'FROM transactions WHERE id > ? ORDER BY id', (last_id,)).fetchall()
+        if rows:
+            last_id = rows[-1]['id']
+        return [{key: row[key] for key in TRANSACTION_FIELDS} for row in rows], last_id, False
+
+    def iter_transaction_rows(self, start=None, end=None):
+        query = ('SELECT transaction_id, item_name, item_quantity, item_price, customer_name, date, processed_by '
+                 'FROM transactions')
+        clauses, params = [], []
+        if start:
+            clauses.append('date >= ?')
+            params.append(start)
+        if end:
+            clauses.append('date < ?')
+            params.append(end)
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY date, id'
+        for row in self._conn().execute(query, params):
+            yield dict(row)
+
+    @staticmethod
+    def _like_prefix(prefix):
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return escaped + '%'
+
+    @staticmethod
+    def _page(limit, offset):
+        return ' LIMIT ? OFFSET ?', [-1 if limit is None else limit, offset]
+
+    def query_books(self, prefix=None, sort='name', descending=False, offset=0, limit=None):
+        if sort not in BOOK_SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        where, params = '', []
+        if prefix:
+            where = " WHERE name LIKE ? ESCAPE '\\' OR barcode LIKE ? ESCAPE '\\'"
+            params = [self._like_prefix(prefix)] * 2
+        direction = 'DESC' if descending else 'ASC'
+        # barcode breaks ties so pages neither repeat nor skip books
+        order = f'name COLLATE NOCASE {direction}, barcode' if sort == 'name' else f'{sort} {direction}, barcode'
+        conn = self._conn()
+        total = conn.execute('SELECT COUNT(*) FROM books' + where, params).fetchone()[0]
+        page, page_params = self._page(limit, offset)
+        rows = conn.execute(f'SELECT * FROM books{where} ORDER BY {order}{page}', params + page_params).fetchall()
+        return [self._book(row) for row in rows], total
+
+    def query_transactions(self, start=None, end=None, prefix=None, sort='date', descending=True,
+                           offset=0, limit=None):
+        if sort not in TRANSACTION_SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        clauses, params = [], []
+        if start:
+            clauses.append('date >= ?')
+            params.append(start)
+        if end:
+            clauses.append('date < ?')
+            params.append(end)
+        if prefix:
+            clauses.append("(customer_name LIKE ? ESCAPE '\\' OR transaction_id LIKE ? ESCAPE '\\')")
+            params += [self._like_prefix(prefix)] * 2
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        direction = 'DESC' if descending else 'ASC'
+        order = {'date': 'date', 'total': 'total', 'customer_name': 'customer_name COLLATE NOCASE'}[sort]
+
+        # One summary row per bill, so a page costs an index range scan
+        # rather than grouping every item row
+        conn = self._conn()
+        total = conn.execute(f'SELECT COUNT(*) FROM transaction_summaries{where}', params).fetchone()[0]
+        page, page_params = self._page(limit, offset)
+        summaries = conn.execute(
+            f'SELECT * FROM transaction_summaries{where} '
+            f'ORDER BY {order} {direction}, transaction_id {direction}{page}', params + page_params).fetchall()
+
+        transactions = {}
+        for summary in summaries:
+            transactions[summary['transaction_id'], summary['date']] = {
+                'id': summary['transaction_id'],
+                'customer_name': summary['customer_name'],
+                'items': [],
+                'total': summary['total'],
+                'date': summary['date'],
+                'processed_by': summary['processed_by']
+            }
+        ids = list(dict.fromkeys(transaction_id for transaction_id, _ in transactions))
+        if ids:
+            placeholders = ', '.join('?' * len(ids))
+            for row in conn.execute(
+                    'SELECT transaction_id, date, item_name, item_quantity, item_price FROM transactions '
+                    f'WHERE transaction_id IN ({placeholders}) ORDER BY id', ids):
+                transaction = transactions.get((row['transaction_id'], row['date']))
+                if transaction is not None:
+                    transaction['items'].append({
+                        'name': row['item_name'],
+                        'quantity': row['item_quantity'],
+                        'price': row['item_price']
+                    })
+        return list(transactions.values()), total
+
+    def _search_index(self):
+        """The SearchIndex, caught up with book_changes written by any process"""
+        conn = self._conn()
+        with self.read_transaction(), self._search_lock:
+            if self._search is None:
+                index = SearchIndex()
+                index.build(self._book(row) for row in conn.execute('SELECT * FROM books'))
+                last_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM book_changes').fetchone()[0]
+            else:
+                index, last_seq = self._search
+                changed = {row['barcode']: row['seq'] for row in conn.execute(
+                    'SELECT seq, barcode FROM book_changes WHERE seq > ? ORDER BY seq', (last_seq,))}
+                if changed:
+                    last_seq = max(changed.values())
+                    books = self.get_books(list(changed))
+                    for barcode in changed:
+                        if barcode in books:
+                            index.add(books[barcode])
+                        else:
+                            index.remove(barcode)
+            self._search = (index, last_seq)
+            return index
+
+    def search_books(self, query, offset=0, limit=None):
+        barcodes, total = self._search_index().search(query, offset, limit)
+        books = self.get_books(barcodes)
+        return [books[barcode] for barcode in barcodes if barcode in books], total
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def open_storage(backend=None):
+    """Create the configured backend (LIBRARY_STORAGE, default 'csv')"""
+    backend = (backend or os.environ.get('LIBRARY_STORAGE', 'csv')).lower()
+    if backend == 'sqlite':
+        return SqliteStorage(os.environ.get('LIBRARY_DB', 'library.db'))
+    if backend == 'csv':
+        return CsvStorage('books.csv', 'transactions.csv')
+    raise ValueError(f"Unknown storage backend: {backend}")
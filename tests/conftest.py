@@ -0,0 +1,62 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import CsvStorage, SqliteStorage  # noqa: E402
+
+
+@pytest.fixture(params=['csv', 'sqlite'])
+def open_storage(request, tmp_path):
+    """Factory for storages of one backend sharing files in tmp_path; all closed afterwards"""
+    opened = []
+
+    def open_one():
+        if request.param == 'sqlite':
+            storage = SqliteStorage(str(tmp_path / 'library.db'))
+        else:
+            storage = CsvStorage(str(tmp_path / 'books.csv'), str(tmp_path / 'transactions.csv'))
+        opened.append(storage)
+        return storage
+
+    yield open_one
+    for storage in opened:
+        storage.close()
+
+
+@pytest.fixture
+def storage(open_storage):
+    return open_storage()
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py imported in a scratch directory with CSV storage and no decode pool"""
+    pytest.importorskip('pyzbar.pyzbar', exc_type=ImportError)
+    workdir = tmp_path_factory.mktemp('app')
+    previous = os.getcwd()
+    os.chdir(workdir)
+    saved = {name: os.environ.get(name) for name in ('SCAN_WORKERS', 'SCAN_STATE_DB', 'LIBRARY_STORAGE')}
+    os.environ.update(SCAN_WORKERS='0', SCAN_STATE_DB=str(workdir / 'scan_sessions.db'), LIBRARY_STORAGE='csv')
+    try:
+        module = importlib.import_module('app')
+        module.init_csv_files()
+        yield module
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        os.chdir(previous)
+
+
+@pytest.fixture
+def client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['user'] = 'admin'
+    return client
@@ -0,0 +1,83 @@
+import pytest
+
+from barcodes import InvalidBarcode, canonical_barcode, normalize_barcode
+from importer import read_import
+from inventory import Book
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('080442957X', '9780804429573'),
+    ('0-8044-2957-x', '9780804429573'),
+    ('ISBN 0-306-40615-2', '9780306406157'),
+    ('036000291452', '0036000291452'),
+    ('978030640615712', '9780306406157'),
+    ('978030640615790000', '9780306406157'),
+    ('96385074', '96385074'),
+    ('ABC-123', 'ABC-123'),
+])
+def test_codes_map_to_canonical_form(raw, expected):
+    assert normalize_barcode(raw) == expected
+
+
+@pytest.mark.parametrize('raw, expected', [('1234567890', '1234567890'),
+                                           ('123-456-7890', '1234567890'),
+                                           ('030640615X', '030640615X'),
+                                           ('036000291453', '036000291453'),
+                                           ('12345678', '12345678'),
+                                           ('96385075', '96385075'),
+                                           ('9780306406158', '9780306406158'),
+                                           ('978-0-306-40615-8', '9780306406158'),
+                                           ('978030640615812', '978030640615812')])
+def test_bad_check_digits_are_shop_codes_unless_strict(raw, expected):
+    assert normalize_barcode(raw) == expected
+    with pytest.raises(InvalidBarcode):
+        normalize_barcode(raw, strict=True)
+
+
+def test_canonical_barcode_keys_stored_codes():
+    assert canonical_barcode('9780306406158') == '9780306406158'
+    assert canonical_barcode('0-306-40615-2') == '9780306406157'
+
+
+@pytest.mark.parametrize('stored, imported', [('9780306406157', '0306406152'),
+                                              ('0306406152', '9780306406157')])
+def test_import_restocks_book_stored_under_other_form(storage, stored, imported):
+    storage.add_book(Book(stored, 'Kept', 100.0, '', '2024-01-01T00:00:00', 2))
+    books, errors, _ = read_import([['isbn', 'title', 'price', 'qty'], [imported, 'Kept', '100', '3']])
+    assert not errors
+    storage.upsert_books(books)
+    assert storage.get_book(stored).quantity == 5
+    assert storage.query_books()[1] == 1
+
+
+@pytest.mark.parametrize('code', ['12345678', '2000000000015', '2000000000019'])
+def test_shop_codes_are_restocked_like_any_book(storage, code):
+    # Legacy rows stored under in-store codes, valid EAN or not
+    storage.add_book(Book(code, 'Shop item', 10.0, '', '2024-01-01T00:00:00', 1))
+    books, errors, _ = read_import([['barcode', 'name', 'price', 'quantity'], [code, 'Shop item', '10', '2']])
+    assert not errors
+    assert [book.barcode for book in books] == [code]
+    storage.upsert_books(books)
+    assert storage.get_book(code).quantity == 3
+    assert storage.find_book(code).quantity == 3
+
+
+def test_shop_codes_through_the_api(client):
+    for code in ('12345678', '2000000000019'):
+        record = {'barcode': code, 'name': 'Shop item', 'price': 10, 'quantity': 1}
+        assert client.post('/api/books', json=record).get_json()['success']
+        assert client.post('/api/books', json=record).get_json()['message'].endswith('New quantity: 2')
+        assert client.get(f'/api/book/{code}').get_json()['book']['quantity'] == 2
+    # Uncatalogued and failing its check digit: most likely a misread
+    assert client.get('/api/book/9780306406158').status_code == 400
+
+
+def test_update_and_delete_accept_any_form_of_the_code(client):
+    record = {'barcode': '978-1-4028-9462-6', 'name': 'Stored as EAN-13', 'price': 10, 'quantity': 1}
+    assert client.post('/api/books', json=record).get_json()['success']
+    assert client.get('/api/book/9781402894626').status_code == 200
+    response = client.post('/api/update_book_quantity', json={'barcode': '1402894627', 'quantity': 7})
+    assert response.get_json()['success']
+    assert client.get('/api/book/9781402894626').get_json()['book']['quantity'] == 7
+    assert client.post('/api/delete_book', json={'barcode': '1-4028-9462-7'}).get_json()['success']
+    assert client.get('/api/book/9781402894626').status_code == 404
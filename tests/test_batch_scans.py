@@ -0,0 +1,79 @@
+import threading
+from contextlib import contextmanager
+
+from inventory import Book
+from scan_sessions import BatchScans
+
+ISBN = '9780306406157'
+
+
+def test_take_consumes_the_tally(tmp_path):
+    scans = BatchScans(str(tmp_path / 'state.db'))
+    scans.add_frames('s', [{ISBN: ('EAN13', 2)}, {ISBN: ('EAN13', 1)}])
+    with scans.take('s') as (frames, symbols):
+        assert frames == 2
+        assert symbols == [(ISBN, 'EAN13', 2, 2)]
+    with scans.take('s') as (frames, symbols):
+        assert (frames, symbols) == (0, [])
+
+
+def test_take_keeps_the_tally_on_error(tmp_path):
+    scans = BatchScans(str(tmp_path / 'state.db'))
+    scans.add_frames('s', [{ISBN: ('EAN13', 1)}])
+    try:
+        with scans.take('s'):
+            raise RuntimeError('restock failed')
+    except RuntimeError:
+        pass
+    assert scans.tally('s') == (1, [(ISBN, 'EAN13', 1, 1)])
+
+
+def test_concurrent_takes_see_the_tally_once(tmp_path):
+    path = str(tmp_path / 'state.db')
+    BatchScans(path).add_frames('s', [{ISBN: ('EAN13', 3)}])
+    taken = []
+    barrier = threading.Barrier(4)
+
+    def take():
+        scans = BatchScans(path)
+        barrier.wait()
+        with scans.take('s') as (_, symbols):
+            taken.append(symbols)
+
+    threads = [threading.Thread(target=take) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(map(len, taken)) == [0, 0, 0, 1]
+
+
+def test_commit_restocks_once(app_module, client):
+    app_module.storage.add_book(Book(ISBN, 'Batch Book', 100.0, '', '2024-01-01T00:00:00', 1))
+    # scan_session_key('batch') of the test client
+    app_module.batch_scans.add_frames('admin_batch_127.0.0.1', [{ISBN: ('EAN13', 2)}])
+
+    first = client.post('/api/batch_scan/commit', json={}).get_json()
+    second = client.post('/api/batch_scan/commit', json={}).get_json()
+
+    assert [result['barcode'] for result in first['results']] == [ISBN]
+    assert second['results'] == [] and second['success']
+    assert app_module.storage.get_book(ISBN).quantity == 3
+
+
+def test_failed_storage_commit_keeps_the_tally(app_module, client, monkeypatch):
+    app_module.storage.add_book(Book('9780306406164', 'Kept Book', 100.0, '', '2024-01-01T00:00:00', 1))
+    app_module.batch_scans.add_frames('admin_batch_127.0.0.1', [{'9780306406164': ('EAN13', 1)}])
+    transaction = app_module.storage.transaction
+
+    @contextmanager
+    def failing_commit():
+        with transaction():
+            yield
+        raise OSError('disk full')
+
+    monkeypatch.setattr(app_module.storage, 'transaction', failing_commit)
+    assert client.post('/api/batch_scan/commit', json={}).status_code == 500
+    monkeypatch.undo()
+    assert app_module.batch_scans.tally('admin_batch_127.0.0.1')[0] == 1
+    assert client.post('/api/batch_scan/commit', json={}).get_json()['updated'] == 1
@@ -0,0 +1,80 @@
+import multiprocessing
+
+import pytest
+
+from checkout import CheckoutEngine, CheckoutError
+from inventory import Book
+
+
+def book(barcode, quantity):
+    return Book(barcode, f'Book {barcode}', 100.0, '', '2024-01-01T00:00:00', quantity)
+
+
+def line(barcode, quantity=1):
+    return {'barcode': barcode, 'name': f'Book {barcode}', 'quantity': quantity, 'price': 100.0}
+
+
+def stock(storage):
+    return {book.barcode: book.quantity for book in storage.all_books()}
+
+
+def test_cart_is_billed_as_one_transaction(storage):
+    storage.add_book(book('A', 5))
+    storage.add_book(book('B', 2))
+    transaction_id = CheckoutEngine(storage).checkout([line('A', 2), line('B'), line('A')], 'Anil', 'admin')
+    assert stock(storage) == {'A': 2, 'B': 1}
+    transactions, total = storage.query_transactions()
+    assert total == 1
+    assert transactions[0]['id'] == transaction_id
+    assert transactions[0]['total'] == 400.0
+
+
+def test_short_line_rejects_the_whole_cart(storage):
+    storage.add_book(book('A', 5))
+    storage.add_book(book('B', 1))
+    with pytest.raises(CheckoutError) as error:
+        # A alone is fine, B is short once both of its lines are added up
+        CheckoutEngine(storage).checkout([line('A', 2), line('B'), line('B'), line('C')], 'Anil', 'admin')
+    assert error.value.details == ['Book B: Insufficient quantity. Available: 1', 'Book C: Book not found']
+    assert stock(storage) == {'A': 5, 'B': 1}
+    assert storage.query_transactions()[1] == 0
+
+
+def test_failed_history_write_puts_the_stock_back(storage, monkeypatch):
+    storage.add_book(book('A', 5))
+
+    def fail(*args):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(storage, 'append_transaction', fail)
+    with pytest.raises(OSError):
+        CheckoutEngine(storage).checkout([line('A', 2)], 'Anil', 'admin')
+    assert stock(storage) == {'A': 5}
+    assert storage.query_transactions()[1] == 0
+
+
+def _buy(open_storage, attempts, sold):
+    engine = CheckoutEngine(open_storage())
+    for _ in range(attempts):
+        try:
+            engine.checkout([line('A')], 'Anil', 'admin')
+        except CheckoutError:
+            continue
+        with sold.get_lock():
+            sold.value += 1
+
+
+def test_concurrent_tills_never_oversell(open_storage):
+    storage = open_storage()
+    storage.add_book(book('A', 10))
+    ctx = multiprocessing.get_context('fork')
+    sold = ctx.Value('i', 0)
+    tills = [ctx.Process(target=_buy, args=(open_storage, 5, sold)) for _ in range(4)]
+    for till in tills:
+        till.start()
+    for till in tills:
+        till.join(30)
+        assert till.exitcode == 0
+    assert sold.value == 10
+    assert stock(storage) == {'A': 0}
+    assert storage.query_transactions()[1] == 10
@@ -0,0 +1,108 @@
+import os
+import signal
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip('pyzbar.pyzbar', exc_type=ImportError)
+
+import decode_pool  # noqa: E402
+from decode_pool import DecodePool, shared_pool  # noqa: E402
+from scanner import DEFAULT_VARIANTS  # noqa: E402
+
+ORDER = list(DEFAULT_VARIANTS)
+
+
+@pytest.fixture
+def pool():
+    pool = DecodePool(1, slot_size=1024 * 1024, slots_per_worker=1, check_interval=0.05)
+    yield pool
+    pool.close()
+
+
+def blank_frame():
+    ok, encoded = cv2.imencode('.png', np.full((64, 64, 3), 255, np.uint8))
+    assert ok
+    return encoded.tobytes()
+
+
+def kill_worker(pool):
+    process, _ = pool._workers[0]
+    os.kill(process.pid, signal.SIGKILL)
+    process.join(timeout=5)
+    assert not process.is_alive()
+
+
+def test_decodes_a_frame(pool):
+    payload = pool.decode('s', blank_frame(), ORDER)
+    assert 'error' not in payload and payload['tried']
+
+
+def test_crashed_worker_is_replaced_and_its_slot_freed(pool):
+    # One slot: a leaked slot would make every later decode time out
+    for _ in range(3):
+        kill_worker(pool)
+        payload = pool.decode('s', blank_frame(), ORDER, timeout=5)
+        assert payload is not None
+        if 'error' in payload:
+            assert payload['error'] == 'Decode worker crashed'
+            payload = pool.decode('s', blank_frame(), ORDER, timeout=5)
+        assert payload is not None and 'error' not in payload
+    assert pool.stats()['restarts'] == 3
+    assert pool.stats()['in_flight'] == 0
+
+
+def test_frame_in_flight_on_a_dead_worker_fails(pool):
+    process, _ = pool._workers[0]
+    os.kill(process.pid, signal.SIGSTOP)
+    results = []
+    decoding = threading.Thread(target=lambda: results.append(pool.decode('s', blank_frame(), ORDER, timeout=10)))
+    decoding.start()
+    deadline = time.monotonic() + 5
+    while pool.stats()['in_flight'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    os.kill(process.pid, signal.SIGKILL)
+    decoding.join()
+    assert results == [{'error': 'Decode worker crashed'}]
+    assert pool.decode('s', blank_frame(), ORDER)['tried']
+
+
+def test_forked_child_starts_its_own_pool(monkeypatch):
+    monkeypatch.setenv('SCAN_WORKERS', '1')
+    parent = shared_pool()
+    try:
+        assert shared_pool() is parent
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                pool = shared_pool()
+                if pool is not parent and pool.decode('s', blank_frame(), ORDER)['tried']:
+                    code = 0
+                pool.close()
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        assert parent.decode('s', blank_frame(), ORDER)['tried']
+    finally:
+        decode_pool._shared_pools.pop(os.getpid(), None)
+        parent.close()
+
+
+def test_scan_stats_do_not_start_the_pool(client, monkeypatch):
+    monkeypatch.setenv('SCAN_WORKERS', '1')
+    monkeypatch.delitem(decode_pool._shared_pools, os.getpid(), raising=False)
+    data = client.get('/api/scan_stats').get_json()
+    assert 'pool' not in data
+    assert os.getpid() not in decode_pool._shared_pools
+
+
+def test_workers_are_not_forked_from_the_server(pool):
+    process, _ = pool._workers[0]
+    # A child of the forkserver, not of this multithreaded process
+    with pytest.raises(ChildProcessError):
+        os.waitpid(process.pid, os.WNOHANG)
@@ -0,0 +1,15 @@
+from exports import group_transaction_rows
+
+
+def row(transaction_id, date, name, quantity=1, price=10.0):
+    return {'transaction_id': transaction_id, 'item_name': name, 'item_quantity': str(quantity),
+            'item_price': str(price), 'customer_name': 'Anil', 'date': date, 'processed_by': 'admin'}
+
+
+def test_reused_legacy_ids_export_as_separate_transactions():
+    rows = [row('20240101120000', '2024-01-01T12:00:00', 'A', 2),
+            row('20240101120000', '2024-01-01T12:00:00', 'B'),
+            row('20240101120000', '2024-01-01T12:00:00.5', 'C', 3)]
+    transactions = list(group_transaction_rows(rows))
+    assert [(t['date'], t['total'], len(t['items'])) for t in transactions] == [
+        ('2024-01-01T12:00:00', 30.0, 2), ('2024-01-01T12:00:00.5', 30.0, 1)]
@@ -0,0 +1,44 @@
+import pytest
+
+from importer import read_import
+
+HEADER = ['isbn', 'title', 'price', 'qty']
+
+
+def run(*rows):
+    books, errors, _ = read_import([HEADER, *rows])
+    return {book.barcode: book for book in books}, {error['row']: error['error'] for error in errors}
+
+
+def test_scientific_notation_barcode_is_rejected():
+    books, errors = run(['9.78123E+12', 'Lost digits', '100', '1'])
+    assert not books
+    assert 'scientific notation' in errors[2]
+
+
+def test_barcodes_are_canonical_and_shop_codes_kept():
+    books, errors = run(['978-0-306-40615-7', 'Hyphenated', '100', '1'],
+                        ['0306406152', 'ISBN-10', '100', '2'],
+                        ['9780306406158', 'Shop code or misprint', '100', '1'],
+                        ['978-1-234', 'Truncated', '100', '1'],
+                        ['9781234567897.0', 'From a float cell', '100', '1'])
+    assert books['9780306406157'].quantity == 3
+    assert '9781234567897' in books
+    # A failing check digit may be a shop's own code: imported as typed
+    assert '9780306406158' in books
+    assert 4 not in errors
+    assert 'Not an ISBN/EAN' in errors[5]
+
+
+@pytest.mark.parametrize('cell, price', [('12,50', 12.5), ('12,5', 12.5), ('Rs. 1,200', 1200.0),
+                                         ('1,20,000', 120000.0), ('1,200.50', 1200.5), ('99', 99.0)])
+def test_price_separators(cell, price):
+    books, errors = run(['SHOP-1', 'Book', cell, '1'])
+    assert not errors
+    assert books['SHOP-1'].price == price
+
+
+def test_ambiguous_price_is_a_row_error():
+    books, errors = run(['SHOP-1', 'Book', '1.234,50', '1'])
+    assert not books
+    assert errors[2] == 'Invalid price'
@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from inventory import Book, InventoryStore
+from storage import CsvStorage
+
+fcntl = pytest.importorskip('fcntl')
+
+
+def book(barcode, quantity=1):
+    return Book(barcode, f'Book {barcode}', 100.0, '', '2024-01-01T00:00:00', quantity)
+
+
+def test_batch_lookup_takes_the_lock_once(tmp_path):
+    storage = CsvStorage(str(tmp_path / 'books.csv'), str(tmp_path / 'transactions.csv'))
+    storage.add_book(book('9780306406157'))
+    storage.add_book(book('LOCAL-1'))
+    lock = storage.inventory.lock
+    syncs = []
+    sync = lock.on_acquire
+    lock.on_acquire = lambda: syncs.append(sync())
+    codes = ['9780306406157', 'LOCAL-1', '0306406152', 'MISSING'] * 25
+    books = storage.find_books(codes)
+    assert set(books) == {'9780306406157', 'LOCAL-1', '0306406152'}
+    assert len(syncs) == 1
+    storage.close()
+
+
+def _in_child(target, *args):
+    """Run target(*args) in a forked process and return its exit code"""
+    process = multiprocessing.get_context('fork').Process(target=target, args=args)
+    process.start()
+    process.join(30)
+    return process.exitcode
+
+
+def _write_books(path, barcodes, quantity):
+    store = InventoryStore(path)
+    for barcode in barcodes:
+        store.add(book(barcode, quantity))
+
+
+def _restock_and_compact(path):
+    store = InventoryStore(path)
+    store.set_quantity('A', 10)
+    store.delete('B')
+    store.compact()
+    store.add(book('D', 4))
+
+
+def test_journal_replay_and_compaction_across_processes(tmp_path):
+    path = str(tmp_path / 'books.csv')
+    store = InventoryStore(path)
+    store.add(book('A'))
+
+    assert _in_child(_write_books, path, ['B', 'C'], 2) == 0
+    assert store.get('B').quantity == 2
+    assert store.totals()[:2] == (3, 5)
+
+    # The other process rotates the journal, rewrites books.csv and writes again
+    assert _in_child(_restock_and_compact, path) == 0
+    assert store.get('A').quantity == 10
+    assert store.get('B') is None
+    assert store.get('D').quantity == 4
+    assert store.totals()[:2] == (3, 16)
+
+    # Our own write after its compaction reaches a fresh reader
+    store.set_quantity('C', 7)
+    store.compact()
+    fresh = InventoryStore(path)
+    assert {barcode: fresh.get(barcode).quantity for barcode in 'ACD'} == {'A': 10, 'C': 7, 'D': 4}
+
+
+def _hold_read_lock(path, held, release):
+    store = InventoryStore(path)
+    with store.read_lock:
+        held.set()
+        release.wait(10)
+
+
+def test_reads_share_the_lock_across_processes(tmp_path):
+    path = str(tmp_path / 'books.csv')
+    store = InventoryStore(path)
+    store.add(book('A'))
+    ctx = multiprocessing.get_context('fork')
+    held, release = ctx.Event(), ctx.Event()
+    reader = ctx.Process(target=_hold_read_lock, args=(path, held, release))
+    reader.start()
+    try:
+        assert held.wait(10)
+        # Another reader gets in, a writer does not
+        started = time.monotonic()
+        assert store.get('A') is not None
+        assert time.monotonic() - started < 1
+        fd = os.open(path + '.lock', os.O_RDWR)
+        try:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        finally:
+            os.close(fd)
+    finally:
+        release.set()
+        reader.join(10)
+
+
+def test_exclusive_inside_shared_is_refused(tmp_path):
+    store = InventoryStore(str(tmp_path / 'books.csv'))
+    with store.read_lock:
+        with pytest.raises(RuntimeError):
+            store.add(book('A'))
+    store.add(book('A'))
+    assert store.get('A') is not None
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+
+from inventory import Book, InventoryStore
+
+
+def book(barcode, quantity=1):
+    return Book(barcode, f'Book {barcode}', 100.0, '', '2024-01-01T00:00:00', quantity)
+
+
+def quantities(store):
+    return {book.barcode: book.quantity for book in store.all()}
+
+
+def test_writes_survive_a_restart_without_compaction(open_storage):
+    storage = open_storage()
+    storage.add_book(book('A', 3))
+    storage.upsert_books([book('A', 2), book('B', 4)])
+    storage.set_quantities({'A': 1, 'B': 2})
+    storage.delete_book('B')
+    storage.close()
+    assert {b.barcode: b.quantity for b in open_storage().all_books()} == {'A': 1}
+
+
+def _sell(open_storage, barcode, times):
+    storage = open_storage()
+    for _ in range(times):
+        with storage.transaction():
+            storage.set_quantity(barcode, storage.get_book(barcode).quantity - 1)
+
+
+def test_concurrent_processes_lose_no_updates(open_storage):
+    storage = open_storage()
+    storage.add_book(book('A', 200))
+    # Forked, so the storage factory needs no pickling
+    ctx = multiprocessing.get_context('fork')
+    children = [ctx.Process(target=_sell, args=(open_storage, 'A', 25)) for _ in range(3)]
+    for child in children:
+        child.start()
+    _sell(open_storage, 'A', 25)
+    for child in children:
+        child.join(30)
+        assert child.exitcode == 0
+    assert storage.get_book('A').quantity == 100
+    assert open_storage().get_book('A').quantity == 100
+
+
+def test_torn_journal_tail_is_skipped_and_later_writes_kept(tmp_path):
+    path = str(tmp_path / 'books.csv')
+    store = InventoryStore(path)
+    store.add(book('A', 5))
+    # A writer died halfway through an entry
+    with open(store.journal_path, 'ab') as file:
+        file.write(b'{"op": "qty", "barcode": "A", "qua')
+    restarted = InventoryStore(path)
+    assert quantities(restarted) == {'A': 5}
+    restarted.set_quantity('A', 9)
+    restarted.add(book('B', 2))
+    assert quantities(InventoryStore(path)) == {'A': 9, 'B': 2}
+    # The store that saw the torn line first catches up too
+    assert quantities(store) == {'A': 9, 'B': 2}
+
+
+def test_interrupted_compaction_is_replayed(tmp_path):
+    path = str(tmp_path / 'books.csv')
+    store = InventoryStore(path)
+    store.add(book('A', 5))
+    store.compact()
+    store.set_quantity('A', 4)
+    store.add(book('B', 1))
+    # Crash after rotating the journal, before the new snapshot replaced books.csv
+    os.replace(store.journal_path, store.journal_path + '.old')
+    restarted = InventoryStore(path)
+    restarted.set_quantity('B', 3)
+    assert quantities(restarted) == {'A': 4, 'B': 3}
+    restarted.compact()
+    assert not os.path.exists(store.journal_path + '.old')
+    assert quantities(InventoryStore(path)) == {'A': 4, 'B': 3}
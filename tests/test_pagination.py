@@ -0,0 +1,73 @@
+import sqlite3
+
+import pytest
+
+from inventory import Book
+from storage import SqliteStorage
+
+
+def pages(query, size):
+    items, offset = [], 0
+    while True:
+        page, total = query(offset, size)
+        items += page
+        offset += len(page)
+        if not page or offset >= total:
+            return items
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_tied_prices_page_without_repeats(storage, descending):
+    for number in range(40):
+        storage.add_book(Book(f'B{number:03d}', f'Book {number}', 100.0, '', '2024-01-01T00:00:00', 1))
+    seen = pages(lambda offset, size: storage.query_books(sort='price', descending=descending,
+                                                            offset=offset, limit=size), 7)
+    assert sorted(book.barcode for book in seen) == [f'B{number:03d}' for number in range(40)]
+
+
+def test_tied_transaction_dates_page_without_repeats(storage):
+    for number in range(30):
+        storage.append_transaction(f'T{number:03d}', [{'name': 'Book', 'quantity': 1, 'price': 50}],
+                                   'Anil', '2024-01-01T10:00:00', 'admin')
+    seen = pages(lambda offset, size: storage.query_transactions(offset=offset, limit=size), 4)
+    assert sorted(transaction['id'] for transaction in seen) == [f'T{number:03d}' for number in range(30)]
+
+
+def bill(storage, transaction_id, customer, date, *lines):
+    storage.append_transaction(transaction_id, [{'name': name, 'quantity': quantity, 'price': price}
+                                                for name, quantity, price in lines], customer, date, 'admin')
+
+
+def test_transactions_match_across_backends(storage):
+    bill(storage, 'T1', 'Anil', '2024-01-01T10:00:00', ('A', 2, 50), ('B', 1, 30))
+    bill(storage, 'T2', 'Beena', '2024-01-02T10:00:00', ('C', 1, 500))
+    # A legacy ID reused by a later bill is a bill of its own
+    bill(storage, 'T1', 'Chitra', '2024-01-03T10:00:00', ('D', 1, 10))
+    page, total = storage.query_transactions()
+    assert total == 3
+    assert [(t['id'], t['customer_name'], t['total'], [i['name'] for i in t['items']]) for t in page] == [
+        ('T1', 'Chitra', 10.0, ['D']), ('T2', 'Beena', 500.0, ['C']), ('T1', 'Anil', 130.0, ['A', 'B'])]
+    assert [t['id'] for t in storage.query_transactions(sort='total', descending=False)[0]] == ['T1', 'T1', 'T2']
+    assert storage.query_transactions(start='2024-01-02', prefix='be')[1] == 1
+
+
+def test_summaries_are_built_for_an_existing_database(tmp_path):
+    path = str(tmp_path / 'library.db')
+    SqliteStorage(path).append_transaction('T1', [{'name': 'A', 'quantity': 2, 'price': 50}],
+                                           'Anil', '2024-01-01T10:00:00', 'admin')
+    conn = sqlite3.connect(path)
+    conn.execute('DROP TABLE transaction_summaries')
+    conn.commit()
+    conn.close()
+    page, total = SqliteStorage(path).query_transactions()
+    assert total == 1
+    assert page[0]['total'] == 100.0
+
+
+def test_transactions_default_to_one_page(app_module, client):
+    for number in range(app_module.DEFAULT_TRANSACTION_PAGE + 5):
+        app_module.storage.append_transaction(f'P{number:04d}', [{'name': 'Book', 'quantity': 1, 'price': 50}],
+                                              'Beena', f'2024-02-01T10:{number // 60:02d}:{number % 60:02d}', 'admin')
+    data = client.get('/api/transactions').get_json()
+    assert len(data['transactions']) == data['limit'] == app_module.DEFAULT_TRANSACTION_PAGE
+    assert data['next_offset'] == app_module.DEFAULT_TRANSACTION_PAGE
@@ -0,0 +1,44 @@
+import io
+
+import cv2
+import numpy as np
+
+
+def chunked(client, path, body, content_type='application/octet-stream'):
+    """POST body as a chunked upload: no Content-Length, terminated input"""
+    return client.post(path, input_stream=io.BytesIO(body), content_type=content_type,
+                       headers={'Transfer-Encoding': 'chunked'}, environ_overrides={'wsgi.input_terminated': True})
+
+
+def blank_png():
+    ok, encoded = cv2.imencode('.png', np.full((64, 64, 3), 255, np.uint8))
+    return encoded.tobytes()
+
+
+def test_chunked_frame_over_the_limit_is_refused(app_module, client):
+    response = chunked(client, '/api/scan_frame', b'\0' * (app_module.MAX_FRAME_BYTES + 1))
+    assert response.status_code == 413
+
+
+def test_chunked_multipart_over_the_limit_is_refused(app_module, client):
+    boundary = 'frameboundary'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="frame"; filename="f.png"\r\n'
+            'Content-Type: image/png\r\n\r\n').encode() + b'\0' * app_module.MAX_FRAME_BYTES + \
+        f'\r\n--{boundary}--\r\n'.encode()
+    response = chunked(client, '/api/scan_frame', body, f'multipart/form-data; boundary={boundary}')
+    assert response.status_code == 413
+
+
+def test_chunked_burst_over_the_limit_is_refused(app_module, client):
+    limit = app_module.MAX_FRAME_BYTES * app_module.MAX_BURST_FRAMES
+    response = chunked(client, '/api/batch_scan/frame', b'\0' * (limit + 1))
+    assert response.status_code == 413
+
+
+def test_frames_under_the_limit_are_decoded(client):
+    response = chunked(client, '/api/scan_frame?type=add', blank_png())
+    assert response.status_code == 200
+    response = client.post('/api/scan_frame', data={'frame': (io.BytesIO(blank_png()), 'f.png'), 'type': 'add'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.get_json()['detected'] is False
@@ -0,0 +1,56 @@
+import pytest
+
+from inventory import Book
+from search import SearchIndex, normalize, tokenize
+
+VIRAMA, ZWJ, ZWNJ, ZWSP = '്', '‍', '‌', '​'
+# അവ (ava), കഥ (katha), മഴ (mazha)
+AVA = 'അവ'
+KATHA = 'കഥ'
+MAZHA = 'മഴ'
+# Consonant and its atomic chillu: ണ ൺ, ന ൻ, ര ർ, ല ൽ, ള ൾ, ക ൿ
+CHILLUS = [('ണ', 'ൺ'), ('ന', 'ൻ'), ('ര', 'ർ'),
+           ('ല', 'ൽ'), ('ള', 'ൾ'), ('ക', 'ൿ')]
+
+
+@pytest.mark.parametrize('consonant, atomic', CHILLUS)
+def test_chillu_sequences_match_atomic_chillus(consonant, atomic):
+    # Word-final chillu, as in അവൻ (avan)
+    assert normalize(AVA + consonant + VIRAMA + ZWJ) == normalize(AVA + atomic) == AVA + atomic
+
+
+def test_virama_without_zwj_is_not_a_chillu():
+    # ന് (n + virama) is a different spelling and stays as typed
+    assert normalize(AVA + 'ന' + VIRAMA) == AVA + 'ന' + VIRAMA
+
+
+@pytest.mark.parametrize('zero_width', [ZWJ, ZWNJ, ZWSP, '⁠', '﻿'])
+def test_zero_width_characters_are_dropped(zero_width):
+    assert normalize(MAZHA[0] + zero_width + MAZHA[1]) == MAZHA
+
+
+def test_decomposed_vowel_signs_match_composed():
+    # കൊ (ko): the o sign U+0D4A is U+0D46 + U+0D3E decomposed
+    assert normalize('കൊ') == normalize('കൊ') == 'കൊ'
+
+
+def test_virama_stays_inside_the_token():
+    # നാട് (naat) is one word; \w alone would split off the virama
+    naat = 'നാട' + VIRAMA
+    assert tokenize(naat + ' ' + KATHA) == [naat, KATHA]
+
+
+def test_compatibility_forms_case_and_accents():
+    assert normalize('Ｂｏｏｋ') == 'book'
+    assert normalize('Café ﬁle') == 'cafe file'
+
+
+def test_search_finds_old_style_chillu_titles_by_atomic_form():
+    index = SearchIndex()
+    avan_old = AVA + 'ന' + VIRAMA + ZWJ
+    avan = AVA + 'ൻ'
+    index.add(Book('B1', f'{avan_old} {KATHA}', 100.0, '', '2024-01-01T00:00:00', 1))
+    index.add(Book('B2', 'River Songs', 100.0, '', '2024-01-01T00:00:00', 1))
+    assert index.search(avan) == (['B1'], 1)
+    assert index.search(AVA) == (['B1'], 1)
+    assert index.search(f'{KATHA} {avan_old}') == (['B1'], 1)
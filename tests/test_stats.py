@@ -0,0 +1,62 @@
+import sqlite3
+import time
+
+import pytest
+
+from storage import SqliteStorage
+
+
+def test_sqlite_stats_and_history_do_not_wait_for_writers(tmp_path):
+    path = str(tmp_path / 'library.db')
+    storage = SqliteStorage(path)
+    storage.append_transaction('T1', [{'name': 'A', 'quantity': 2, 'price': 50}],
+                               'Anil', '2024-01-01T10:00:00', 'admin')
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        started = time.monotonic()
+        assert storage.sales_stats().day('2024-01-01') == (100.0, 2)
+        assert storage.query_transactions()[1] == 1
+        assert storage.search_books('anything')[1] == 0
+        assert time.monotonic() - started < 1
+    finally:
+        writer.execute('ROLLBACK')
+        writer.close()
+    storage.close()
+
+
+def sell(storage, transaction_id, customer, date, *lines):
+    storage.append_transaction(transaction_id, [{'name': name, 'quantity': quantity, 'price': price}
+                                                for name, quantity, price in lines], customer, date, 'admin')
+
+
+def test_rollups_by_day_and_month(storage):
+    sell(storage, 'T1', 'Anil', '2024-01-30T10:00:00', ('A', 2, 50.0), ('B', 1, 30.0))
+    sell(storage, 'T2', 'Anil', '2024-01-30T18:00:00', ('A', 1, 50.0))
+    sell(storage, 'T3', 'Beena', '2024-02-01T09:00:00', ('C', 3, 10.0))
+    stats = storage.sales_stats()
+    assert stats.day('2024-01-30') == (180.0, 4)
+    assert stats.day('2024-01-31') == (0, 0)
+    assert stats.rollup('day') == [
+        {'period': '2024-01-30', 'revenue': 180.0, 'units': 4, 'transactions': 2, 'customers': 1},
+        {'period': '2024-02-01', 'revenue': 30.0, 'units': 3, 'transactions': 1, 'customers': 1}]
+    # Bounds are cut to the period
+    assert stats.rollup('month', start='2024-01-15', end='2024-02-15') == [
+        {'period': '2024-01', 'revenue': 180.0, 'units': 4, 'transactions': 2, 'customers': 1}]
+    assert stats.top_sellers(2) == [{'name': 'A', 'units': 3}, {'name': 'C', 'units': 3}]
+    with pytest.raises(ValueError):
+        stats.rollup('week')
+
+
+def test_rollups_catch_up_with_other_writers(open_storage):
+    reader, writer = open_storage(), open_storage()
+    sell(reader, 'T1', 'Anil', '2024-03-01T10:00:00', ('A', 1, 100.0))
+    assert reader.sales_stats().day('2024-03-01') == (100.0, 1)
+    sell(writer, 'T2', 'Beena', '2024-03-01T11:00:00', ('B', 2, 25.0))
+    stats = reader.sales_stats()
+    assert stats.day('2024-03-01') == (150.0, 3)
+    assert stats.rollup('day')[0]['transactions'] == 2
+    assert stats.rollup('day')[0]['customers'] == 2
+    # Rows already folded in are not counted twice
+    assert reader.sales_stats().day('2024-03-01') == (150.0, 3)
+    assert open_storage().sales_stats().rollup('month') == stats.rollup('month')
@@ -0,0 +1,110 @@
+import multiprocessing
+import threading
+
+import pytest
+
+import transactions
+from migrate_transaction_ids import migrate_csv, migrate_sqlite, split_merged_ids
+from storage import CsvStorage, SqliteStorage
+from transactions import TransactionIdGenerator
+
+
+def test_ids_are_unique_and_increasing_across_threads():
+    generator = TransactionIdGenerator()
+    taken = [[] for _ in range(4)]
+
+    def take(ids):
+        ids.extend(generator.next_id() for _ in range(2000))
+
+    threads = [threading.Thread(target=take, args=(ids,)) for ids in taken]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(ids == sorted(ids) for ids in taken)
+    assert len({transaction_id for ids in taken for transaction_id in ids}) == 8000
+
+
+def test_clock_stepping_back_keeps_ids_increasing(monkeypatch):
+    clock = iter([1700000000.500, 1700000000.200, 1700000000.200, 1700000000.501])
+    monkeypatch.setattr(transactions.time, 'time', lambda: next(clock))
+    generator = TransactionIdGenerator()
+    ids = [generator.next_id() for _ in range(4)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == 4
+    assert [transaction_id[-4:] for transaction_id in ids] == ['0000', '0001', '0002', '0000']
+
+
+def test_full_millisecond_borrows_the_next(monkeypatch):
+    monkeypatch.setattr(transactions.time, 'time', lambda: 1700000000.500)
+    generator = TransactionIdGenerator()
+    ids = [generator.next_id() for _ in range(10001)]
+    assert ids[-1][14:17] == '501' and ids[-1].endswith('-0000')
+    assert ids == sorted(ids)
+
+
+def _ids(queue):
+    queue.put([transactions.new_transaction_id() for _ in range(500)])
+
+
+def test_processes_never_collide():
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    children = [ctx.Process(target=_ids, args=(queue,)) for _ in range(3)]
+    for child in children:
+        child.start()
+    ids = [transaction_id for _ in children for transaction_id in queue.get(timeout=30)]
+    for child in children:
+        child.join(30)
+    ids += [transactions.new_transaction_id() for _ in range(500)]
+    assert len(set(ids)) == 2000
+
+
+def row(transaction_id, date, name, customer='Anil'):
+    return {'transaction_id': transaction_id, 'item_name': name, 'item_quantity': 1, 'item_price': 10.0,
+            'customer_name': customer, 'date': date, 'processed_by': 'admin'}
+
+
+MERGED = [row('20240101120000', '2024-01-01T12:00:00.100', 'A'),
+          row('20240101120000', '2024-01-01T12:00:00.100', 'B'),
+          row('20240101120000', '2024-01-01T12:00:00.700', 'C', 'Beena'),
+          row('20240101120500', '2024-01-01T12:05:00.000', 'D')]
+
+
+def test_split_merged_ids_renames_each_bill_in_log_order():
+    new_ids, split = split_merged_ids(MERGED)
+    assert split == 1
+    assert new_ids == ['20240101120000-01', '20240101120000-01', '20240101120000-02', '20240101120500']
+
+
+def bills(storage):
+    page, _ = storage.query_transactions(sort='date', descending=False)
+    return [(transaction['id'], [item['name'] for item in transaction['items']]) for transaction in page]
+
+
+def backend(tmp_path, kind):
+    """(storage factory, migrate(dry_run)) for one backend in tmp_path"""
+    if kind == 'sqlite':
+        path = str(tmp_path / 'library.db')
+        return lambda: SqliteStorage(path), lambda dry_run=False: migrate_sqlite(path, dry_run)
+    books, log = str(tmp_path / 'books.csv'), str(tmp_path / 'transactions.csv')
+    return lambda: CsvStorage(books, log), lambda dry_run=False: migrate_csv(log, books, dry_run)
+
+
+@pytest.mark.parametrize('kind', ['csv', 'sqlite'])
+def test_migration_splits_stored_bills(tmp_path, kind):
+    open_storage, migrate = backend(tmp_path, kind)
+    storage = open_storage()
+    for transaction_id, date in dict.fromkeys((r['transaction_id'], r['date']) for r in MERGED):
+        rows = [r for r in MERGED if (r['transaction_id'], r['date']) == (transaction_id, date)]
+        storage.append_transaction(transaction_id, [{'name': r['item_name'], 'quantity': 1, 'price': 10.0}
+                                                    for r in rows], rows[0]['customer_name'], date, 'admin')
+    before = bills(storage)
+    assert migrate(dry_run=True) == (1, 3)
+    assert bills(open_storage()) == before
+    assert migrate() == (1, 3)
+    expected = [('20240101120000-01', ['A', 'B']), ('20240101120000-02', ['C']), ('20240101120500', ['D'])]
+    # A running storage catches up, and a fresh one reads the same
+    assert bills(storage) == expected
+    assert bills(open_storage()) == expected
+    assert migrate() == (0, 0)
@@ -0,0 +1,89 @@
+import csv
+import io
+import os
+
+import pytest
+
+from storage import CsvStorage
+from transactions import TRANSACTION_FIELDS, TransactionLog, transaction_rows
+
+
+def bill(log, transaction_id, date, *names):
+    return log.append(transaction_rows(transaction_id, [{'name': name, 'quantity': 1, 'price': 10.0}
+                                                        for name in names], 'Anil', date, 'admin'))
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = TransactionLog(str(tmp_path / 'transactions.csv'))
+    bill(log, 'T1', '2024-01-01T10:00:00', 'A', 'B')
+    # A quoted line break inside a field must not shift the byte ranges
+    bill(log, 'T2', '2024-01-02T10:00:00', 'Two\nlines, "quoted"')
+    bill(log, 'T3', '2024-01-03T10:00:00', 'C')
+    return log
+
+
+def index(log):
+    return log.read_index(0, os.path.getsize(log.index_path))
+
+
+def check(log, ids=('T1', 'T2', 'T3')):
+    entries = index(log)
+    assert [entry['id'] for entry in entries] == list(ids)
+    for entry in entries:
+        assert {row['transaction_id'] for row in log.read(entry['offset'], entry['length'])} == {entry['id']}
+
+
+def test_index_points_at_each_bill(log):
+    check(log)
+    assert log.read(index(log)[1]['offset'], index(log)[1]['length'])[0]['item_name'] == 'Two\nlines, "quoted"'
+
+
+def test_missing_index_is_rebuilt(log):
+    os.remove(log.index_path)
+    log.ensure_index()
+    check(log)
+
+
+def test_torn_index_line_is_rebuilt(log):
+    with open(log.index_path, 'ab') as file:
+        file.write(b'{"id":"T4","offs')
+    log.ensure_index()
+    check(log)
+
+
+def test_rows_written_without_their_index_entry_are_indexed(log):
+    # Crash between the log write and the index write
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, fieldnames=TRANSACTION_FIELDS).writerows(
+        transaction_rows('T4', [{'name': 'D', 'quantity': 1, 'price': 10.0}], 'Anil', '2024-01-04T10:00:00', 'admin'))
+    with open(log.path, 'a', encoding='utf-8', newline='') as file:
+        file.write(buffer.getvalue())
+    log.ensure_index()
+    check(log, ('T1', 'T2', 'T3', 'T4'))
+
+
+def test_index_of_a_replaced_log_is_rebuilt(log, tmp_path):
+    # The log was rewritten behind the app's back (restored from a backup, ...)
+    other = TransactionLog(str(tmp_path / 'other.csv'))
+    bill(other, 'X1', '2023-06-01T10:00:00', 'Z')
+    bill(other, 'X2', '2023-06-02T10:00:00', 'Y', 'W', 'V', 'U')
+    os.replace(other.path, log.path)
+    log.ensure_index()
+    check(log, ('X1', 'X2'))
+
+
+def test_storage_history_follows_a_rebuilt_index(tmp_path):
+    storage = CsvStorage(str(tmp_path / 'books.csv'), str(tmp_path / 'transactions.csv'))
+    bill(storage.transactions, 'T1', '2024-01-01T10:00:00', 'A')
+    assert storage.query_transactions()[1] == 1
+    os.remove(storage.transactions.index_path)
+    storage.append_transaction('T2', [{'name': 'B', 'quantity': 2, 'price': 5.0}], 'Beena',
+                               '2024-01-02T10:00:00', 'admin')
+    page, total = storage.query_transactions()
+    assert total == 2
+    assert [(transaction['id'], transaction['total']) for transaction in page] == [('T2', 10.0), ('T1', 10.0)]
+    assert storage.sales_stats().day('2024-01-02') == (10.0, 2)
+    rows = list(storage.iter_transaction_rows('2024-01-02', '2024-01-03'))
+    assert [row['item_name'] for row in rows] == ['B']
+    storage.close()
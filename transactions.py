@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""Append-only transaction log backed by transactions.csv, with its index and rollups"""
+import bisect
+import csv
+import io
+import json
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from metrics import record_io
+
+TRANSACTION_FIELDS = ['transaction_id', 'item_name', 'item_quantity', 'item_price', 'customer_name', 'date', 'processed_by']
+
+
+class TransactionIdGenerator:
+    """Unique, time-ordered transaction IDs.
+
+    IDs look like 20240101123045123-00a1b2-0007: local time to the
+    millisecond, the process ID in hex and a sequence number within the
+    millisecond. Workers and tills never collide, string order is time
+    order, and a clock stepping backwards does not break monotonicity (the
+    last millisecond is reused). Past 10000 IDs in one millisecond the
+    next millisecond is borrowed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._seq = 0
+
+    def next_id(self):
+        with self._lock:
+            ms = int(time.time() * 1000)
+            if ms <= self._last_ms:
+                ms = self._last_ms
+                self._seq += 1
+                if self._seq > 9999:
+                    ms += 1
+                    self._seq = 0
+            else:
+                self._seq = 0
+            self._last_ms = ms
+            seq = self._seq
+        stamp = datetime.fromtimestamp(ms / 1000).strftime('%Y%m%d%H%M%S')
+        return f"{stamp}{ms % 1000:03d}-{os.getpid():06x}-{seq:04d}"
+
+
+_transaction_ids = TransactionIdGenerator()
+
+
+def new_transaction_id():
+    """Next ID from the process-wide TransactionIdGenerator"""
+    return _transaction_ids.next_id()
+
+
+def transaction_rows(transaction_id, items, customer_name, date, processed_by):
+    """Flatten one bill into transactions.csv-shaped row dicts"""
+    return [{
+        'transaction_id': transaction_id,
+        'item_name': item.get('name', 'Unknown'),
+        'item_quantity': item.get('quantity', 1),
+        'item_price': item.get('price', 0),
+        'customer_name': customer_name,
+        'date': date,
+        'processed_by': processed_by
+    } for item in items]
+
+
+def transaction_summary(rows, offset=None, length=None):
+    """Index entry for one transaction: totals, units per title and where its rows are stored"""
+    first = rows[0]
+    total = 0
+    units = 0
+    titles = {}
+    for row in rows:
+        quantity = int(row['item_quantity'])
+        total += float(row['item_price']) * quantity
+        units += quantity
+        titles[row['item_name']] = titles.get(row['item_name'], 0) + quantity
+    return {
+        'id': first['transaction_id'],
+        'customer_name': first['customer_name'],
+        'date': first['date'],
+        'processed_by': first['processed_by'],
+        'total': total,
+        'units': units,
+        'titles': titles,
+        'offset': offset,
+        'length': length
+    }
+
+
+def _parse_records(lines):
+    """Join CSV byte lines into (record bytes, field list), keeping quoted line breaks in their record"""
+    record = b''
+    for line in lines:
+        record += line
+        if record.count(b'"') % 2:
+            continue
+        if record.strip():
+            text = record.decode('utf-8')
+            if '"' in text:
+                fields = next(csv.reader([text]))
+            else:
+                fields = text.rstrip('\r\n').split(',')
+            yield record, fields
+        else:
+            yield record, None
+        record = b''
+
+
+def _lines_until(file, limit):
+    """Lines of a binary file until limit bytes have been read"""
+    for line in file:
+        if limit <= 0:
+            break
+        limit -= len(line)
+        yield line
+
+
+class TransactionLog:
+    """Flattened transaction history - one CSV row per billed item.
+
+    A sidecar index (transactions.csv.idx, one JSON line per transaction)
+    records each transaction's totals and the byte range of its rows, so
+    readers load summaries instead of parsing the log and fetch item rows
+    only for the transactions they show. The index is appended together
+    with the log and rebuilt from it when missing or out of step.
+    Callers serialize appends across processes (CsvStorage holds its lock).
+    """
+
+    def __init__(self, path='transactions.csv', index_path=None):
+        self.path = path
+        self.index_path = index_path or path + '.idx'
+        self._lock = threading.RLock()
+
+    def ensure_file(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            with open(self.path, 'w', newline='', encoding='utf-8') as file:
+                csv.writer(file).writerow(TRANSACTION_FIELDS)
+
+    def append(self, rows):
+        """Append all rows of one transaction with a single write; returns its index entry"""
+        if not rows:
+            return None
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=TRANSACTION_FIELDS)
+        writer.writerows(rows)
+        data = buffer.getvalue().encode('utf-8')
+        with self._lock:
+            self.ensure_file()
+            self.ensure_index()
+            with open(self.path, 'ab') as file:
+                offset = file.seek(0, os.SEEK_END)
+                file.write(data)
+                file.flush()
+            record_io(self.path, 'write', len(data))
+            summary = transaction_summary(rows, offset, len(data))
+            entry = self._entry(summary)
+            with open(self.index_path, 'ab') as file:
+                file.write(entry)
+            record_io(self.index_path, 'write', len(entry))
+        return summary
+
+    @staticmethod
+    def _entry(summary):
+        return (json.dumps(summary, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+    def iter_rows(self, start=None, end=None):
+        """Stream rows (dicts) stored from byte start (None: after the header) up to byte end"""
+        with open(self.path, 'rb') as file:
+            if start is None:
+                file.readline()
+            else:
+                file.seek(start)
+            started = file.tell()
+            lines = file if end is None else _lines_until(file, end - started)
+            try:
+                for _, fields in _parse_records(lines):
+                    if fields:
+                        yield dict(zip(TRANSACTION_FIELDS, fields))
+            finally:
+                record_io(self.path, 'read', file.tell() - started)
+
+    def read(self, offset, length):
+        """Rows (dicts) stored in one byte range of the log"""
+        return list(self.iter_rows(offset, offset + length))
+
+    def scan(self, start=None):
+        """Yield an index entry per transaction stored from byte start on (None: after the header).
+
+        Rows of one transaction are contiguous, so a change of ID or date
+        starts the next one.
+        """
+        group = None
+        group_offset = group_length = 0
+        with open(self.path, 'rb') as file:
+            if start is None:
+                start = len(file.readline())
+            file.seek(start)
+            offset = start
+            for record, fields in _parse_records(file):
+                row = dict(zip(TRANSACTION_FIELDS, fields)) if fields else None
+                if row and group and ((row['transaction_id'], row['date'])
+                                      == (group[0]['transaction_id'], group[0]['date'])):
+                    group.append(row)
+                    group_length += len(record)
+                elif row:
+                    if group:
+                        yield transaction_summary(group, group_offset, group_length)
+                    group, group_offset, group_length = [row], offset, len(record)
+                offset += len(record)
+        record_io(self.path, 'read', offset - start)
+        if group:
+            yield transaction_summary(group, group_offset, group_length)
+
+    def _last_entry(self):
+        """Last index entry, or None if the index is empty"""
+        with open(self.index_path, 'rb') as file:
+            size = file.seek(0, os.SEEK_END)
+            chunk = 4096
+            while True:
+                file.seek(max(0, size - chunk))
+                lines = file.read().splitlines()
+                # Need the whole last line: keep reading back until another line precedes it
+                if len(lines) > 1 or chunk >= size:
+                    break
+                chunk *= 4
+        return json.loads(lines[-1]) if lines else None
+
+    def _entry_matches(self, entry, log_size):
+        """Whether the log still holds this transaction where the index says"""
+        if entry['offset'] + entry['length'] > log_size:
+            return False
+        rows = self.read(entry['offset'], entry['length'])
+        return bool(rows) and rows[0]['transaction_id'] == entry['id'] and rows[0]['date'] == entry['date']
+
+    def rebuild_index(self):
+        """Rewrite the index from the whole log"""
+        tmp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            for summary in self.scan():
+                file.write(self._entry(summary))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.index_path)
+
+    def ensure_index(self):
+        """Make the index cover the whole log: rebuild it if it is missing or
+        no longer matches, index rows appended without it (e.g. a crash
+        between the two writes)."""
+        with self._lock:
+            self.ensure_file()
+            log_size = os.path.getsize(self.path)
+            if not os.path.exists(self.index_path):
+                self.rebuild_index()
+                return
+            try:
+                last = self._last_entry()
+            except ValueError:
+                # Torn last line
+                self.rebuild_index()
+                return
+            if last is None:
+                with open(self.path, 'rb') as file:
+                    covered = len(file.readline())
+            elif self._entry_matches(last, log_size):
+                covered = last['offset'] + last['length']
+            else:
+                self.rebuild_index()
+                return
+            if covered < log_size:
+                with open(self.index_path, 'ab') as file:
+                    for summary in self.scan(covered):
+                        file.write(self._entry(summary))
+
+    def read_index(self, start, end):
+        """Index entries stored between two byte offsets of the index file"""
+        if start >= end:
+            return []
+        with open(self.index_path, 'rb') as file:
+            file.seek(start)
+            data = file.read(end - start)
+        record_io(self.index_path, 'read', len(data))
+        lines = [line for line in data.splitlines() if line.strip()]
+        # One decode for the whole batch is much faster than one per line
+        return json.loads(b'[' + b','.join(lines) + b']')
+
+
+TRANSACTION_SORT_KEYS = ('date', 'total', 'customer_name')
+
+
+class TransactionIndex:
+    """Transaction summaries (see transaction_summary) kept in date order.
+
+    Built once from the index file and extended on every append, so history
+    pages are answered with a bisect on the date range instead of
+    re-parsing and re-sorting the whole log; item rows are read afterwards
+    for the page only.
+    """
+
+    def __init__(self):
+        self._ordered = []
+        self._dates = []
+        self._lock = threading.Lock()
+
+    def add_summary(self, summary):
+        with self._lock:
+            # Transactions are appended in time order, so this is almost always an append
+            position = bisect.bisect_right(self._dates, summary['date'])
+            self._dates.insert(position, summary['date'])
+            self._ordered.insert(position, summary)
+
+    def _bounds(self, start, end):
+        low = bisect.bisect_left(self._dates, start) if start else 0
+        high = bisect.bisect_left(self._dates, end) if end else len(self._dates)
+        return low, max(low, high)
+
+    def byte_range(self, start=None, end=None):
+        """(first offset, end offset) of the log rows dated in [start, end), or None"""
+        with self._lock:
+            low, high = self._bounds(start, end)
+            selected = self._ordered[low:high]
+        if not selected:
+            return None
+        return (min(summary['offset'] for summary in selected),
+                max(summary['offset'] + summary['length'] for summary in selected))
+
+    def query(self, start=None, end=None, prefix=None, sort='date', descending=True, offset=0, limit=None):
+        """Return (page of transaction summaries, total matches).
+
+        start/end bound the date (end exclusive); prefix matches the start of
+        the customer name (case-insensitive) or transaction ID.
+        """
+        if sort not in TRANSACTION_SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        with self._lock:
+            low, high = self._bounds(start, end)
+            if not prefix and sort == 'date':
+                total = high - low
+                stop = total if limit is None else min(total, offset + limit)
+                positions = range(offset, stop)
+                if descending:
+                    return [self._ordered[high - 1 - position] for position in positions], total
+                return [self._ordered[low + position] for position in positions], total
+            selected = self._ordered[low:high]
+
+        if prefix:
+            key = prefix.casefold()
+            selected = [transaction for transaction in selected
+                        if transaction['customer_name'].casefold().startswith(key)
+                        or transaction['id'].startswith(prefix)]
+        if sort == 'customer_name':
+            selected.sort(key=lambda transaction: transaction['customer_name'].casefold(), reverse=descending)
+        else:
+            selected.sort(key=lambda transaction: transaction[sort], reverse=descending)
+        total = len(selected)
+        stop = total if limit is None else offset + limit
+        return selected[offset:stop], total
+
+
+ROLLUP_PERIODS = {'day': 10, 'month': 7}
+
+
+class SalesStats:
+    """Running sales rollups fed from transaction rows or summaries.
+
+    Revenue, units, transaction count and distinct customers are bucketed
+    per day (YYYY-MM-DD) and per month (YYYY-MM), units per title, so
+    dashboard figures and reports never require rescanning the log.
+    """
+
+    def __init__(self):
+        self.units_by_title = Counter()
+        self._buckets = {period: {} for period in ROLLUP_PERIODS}
+        self._keys = {period: [] for period in ROLLUP_PERIODS}
+        self._last_transaction = None
+        self._lock = threading.Lock()
+
+    def _add(self, date, customer_name, revenue, units, new_transaction):
+        for period, width in ROLLUP_PERIODS.items():
+            key = date[:width]
+            bucket = self._buckets[period].get(key)
+            if bucket is None:
+                bucket = self._buckets[period][key] = {'revenue': 0, 'units': 0, 'transactions': 0,
+                                                       'customers': set()}
+                bisect.insort(self._keys[period], key)
+            bucket['revenue'] += revenue
+            bucket['units'] += units
+            bucket['transactions'] += new_transaction
+            bucket['customers'].add(customer_name)
+
+    def add_row(self, row):
+        quantity = int(row['item_quantity'])
+        revenue = float(row['item_price']) * quantity
+        with self._lock:
+            # Rows of one transaction arrive together
+            transaction = (row['transaction_id'], row['date'])
+            new_transaction = transaction != self._last_transaction
+            self._last_transaction = transaction
+            self._add(row['date'], row['customer_name'], revenue, quantity, new_transaction)
+            self.units_by_title[row['item_name']] += quantity
+
+    def add_summary(self, summary):
+        with self._lock:
+            self._add(summary['date'], summary['customer_name'], summary['total'], summary['units'], True)
+            for title, units in summary['titles'].items():
+                self.units_by_title[title] += units
+
+    def day(self, day):
+        """Return (revenue, units) for one YYYY-MM-DD day"""
+        with self._lock:
+            bucket = self._buckets['day'].get(day)
+            return (bucket['revenue'], bucket['units']) if bucket else (0, 0)
+
+    def rollup(self, period='day', start=None, end=None):
+        """Buckets of one period ('day' or 'month') from start to end (exclusive), oldest first.
+
+        start/end are dates; they are cut to the period, so a month report
+        from 2024-01-15 starts with January.
+        """
+        width = ROLLUP_PERIODS.get(period)
+        if width is None:
+            raise ValueError(f"Unknown period: {period}")
+        with self._lock:
+            keys = self._keys[period]
+            low = bisect.bisect_left(keys, start[:width]) if start else 0
+            high = bisect.bisect_left(keys, end[:width]) if end else len(keys)
+            buckets = self._buckets[period]
+            return [{
+                'period': key,
+                'revenue': buckets[key]['revenue'],
+                'units': buckets[key]['units'],
+                'transactions': buckets[key]['transactions'],
+                'customers': len(buckets[key]['customers'])
+            } for key in keys[low:high]]
+
+    def top_sellers(self, n=5):
+        with self._lock:
+            return [{'name': name, 'units': units} for name, units in self.units_by_title.most_common(n)]